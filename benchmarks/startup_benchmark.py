@@ -0,0 +1,83 @@
+# benchmarks/startup_benchmark.py
+"""
+Measures worker cold start: importing router and constructing a Router, each in
+a fresh interpreter, plus which heavy dependencies were loaded by then.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --profile   # slowest imports (python -X importtime)
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Modules that should only load once the agent needing them is first used
+HEAVY_MODULES = ["openai", "chromadb", "pandas", "pandas_gbq", "google.auth", "google.cloud.bigquery", "IPython"]
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import router
+imported = time.perf_counter()
+r = router.Router("key", "https://example.invalid", "2024-02-01", "embed", None, None,
+                  "key", "https://example.invalid", "2024-02-01", "gpt")
+constructed = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "construct_s": constructed - imported,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_probe():
+    # The agents resolve paths like ../output relative to src/
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=SRC_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def profile_imports(top):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import router"],
+        cwd=SRC_DIR, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:   self | cumulative | module"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--profile", action="store_true", help="show the slowest imports instead")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile_imports(args.top)
+        return
+
+    results = [run_probe() for _ in range(args.runs)]
+    for key in ("import_s", "construct_s"):
+        values = [r[key] for r in results]
+        print(f"{key:12} median {statistics.median(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    total = [r["import_s"] + r["construct_s"] for r in results]
+    print(f"{'cold start':12} median {statistics.median(total) * 1000:8.1f} ms")
+    print(f"heavy modules loaded at startup: {', '.join(results[-1]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/vector_store_benchmark.py
+"""
+Compares the KnowledgeAgent vector backends (vector_store.py) on synthetic,
+clustered unit vectors: build time, recall@k against exact search, queries
+per second (one query per call, as KnowledgeAgent issues them, and batched),
+and memory. Each backend runs in a fresh interpreter so resident memory
+growth is attributable to it.
+
+    python benchmarks/vector_store_benchmark.py --docs 2000 --dim 1536
+    python benchmarks/vector_store_benchmark.py --docs 100000 --backends numpy ivf
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+PROBE = """
+import gc, sys, json, time, resource
+import numpy as np
+from similarity import normalize_rows, cosine_top_k
+from vector_store import create_vector_store
+
+args = json.loads(sys.argv[1])
+rng = np.random.default_rng(0)
+centers = normalize_rows(rng.standard_normal((max(args["docs"] // 50, 1), args["dim"])))
+def sample(n):
+    rows = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.standard_normal((n, args["dim"])) / np.sqrt(args["dim"])
+    return normalize_rows(rows)
+corpus, queries = sample(args["docs"]), sample(args["queries"])
+ids = [f"doc_{i}" for i in range(args["docs"])]
+documents = [f"document {i}" for i in range(args["docs"])]
+truth = cosine_top_k(corpus, queries, args["k"])[0]
+gc.collect()
+
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+before = rss()
+started = time.perf_counter()
+store = create_vector_store(args["backend"], "bench", **args["options"])
+batch = 1000 if args["backend"] == "chroma" else len(ids)
+for start in range(0, len(ids), batch):
+    store.add(ids[start:start + batch], documents[start:start + batch], corpus[start:start + batch])
+store.query(queries[0], n_results=args["k"])  # consolidate / train before timing
+build = time.perf_counter() - started
+
+started = time.perf_counter()
+found = [store.query(q, n_results=args["k"])["ids"][0] for q in queries]
+single = time.perf_counter() - started
+started = time.perf_counter()
+store.query(queries, n_results=args["k"])
+batched = time.perf_counter() - started
+
+positions = {doc_id: i for i, doc_id in enumerate(ids)}
+recall = np.mean([
+    len({positions[d] for d in row} & set(expected.tolist())) / len(expected)
+    for row, expected in zip(found, truth)
+])
+print(json.dumps({
+    "backend": args["backend"],
+    "build_s": build,
+    "recall": float(recall),
+    "qps": len(queries) / single,
+    "batched_qps": len(queries) / batched,
+    "memory_mb": (rss() - before) / 2**20,
+}))
+"""
+
+
+def run_backend(backend, args):
+    options = {"n_probe": args.n_probe, "min_train_size": 0} if backend == "ivf" else {}
+    payload = json.dumps({
+        "backend": backend, "docs": args.docs, "dim": args.dim, "queries": args.queries,
+        "k": args.k, "options": options,
+    })
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, payload], cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        return {"backend": backend, "error": completed.stderr.strip().splitlines()[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--backends", nargs="+", default=["numpy", "ivf", "chroma"])
+    args = parser.parse_args()
+
+    print(f"{args.docs} docs x {args.dim} dims, {args.queries} queries, k={args.k}")
+    print(f"{'backend':8} {'build s':>9} {'recall@k':>9} {'QPS':>10} {'batched QPS':>12} {'memory MB':>10}")
+    for backend in args.backends:
+        r = run_backend(backend, args)
+        if "error" in r:
+            print(f"{backend:8} failed: {r['error']}")
+            continue
+        print(
+            f"{backend:8} {r['build_s']:9.2f} {r['recall']:9.3f} {r['qps']:10.0f} "
+            f"{r['batched_qps']:12.0f} {r['memory_mb']:10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
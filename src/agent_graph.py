@@ -0,0 +1,118 @@
+# module/agent_graph.py
+import asyncio
+from async_bridge import run_sync
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# Declared data flow of each agent. An agent depends on every earlier agent in
+# the plan that produces one of its inputs; agents without a path between them
+# run concurrently.
+AGENT_IO = {
+    "knowledge_agent": {"inputs": (), "outputs": ("conversation", "knowledge")},
+    "sql_agent": {"inputs": (), "outputs": ("conversation", "sql_query", "query_result")},
+    "chart_agent": {"inputs": ("query_result",), "outputs": ("chart",)},
+    "summary_agent": {"inputs": ("conversation",), "outputs": ("conversation", "summary")},
+    "analysis_agent": {"inputs": ("conversation",), "outputs": ()},
+    "follow_up_agent": {"inputs": ("conversation",), "outputs": ()},
+}
+
+
+class AgentGraph:
+    """
+    Dependency graph over a router plan (a list of {"Agent": ..., "args": ...} calls).
+    """
+
+    def __init__(self, agent_calls, agent_io=None):
+        self.agent_calls = list(agent_calls)
+        self.agent_io = agent_io or AGENT_IO
+        self.dependencies = self._build_dependencies()
+
+    def io_for(self, index):
+        agent = (self.agent_calls[index] or {}).get("Agent")
+        return self.agent_io.get(agent, {"inputs": (), "outputs": ()})
+
+    def _build_dependencies(self):
+        dependencies = {}
+        for i in range(len(self.agent_calls)):
+            inputs = set(self.io_for(i)["inputs"])
+            dependencies[i] = {
+                j for j in range(i) if inputs & set(self.io_for(j)["outputs"])
+            }
+        return dependencies
+
+    def collect_inputs(self, index, outputs):
+        """
+        Gather the values a node consumes, as {name: [values in plan order]}.
+        """
+        inputs = {}
+        for name in self.io_for(index)["inputs"]:
+            inputs[name] = [
+                outputs[j][name]
+                for j in sorted(self.dependencies[index])
+                if name in (outputs.get(j) or {})
+            ]
+        return inputs
+
+    def _ready(self, remaining, outputs):
+        ready = sorted(i for i in remaining if self.dependencies[i] <= outputs.keys())
+        for i in ready:
+            remaining.discard(i)
+        return ready
+
+    def run(self, run_node, max_workers=4):
+        """
+        Execute the plan, running independent nodes concurrently in up to
+        max_workers threads. run_node(agent_call, inputs) must return a dict of
+        outputs. Returns the list of outputs in plan order.
+        """
+
+        async def run_in_thread(agent_call, inputs):
+            # to_thread runs the node in a copy of the caller's context, so tracing spans nest per request
+            return await asyncio.to_thread(run_node, agent_call, inputs)
+
+        return run_sync(self.arun(run_in_thread, max_concurrency=max_workers))
+
+    async def arun(self, run_node, max_concurrency=None):
+        """
+        Execute the plan, awaiting independent nodes concurrently on the event loop
+        (at most max_concurrency at a time, if given). run_node(agent_call, inputs)
+        must be a coroutine function returning a dict of outputs.
+        Returns the list of outputs in plan order. Cancelling arun cancels the
+        nodes in flight and waits for them to finish.
+        """
+        outputs = {}
+        remaining = set(range(len(self.agent_calls)))
+        in_flight = {}
+        slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        async def run_slot(agent_call, inputs):
+            async with slots:
+                return await run_node(agent_call, inputs)
+
+        try:
+            while remaining or in_flight:
+                for i in self._ready(remaining, outputs):
+                    inputs = self.collect_inputs(i, outputs)
+                    node = run_slot if slots is not None else run_node
+                    task = asyncio.ensure_future(node(self.agent_calls[i], inputs))
+                    in_flight[task] = i
+
+                finished, _ = await asyncio.wait(list(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    i = in_flight.pop(task)
+                    try:
+                        outputs[i] = task.result() or {}
+                    except Exception as e:
+                        logger.error(f"Agent call {i} failed: {e}")
+                        outputs[i] = {}
+        finally:
+            # Cancelled (e.g. the client disconnected): stop the agents still
+            # running rather than let them spend quota on an unwanted answer
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+        return [outputs[i] for i in range(len(self.agent_calls))]
@@ -4,8 +4,9 @@ import os
 import json
 import warnings
 import pandas as pd
-from openai import AzureOpenAI
-from IPython.display import display, Markdown
+from llm_manager import pooled_client
+from async_bridge import run_sync
+from rate_limiter import get_rate_limiter, estimate_chat_tokens, usage_tokens
 
 warnings.filterwarnings("ignore")
 
@@ -16,11 +17,9 @@ class AnalysisAgent:
         self.api_version = api_version
         self.gpt_deployment = gpt_deployment
         self.temperature = temperature
-        self.client = AzureOpenAI(
-            api_version=self.api_version,
-            azure_endpoint=self.api_base,
-            api_key=self.api_key
-        )
+
+    client = pooled_client()
+    async_client = pooled_client(asynchronous=True)
 
     def parse_sql_result(self, json_data):
         """Convert JSON SQL result into a DataFrame."""
@@ -30,8 +29,8 @@ class AnalysisAgent:
             df[col] = pd.to_numeric(df[col], errors='ignore')
         return df
 
-    def dynamic_analysis_prompt(self, business_question=None, inputs=None):
-        """Generate the dynamic prompt for analysis based on available inputs."""
+    def build_messages(self, business_question=None, inputs=None):
+        """Build the chat messages for analysis based on available inputs."""
         inputs = inputs or {}
 
         sql_content = f"""
@@ -52,33 +51,43 @@ class AnalysisAgent:
         Final Visualization JSON:
         {json.dumps(inputs.get('visualization_json'), indent=4)}""" if inputs.get('visualization_type') and inputs.get('visualization_json') else ""
 
-        # Create and send prompt to the API
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a data analyst specializing in generating concise business insights and summaries from data query results, \
-                                validating knowledge-based answers, or integrating visual data representations where applicable. \
-                                Use any provided SQL, visualization, or knowledge data to generate insights or clarify answers."
-                },
-                {
-                    "role": "user",
-                    "content": f"""Here is the information you need to generate insights:
+        return [
+            {
+                "role": "system",
+                "content": "You are a data analyst specializing in generating concise business insights and summaries from data query results, \
+                            validating knowledge-based answers, or integrating visual data representations where applicable. \
+                            Use any provided SQL, visualization, or knowledge data to generate insights or clarify answers."
+            },
+            {
+                "role": "user",
+                "content": f"""Here is the information you need to generate insights:
 
-                                Business Question:
-                                {business_question}
+                            Business Question:
+                            {business_question}
 
-                                {sql_content}
+                            {sql_content}
 
-                                {knowledge_content}
+                            {knowledge_content}
 
-                                {vega_content}
+                            {vega_content}
+
+                            Please provide a concise summary of the top findings, limited to 4-5 sentences. Ensure any knowledge answers are validated and clarified, \
+                            and integrate visualization insights if relevant. Avoid unnecessary details."""
+            }
+        ]
+
+    def dynamic_analysis_prompt(self, business_question=None, inputs=None):
+        """Generate the dynamic prompt for analysis based on available inputs."""
+        return run_sync(self.adynamic_analysis_prompt(business_question, inputs))
 
-                                Please provide a concise summary of the top findings, limited to 4-5 sentences. Ensure any knowledge answers are validated and clarified, \
-                                and integrate visualization insights if relevant. Avoid unnecessary details."""
-                }
-            ],
+    async def adynamic_analysis_prompt(self, business_question=None, inputs=None):
+        """Async implementation of dynamic_analysis_prompt."""
+        request = dict(
+            messages=self.build_messages(business_question, inputs),
             model=self.gpt_deployment,
             temperature=self.temperature
         )
+        async with get_rate_limiter().areserve(self.gpt_deployment, estimate_chat_tokens(request)) as quota:
+            response = await self.async_client.chat.completions.create(**request)
+            quota.settle(usage_tokens(response))
         return response.choices[0].message.content
@@ -0,0 +1,77 @@
+# module/async_bridge.py
+import queue
+import asyncio
+import threading
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# The sync API is a thin layer over the async one: each sync entry point runs
+# its coroutine on one long-lived event loop in a background thread, so sync
+# callers share that loop's pooled connections instead of starting a new loop
+# (and pool) per call.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_bridge_loop():
+    """The event loop sync entry points run on, started on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-bridge", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def _submit(coro):
+    loop = get_bridge_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("A sync API was called from async code on the bridge loop; await its async counterpart instead")
+    # The task starts in a copy of the caller's context, so tracing spans nest as usual
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from sync code and return its result."""
+    future = _submit(coro)
+    try:
+        return future.result()
+    except BaseException:
+        # e.g. KeyboardInterrupt while waiting: stop the work too
+        future.cancel()
+        raise
+
+
+def iterate_sync(aiterable):
+    """Iterate an async iterable from sync code. Closing the generator early cancels it."""
+    items = queue.Queue()
+    finished = object()
+
+    async def pump():
+        try:
+            async for item in aiterable:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((finished, e))
+            raise
+        items.put((finished, None))
+
+    future = _submit(pump())
+    try:
+        while True:
+            item, error = items.get()
+            if item is finished:
+                if error is not None and not isinstance(error, asyncio.CancelledError):
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,25 @@
+# module/atomic_write.py
+import os
+import json
+import tempfile
+
+
+def write_json_atomic(path, data):
+    """
+    Write data to path as JSON. The JSON goes to a uniquely named temporary
+    file in the same directory, which then replaces path in one step. Readers
+    see either the old file or the new one, and concurrent writers never share
+    a temporary file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False
+    ) as f:
+        try:
+            json.dump(data, f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
@@ -1,18 +1,46 @@
 # module/base_agent.py
-from openai import AzureOpenAI
-from IPython.display import display, Markdown
+import time
 from logging_config import setup_logger
+from llm_cache import get_default_cache, make_cache_key
+from llm_manager import pooled_client
+from telemetry import span, counter, histogram, get_tracer, record_llm_usage
+from token_counter import count_tokens
+from rate_limiter import get_rate_limiter, estimate_chat_tokens, usage_tokens, PRIORITY_DEFAULT
+from single_flight import single_flight
+from async_bridge import run_sync, iterate_sync
 
 # Set up the logger for this module
 logger = setup_logger(__name__)
 
 logger.info("This is an info log from the current module.")
 
+llm_requests = counter("llm_requests_total", "LLM completions requested, by cache outcome")
+time_to_first_token = histogram(
+    "llm_time_to_first_token_seconds", "Delay before the first streamed token arrives"
+)
+llm_flight = single_flight("llm")
+
+
+def display_markdown(text):
+    """Render Markdown in a notebook; IPython is only imported when something is shown."""
+    from IPython.display import display, Markdown
+
+    display(Markdown(text))
+
 
 class SuperAgent:
-    def __init__(self, name, api_key, api_base, api_version, gpt_deployment):
+    # Agents whose responses must never be reused can set this to False.
+    use_cache = True
+    # Identical requests already in flight are shared rather than sent again
+    # (only for agents whose responses may be reused, i.e. use_cache).
+    use_single_flight = True
+    # Queue position when the deployment is at its quota (see rate_limiter)
+    priority = PRIORITY_DEFAULT
+
+    def __init__(self, name, api_key, api_base, api_version, gpt_deployment, cache=None):
         """
         Initialize the SuperAgent with configuration details.
+        If no cache is given, the shared default response cache is used.
         """
         # Store configuration details with optional default values
         self.api_key = api_key or "default_api_key"
@@ -20,70 +48,198 @@ class SuperAgent:
         self.api_version = api_version or "default_api_version"
         self.gpt_deployment = gpt_deployment or "default_deployment"
         self.name = name or "default_name"
+        self.cache = cache
 
-        # Initialize the AzureOpenAI client if API details are provided
-        if self.api_key and self.api_base:
-            self.client = AzureOpenAI(
-                api_version=self.api_version,
-                azure_endpoint=self.api_base,
-                api_key=self.api_key,
-            )
-        else:
-            self.client = None
+        # The shared, pooled AzureOpenAI clients are looked up on each call (pooled_client)
+        if not (self.api_key and self.api_base):
             print(
                 "\nWarning: API client is not initialized. Check your configurations."
             )
-            display(Markdown("**Warning:** API client is not initialized."))
+            display_markdown("**Warning:** API client is not initialized.")
 
-    def call_gpt(self, user_prompt, system_prompt, functions=None):
-        """
-        Call the GPT model with the provided user and system prompts.
-        """
-        # notes_prompt = None
-        # lookup if there are any notes in a rag database (would be a string)
-        # Rag/vector similarity
-        # implement a notes agent that returns only relevant notes
-        # update notes_prompt
+    client = pooled_client()
+    async_client = pooled_client(asynchronous=True)
+
+    def get_cache(self):
+        """Return the response cache for this agent, or None if caching is off."""
+        if not self.use_cache:
+            return None
+        return self.cache if self.cache is not None else get_default_cache()
 
-        if not self.client:
+    def _require_client(self, client):
+        if not client:
             error_message = (
                 "API client is not initialized. Please provide valid API details."
             )
             print(error_message)
-            display(Markdown(f"**Error:** {error_message}"))
+            display_markdown(f"**Error:** {error_message}")
             raise ValueError(error_message)
 
+    def _lookup_cache(self, user_prompt, system_prompt, functions):
+        """Return (cache, cache_key, cached_response) for a request."""
+        cache = self.get_cache()
+        if cache is None:
+            return None, None, None
+
+        cache_key = make_cache_key(
+            self.gpt_deployment,
+            system_prompt,
+            user_prompt,
+            functions,
+            temperature=0,
+            seed=42,
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"{self.name}: response cache hit.")
+        return cache, cache_key, cached
+
+    def _completion_kwargs(self, user_prompt, system_prompt, functions):
         messages = [
             # {"role": "system", "content": system_prompt + notes_prompt},
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
+        kwargs = {
+            "messages": messages,
+            "model": self.gpt_deployment,
+            "temperature": 0,
+            "seed": 42,  # Seed for reproducibility
+        }
+        if functions:
+            kwargs["functions"] = functions
+        return kwargs
 
-        try:
-            if functions:
-                chat_completion = self.client.chat.completions.create(
-                    messages=messages,
-                    model=self.gpt_deployment,
-                    temperature=0,
-                    seed=42,  # Seed for reproducibility
-                    functions=functions,
-                )
-
-                # Return whole chate_completion object, as several parts will need to parsed.
-                return chat_completion
-
-            else:
-                chat_completion = self.client.chat.completions.create(
-                    messages=messages,
-                    model=self.gpt_deployment,
-                    temperature=0,
-                    seed=42,  # Seed for reproducibility
-                )
-                response = chat_completion.choices[0].message.content
+    def _handle_completion(self, chat_completion, functions, cache, cache_key):
+        if functions:
+            # Return whole chate_completion object, as several parts will need to parsed.
+            response = chat_completion
+        else:
+            response = chat_completion.choices[0].message.content
+
+        if cache is not None and response:
+            cache.set(cache_key, response)
+        return response
+
+    def _count_request(self, active_span, cached):
+        outcome = "hit" if cached is not None else "miss"
+        active_span.set(cache=outcome)
+        llm_requests.inc(agent=self.name, model=self.gpt_deployment, cache=outcome)
+
+    def _areserve(self, request, priority=None):
+        """Wait for quota for a chat request on this agent's deployment."""
+        return get_rate_limiter().areserve(
+            self.gpt_deployment, estimate_chat_tokens(request), self.priority if priority is None else priority
+        )
+
+    def _coalesce_key(self, cache_key):
+        """Key for sharing an in-flight request, or None if this call must run on its own."""
+        return cache_key if self.use_single_flight else None
+
+    def _report_error(self, e):
+        error_message = f"Error while calling GPT: {e}"
+        print(error_message)
+        display_markdown(f"**Error:** {error_message}")
+
+    def call_gpt(self, user_prompt, system_prompt, functions=None, priority=None):
+        """
+        Call the GPT model with the provided user and system prompts.
+        The call waits for the deployment's quota, queued by priority
+        (default: the agent's priority). Sync wrapper over acall_gpt.
+        """
+        # notes_prompt = None
+        # lookup if there are any notes in a rag database (would be a string)
+        # Rag/vector similarity
+        # implement a notes agent that returns only relevant notes
+        # update notes_prompt
+
+        return run_sync(self.acall_gpt(user_prompt, system_prompt, functions, priority))
+
+    async def acall_gpt(self, user_prompt, system_prompt, functions=None, priority=None):
+        """
+        Call the GPT model through AsyncAzureOpenAI; see call_gpt.
+        """
+        self._require_client(self.async_client)
+
+        with span("llm.call", agent=self.name, model=self.gpt_deployment) as s:
+            cache, cache_key, cached = self._lookup_cache(user_prompt, system_prompt, functions)
+            self._count_request(s, cached)
+            if cached is not None:
+                return cached
+
+            request = self._completion_kwargs(user_prompt, system_prompt, functions)
+
+            async def complete():
+                async with self._areserve(request, priority) as quota:
+                    chat_completion = await self.async_client.chat.completions.create(**request)
+                    quota.settle(usage_tokens(chat_completion))
+                record_llm_usage(s, chat_completion, agent=self.name, model=self.gpt_deployment)
+                return self._handle_completion(chat_completion, functions, cache, cache_key)
+
+            try:
+                key = self._coalesce_key(cache_key)
+                if key is None:
+                    return await complete()
+                response, shared = await llm_flight.ado(key, complete)
+                s.set(coalesced=shared)
                 return response
 
+            except Exception as e:
+                self._report_error(e)
+                raise
+
+    def _stream_started(self, cached):
+        """Common setup for stream_gpt/astream_gpt; returns the span attributes to record."""
+        outcome = "hit" if cached is not None else "miss"
+        llm_requests.inc(agent=self.name, model=self.gpt_deployment, cache=outcome)
+        return {"agent": self.name, "model": self.gpt_deployment, "cache": outcome}
+
+    def _first_token(self, attributes, started):
+        elapsed = time.perf_counter() - started
+        attributes["time_to_first_token"] = elapsed
+        time_to_first_token.observe(elapsed, agent=self.name, model=self.gpt_deployment)
+
+    def stream_gpt(self, user_prompt, system_prompt):
+        """
+        Streaming counterpart of call_gpt (no function calling): yields the answer
+        text piece by piece as the model produces it. The full text is cached like
+        call_gpt's, so a cached answer is yielded in one piece. Sync wrapper over
+        astream_gpt.
+        """
+        yield from iterate_sync(self.astream_gpt(user_prompt, system_prompt))
+
+    async def astream_gpt(self, user_prompt, system_prompt):
+        """
+        Async implementation of stream_gpt.
+        """
+        self._require_client(self.async_client)
+        started = time.perf_counter()
+        cache, cache_key, cached = self._lookup_cache(user_prompt, system_prompt, None)
+        attributes = self._stream_started(cached)
+        if cached is not None:
+            get_tracer().record("llm.stream", started, **attributes)
+            yield cached
+            return
+
+        parts = []
+        request = self._completion_kwargs(user_prompt, system_prompt, None)
+        try:
+            async with self._areserve(request) as quota:
+                stream = await self.async_client.chat.completions.create(stream=True, **request)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if not parts:
+                            self._first_token(attributes, started)
+                        parts.append(delta)
+                        yield delta
+                quota.settle(estimate_chat_tokens(request, completion_tokens=count_tokens("".join(parts))))
         except Exception as e:
-            error_message = f"Error while calling GPT: {e}"
-            print(error_message)
-            display(Markdown(f"**Error:** {error_message}"))
+            get_tracer().record("llm.stream", started, status="error", error=str(e), **attributes)
+            self._report_error(e)
             raise
+
+        response = "".join(parts)
+        get_tracer().record("llm.stream", started, chunks=len(parts), **attributes)
+        if cache is not None and response:
+            cache.set(cache_key, response)
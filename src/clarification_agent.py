@@ -1,10 +1,13 @@
 # module/clarification_agent.py
 import os
 import sys
+import json
 
 sys.path.append(os.path.abspath("../modules"))
 from common_imports import *  # noqa: F403
 from base_agent import SuperAgent
+from rate_limiter import PRIORITY_INTERACTIVE
+from async_bridge import run_sync
 
 from logging_config import setup_logger
 
@@ -13,23 +16,61 @@ logger = setup_logger(__name__)
 
 
 class ClarificationAgent(SuperAgent):
+    priority = PRIORITY_INTERACTIVE
+
     def __init__(self, api_key, api_base, api_version, gpt_deployment):
         self.api_key = api_key
         self.api_base = api_base
         self.api_version = api_version
         self.gpt_deployment = gpt_deployment
         self.name = "clarification_agent"
-        self.client = AzureOpenAI(
-            api_version=self.api_version,
-            azure_endpoint=self.api_base,
-            api_key=self.api_key,
-        )
 
         # Initialize the parent class
         super().__init__(
             "Clarification Agent", api_key, api_base, api_version, gpt_deployment
         )
 
+        self.assessment_system_prompt = """
+        You are a Clarification Agent specializing in understanding ambiguous user queries.
+        Your TASK is to decide if the user's query requires clarification and, if it does,
+        to ask the user a specific question that resolves the ambiguity.
+
+        - Look for vague terms or phrases such as:
+          1. Timeframes (e.g., "last week"): "Do you mean fiscal week or calendar week?"
+          2. "Top shows/genres": "Should 'top' be defined by total views, ratings, or another metric?"
+          3. "Trend analysis": "What timeframe should the trend cover? Weekly, monthly, or another period?"
+          4. DMA or region: "Which specific DMA or region are you referring to?"
+          5. "Broadcast survey period": "Is the 'broadcast survey period' a fiscal month or calendar month?"
+          6. Device type: "Which device category should the query focus on (e.g., STB, MOBILE APP)?"
+          7. Anomaly detection: "What criteria define an anomaly—statistical variance, threshold deviation, etc.?"
+          8. Rate of change: "How should the rate of change be calculated—(end-start)/start or a different method?"
+
+        - Rules:
+          - Always call report_ambiguity with your verdict.
+          - If no clarification is needed, set needs_clarification to false and leave clarifying_question empty.
+          - Ask one clarification question at a time for each ambiguity.
+          - Be concise and precise in your questions.
+        """
+
+        # Structured response so the verdict and the clarifying question arrive together.
+        self.assessment_functions = [
+            {
+                "name": "report_ambiguity",
+                "description": "Reports whether the query needs clarification and the question to ask.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "needs_clarification": {"type": "boolean"},
+                        "clarifying_question": {
+                            "type": "string",
+                            "description": "Question to ask the user; empty if no clarification is needed.",
+                        },
+                    },
+                    "required": ["needs_clarification"],
+                },
+            }
+        ]
+
     # def is_business_related(self, user_query):
     #     """
     #     Determines if the user's query is related to NBC/Peacock business.
@@ -56,76 +97,57 @@ class ClarificationAgent(SuperAgent):
     #         pass it on for further processing.
     #     """
 
-    def detect_ambiguity(self, user_query):
-        """
-        Detects whether the user's query contains ambiguity.
+    def assess_query(self, user_query):
+        """Sync wrapper over aassess_query."""
+        return run_sync(self.aassess_query(user_query))
+
+    async def aassess_query(self, user_query):
         """
-        system_prompt = """
-        You are an expert in identifying ambiguous queries.
-        Your TASK is to determine if the user's query requires clarification.
-        
-        - Look for vague terms or phrases such as:
-          1. "Last week" (Ambiguity: fiscal week vs. calendar week).
-          2. "Top shows/genres" (Ambiguity: top by views, ratings, or other metrics?).
-          3. "Trend" (Ambiguity: specify the timeframe or measurement method).
-          4. References to "DMA" or "region" (Ambiguity: which region?).
-          5. "Broadcast survey period" (Ambiguity: fiscal month vs. calendar month?).
-        
-        - If these terms are detected, return "True" to indicate that clarification is needed.
-        - Otherwise, return "False."
+        Detects ambiguity and, when needed, drafts the clarifying question in a single call.
+        Returns a dict with "needs_clarification" and "clarifying_question".
         """
-
-        user_prompt = (
-            f"User Query: {user_query}\n\nDoes this query require clarification?"
-        )
-
         try:
-            response = self.call_gpt(user_prompt, system_prompt)
-            if "True" in response:
-                logger.info("Ambiguity detected in the query.")
-                return True
-            elif "False" in response:
-                logger.info("No ambiguity detected in the query.")
-                return False
-            else:
-                raise ValueError("Unexpected response for ambiguity detection.")
+            chat_completion = await self.acall_gpt(
+                self._assessment_user_prompt(user_query),
+                self.assessment_system_prompt,
+                functions=self.assessment_functions,
+            )
+            return self._parse_assessment(chat_completion)
         except Exception as e:
-            logger.error(f"Error during ambiguity detection: {e}")
-            return False  # Assume no ambiguity if an error occurs.
+            logger.error(f"Error during ambiguity assessment: {e}")
+            # Assume no ambiguity if an error occurs.
+            return {"needs_clarification": False, "clarifying_question": None}
+
+    def _assessment_user_prompt(self, user_query):
+        return f"User Query: {user_query}\n\nDoes this query require clarification?"
+
+    def _parse_assessment(self, chat_completion):
+        message = chat_completion.choices[0].message
+
+        if message.function_call:
+            args = json.loads(message.function_call.arguments)
+            needs_clarification = bool(args.get("needs_clarification"))
+            clarifying_question = args.get("clarifying_question") or None
+        elif message.content and "True" in message.content:
+            needs_clarification, clarifying_question = True, None
+        elif message.content and "False" in message.content:
+            needs_clarification, clarifying_question = False, None
+        else:
+            raise ValueError("Unexpected response for ambiguity assessment.")
+
+        if needs_clarification:
+            logger.info("Ambiguity detected in the query.")
+        else:
+            logger.info("No ambiguity detected in the query.")
+            clarifying_question = None
+
+        return {
+            "needs_clarification": needs_clarification,
+            "clarifying_question": clarifying_question,
+        }
 
-    def clarify_query(self, user_query):
-        """
-        Handles ambiguities in the user's query and generates a clarification response.
+    def detect_ambiguity(self, user_query):
         """
-        system_prompt = """
-        You are a Clarification Agent specializing in understanding ambiguous user queries.
-        Your TASK is to identify unclear aspects of the user's query and ask specific questions to clarify:
-        
-        - Example ambiguities and their corresponding clarification questions:
-          1. Timeframes (e.g., "last week"): "Do you mean fiscal week or calendar week?"
-          2. "Top shows/genres": "Should 'top' be defined by total views, ratings, or another metric?"
-          3. "Trend analysis": "What timeframe should the trend cover? Weekly, monthly, or another period?"
-          4. DMA or region: "Which specific DMA or region are you referring to?"
-          5. "Broadcast survey period": "Is the 'broadcast survey period' a fiscal month or calendar month?"
-          6. Device type: "Which device category should the query focus on (e.g., STB, MOBILE APP)?"
-          7. Anomaly detection: "What criteria define an anomaly—statistical variance, threshold deviation, etc.?"
-          8. Rate of change: "How should the rate of change be calculated—(end-start)/start or a different method?"
-        
-        - Rules:
-          - Ask one clarification question at a time for each ambiguity.
-          - Be concise and precise in your questions.
+        Detects whether the user's query contains ambiguity.
         """
-
-        user_prompt = f"User Query: {user_query}\n\nProvide clarification questions."
-
-        try:
-            clarification = self.call_gpt(user_prompt, system_prompt)
-            if clarification:
-                logger.info("Clarification generated successfully.")
-                return clarification
-            else:
-                raise ValueError("No clarification was generated.")
-
-        except Exception as e:
-            logger.error(f"Error during clarification generation: {e}")
-            return "Unable to clarify the query. Please try again."
+        return self.assess_query(user_query)["needs_clarification"]
@@ -0,0 +1,177 @@
+# module/conversation_buffer.py
+import threading
+from token_counter import DEFAULT_ENCODING, APPROX_CHARS_PER_TOKEN, count_tokens, truncate_tokens
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# Texts longer than this many budgets are cut by characters before tokenizing,
+# so digesting a huge agent output costs about the same as a small one
+_PRECUT_FACTOR = 4
+
+
+def digest(text, max_tokens, encoding_name=DEFAULT_ENCODING):
+    """
+    Shorten text to roughly max_tokens tokens, keeping its first lines (two
+    thirds of the budget) and last lines (the rest) around an omission marker.
+    Tables and logs keep their header and final rows this way.
+    """
+    text = str(text)
+    if len(text) <= max_tokens:  # never more tokens than characters
+        return text
+    limit = max_tokens * APPROX_CHARS_PER_TOKEN * _PRECUT_FACTOR
+    precut = 0
+    if len(text) > 2 * limit:
+        precut = (len(text) - 2 * limit) // APPROX_CHARS_PER_TOKEN
+        text = text[:limit] + "\n" + text[-limit:]
+    total = count_tokens(text, encoding_name) + precut
+    if total <= max_tokens:
+        return text
+
+    lines = text.splitlines()
+    head_budget = max_tokens * 2 // 3
+    tail_budget = max_tokens - head_budget
+    head, used = [], 0
+    for line in lines:
+        cost = count_tokens(line, encoding_name) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = count_tokens(line, encoding_name) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+
+    if not head and not tail:
+        # One long line (e.g. a stringified dict): cut it by tokens instead
+        return truncate_tokens(text, max_tokens, encoding_name) + f" [... about {total - max_tokens} more tokens omitted]"
+    omitted = total - count_tokens("\n".join(head + tail), encoding_name)
+    return "\n".join(head + [f"[... about {omitted} tokens omitted ...]"] + tail)
+
+
+class ConversationBuffer:
+    """
+    Conversation entries held to a token budget, for prompts such as the
+    Summary Agent's.
+    - Each entry is capped at entry_tokens; longer ones are replaced by a digest.
+    - When the buffer exceeds max_tokens, the oldest unpinned entries are folded
+      into a rolling summary of at most summary_tokens, written by summarizer
+      (a callable taking text and returning a shorter text) or, without one or
+      if it fails, by digesting.
+    The rendered prompt is therefore bounded by max_tokens plus summary_tokens
+    however much the agents produce. The summarizer runs outside the buffer's
+    lock, so compacting in the background does not block add() or render().
+    """
+
+    def __init__(
+        self,
+        max_tokens=3000,
+        entry_tokens=800,
+        summary_tokens=300,
+        summarizer=None,
+        encoding_name=DEFAULT_ENCODING,
+    ):
+        self.max_tokens = max_tokens
+        self.entry_tokens = entry_tokens
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self.encoding_name = encoding_name
+        self.entries = []  # [{"text": ..., "tokens": ..., "pinned": ...}]
+        self.summary = ""
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()  # one compaction at a time
+        self._generation = 0  # bumped by clear(), so an in-flight compaction is dropped
+
+    @classmethod
+    def from_entries(cls, entries, **kwargs):
+        """Build a buffer from a conversation list; nested lists are flattened."""
+        buffer = cls(**kwargs)
+        buffer.extend(entries)
+        return buffer
+
+    def add(self, text, pinned=False):
+        """Append an entry, digesting it if it exceeds entry_tokens. Pinned entries are never folded."""
+        text = digest(text, self.entry_tokens, self.encoding_name)
+        entry = {"text": text, "tokens": count_tokens(text, self.encoding_name), "pinned": pinned}
+        with self._lock:
+            self.entries.append(entry)
+        return text
+
+    def extend(self, entries, pinned=False):
+        for entry in entries:
+            if isinstance(entry, (list, tuple)):
+                self.extend(entry, pinned)
+            elif entry is not None:
+                self.add(entry, pinned)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            summary = count_tokens(self.summary, self.encoding_name) if self.summary else 0
+            return summary + sum(e["tokens"] for e in self.entries)
+
+    def compact(self):
+        """Fold the oldest unpinned entries into the rolling summary until within max_tokens."""
+        with self._compact_lock:
+            with self._lock:
+                total = sum(e["tokens"] for e in self.entries)
+                folded = []
+                for entry in self.entries:
+                    if total <= self.max_tokens:
+                        break
+                    if entry["pinned"]:
+                        continue
+                    folded.append(entry)
+                    total -= entry["tokens"]
+                if not folded:
+                    return False
+                text = "\n".join(([self.summary] if self.summary else []) + [e["text"] for e in folded])
+                generation = self._generation
+
+            summary = None
+            if self.summarizer:
+                try:
+                    summary = self.summarizer(text)
+                except Exception as e:
+                    logger.warning(f"Rolling summary failed, digesting instead: {e}")
+            summary = digest(summary or text, self.summary_tokens, self.encoding_name)
+
+            with self._lock:
+                if generation != self._generation:
+                    return False
+                # Entries added meanwhile stay; only the folded ones are replaced by the summary
+                folded_ids = {id(e) for e in folded}
+                self.entries = [e for e in self.entries if id(e) not in folded_ids]
+                self.summary = summary
+            logger.info(f"Folded {len(folded)} conversation entries into the rolling summary")
+            return True
+
+    def render(self, compact=True):
+        """
+        The conversation as prompt text, compacting first if over budget.
+        With compact=False it is rendered as is, without calling the summarizer.
+        """
+        if compact:
+            self.compact()
+        with self._lock:
+            lines = [f"Earlier conversation (summary): {self.summary}"] if self.summary else []
+            lines.extend(e["text"] for e in self.entries)
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self.entries = []
+            self.summary = ""
+            self._generation += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return self.render()
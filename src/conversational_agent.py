@@ -1,21 +1,21 @@
 
 import sys
 import os
-from IPython.display import display, Markdown
+import asyncio
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 curr_dir = Path(os.getcwd())
 root_dir = Path(curr_dir.parents[0])
 sys.path.append(str(root_dir))
 
-from sql_agent import SQLAgent
-from knowledge_agent import KnowledgeAgent
-from summary_agent import SummaryAgent
-from sql_debugger import SQLDebugger
-from vega_agent import VegaAgent
 from base_agent import SuperAgent
+from lazy import lazy_property, aload
 from logging_config import setup_logger
-from clarification_agent import ClarificationAgent
+from agent_graph import AgentGraph
+from telemetry import span
+from async_bridge import run_sync
 
 
 # Set up the logger for this module
@@ -26,6 +26,9 @@ artifacts_dir = Path(curr_dir.parents[0] / "artifacts/")
 
 ### Acts as a manager agent by routing which agents need to be executed
 class ConversationalAgent(SuperAgent):
+    # Conversation histories kept in memory; the least recently used are dropped
+    max_sessions = 1000
+
     def __init__(
         self,
         embed_api_key,
@@ -46,127 +49,367 @@ class ConversationalAgent(SuperAgent):
             api_version=api_version,
             gpt_deployment=gpt_deployment,
         )
-        self.sql_debugger = SQLDebugger(api_key, api_base, api_version, gpt_deployment)
-        self.sql_agent = SQLAgent(api_key, api_base, api_version, gpt_deployment)
-        self.knowledge_agent = KnowledgeAgent(embed_api_key, embed_api_base, embed_api_version, embed_gpt_deployment, initial_data_texts, initial_metadata, api_key, api_base, api_version, gpt_deployment)
-        self.summary_agent = SummaryAgent(api_key, api_base, api_version, gpt_deployment)
-        self.vega_agent = VegaAgent(api_key, api_base, api_version, gpt_deployment)
-
-    def execute_agent_calls(self, function_json, original_user_question):
-            conversation = []
-            result = ""
-            json_result = {
-                'Chart': None,
-                'Query_Result':None,
-                'SQL_Query': None,
-                'Summary': None
-            }
-            print(f"User Question: {original_user_question}")
-            conversation.append([f"User: {original_user_question}"])
-            result += f"User Question: {original_user_question}"
-    
-            for agent_call in function_json:   
-                agent = agent_call['Agent'] 
-                if not agent:
-                    print("Warning: Missing 'Agent' key in function_json.")
-                    continue
-    
-                if agent == 'knowledge_agent': 
-                    print("\n====================")
-                    print("Knowledge Agent")
-                    print("====================")
-                    args = agent_call['args']
-                    prompt = args.get('prompt') if args else None
-    
-                    if not args:
-                        print("Warning: Missing 'args' for knowledge_agent call.")
-                        continue
-                    
-                    try:
-                        print(f"Knowledge Agent Prompt: {prompt}")
-                        results = self.knowledge_agent.ask_knowledge_agent(prompt, top_k=3) 
-                        print(f"Knowledge Agent Results: {results}")
-                        conversation.append([f"Knowledge Agent: {results}"])
-                        result += f"\nKnowledge Agent: {results}"
-                    except Exception as e:
-                        print(f"Error executing knowledge agent: {e}")          
-    
-                elif agent == 'sql_agent':  
-                    print("\n====================")
-                    print("SQL Agent")
-                    print("====================")
-                    args = agent_call['args']
-                    prompt = args.get('prompt') if args else None
-    
-                    if not prompt:
-                        print("Warning: Missing 'prompt' for sql_agent call.")
-                        continue
-    
-                    try:
-                        print(f"SQL Agent Prompt: {prompt}")
-                        sql_query = self.sql_agent.generate_query(prompt)
-                        print(f"Pre-Validated SQL Query: {sql_query}")
-    
-                        if sql_query is None:
-                            print("Warning: The SQL query generation returned None.")
-    
-                        if not isinstance(sql_query, str):
-                            print("Error: The generated SQL query is not a string.")
-
-                        query_result = self.sql_agent.send_query(sql_query)
-                        
-                        
-                        print(f"Pre-Validation Query Result: {query_result}")
-                        sql_query, query_result, description = self.sql_debugger.validate_and_fix_sql(sql_query, original_user_question, query_result)
-
-                        conversation.append([f"SQL Query Results: {query_result}"])
-                        conversation.append([f"SQL Query: {sql_query}"])
-                        result += f"\nSQL Query Results:\n{query_result}"
-                        json_result['SQL_Query'] = sql_query
-                        json_result['Query_Result'] = str(query_result)
-                    except Exception as e:
-                        print(f"Error executing sql_agent: {e}")
-    
-                elif agent == 'chart_agent':
-                    print("\n====================")
-                    print("Vega Agent")
-                    print("====================")
-                    try:
-                        if "query_result" in locals():
-                            chart = self.vega_agent.get_vega_chart(query_result, "no additional prompt")
-                            print(f"Generated Chart: {str(chart)}")
-                        else:
-                            print("Error: chart agent tried running, however no SQL results have been produced.")
-                            chart = None
-                    except Exception as e:
-                        print(f"Error executing chart_agent: {e}")
-    
-                    #conversation.append([f"Vega Agent: {chart}"])
-                    result += f"\nVega Agent: {chart}"
-                    json_result['Chart'] = chart
-                elif agent == 'summary_agent':
-                    print("\n====================")
-                    print("Summary Agent")
-                    print("====================")
-                    try:
-                        summary = self.summary_agent.generate_summary(conversation)
-                        #print(f"Generated Summary: {summary}")
-                        conversation.append([f"Summary Agent: {summary}"])
-                        result += f"\nSummary Agent: {summary}"
-                    except Exception as e:
-                        print(f"Error executing summary_agent: {e}")
-
-                    json_result['Summary'] = summary
-                elif agent in ['analysis_agent', 'follow_up_agent']:
-                    print(f"Agent {agent} is not implemented.")
-    
+        self.embed_api_key = embed_api_key
+        self.embed_api_base = embed_api_base
+        self.embed_api_version = embed_api_version
+        self.embed_gpt_deployment = embed_gpt_deployment
+        self.initial_data_texts = initial_data_texts
+        self.initial_metadata = initial_metadata
+        self.sessions = OrderedDict()  # session id -> ConversationBuffer
+        self._sessions_lock = threading.Lock()
+
+    # Sub-agents (and their heavy imports: BigQuery, chromadb, the vector store)
+    # are built on first use, so a session that only asks knowledge questions
+    # never loads the SQL stack and vice versa. Async code reads them through
+    # lazy.aload: their constructors embed indexes with blocking calls.
+
+    @lazy_property
+    def embedding_client(self):
+        """One embedding pipeline (and cache) shared by the SQL and knowledge agents."""
+        from embedding_client import EmbeddingClient
+
+        return EmbeddingClient(self.embed_api_key, self.embed_api_base, self.embed_api_version, self.embed_gpt_deployment)
+
+    @lazy_property
+    def sql_agent(self):
+        from sql_agent import SQLAgent
+
+        return SQLAgent(self.api_key, self.api_base, self.api_version, self.gpt_deployment, embedding_client=self.embedding_client)
+
+    @lazy_property
+    def sql_debugger(self):
+        from sql_debugger import SQLDebugger
+
+        return SQLDebugger(self.api_key, self.api_base, self.api_version, self.gpt_deployment)
+
+    @lazy_property
+    def knowledge_agent(self):
+        from knowledge_agent import KnowledgeAgent
+
+        return KnowledgeAgent(self.embed_api_key, self.embed_api_base, self.embed_api_version, self.embed_gpt_deployment, self.initial_data_texts, self.initial_metadata, self.api_key, self.api_base, self.api_version, self.gpt_deployment, embedding_client=self.embedding_client)
+
+    @lazy_property
+    def summary_agent(self):
+        from summary_agent import SummaryAgent
+
+        return SummaryAgent(self.api_key, self.api_base, self.api_version, self.gpt_deployment)
+
+    @lazy_property
+    def vega_agent(self):
+        from vega_agent import VegaAgent
+
+        return VegaAgent(self.api_key, self.api_base, self.api_version, self.gpt_deployment)
+
+    def session_history(self, session_id):
+        """
+        Earlier turns of one conversation, given to the Summary Agent as context
+        for follow-up questions. Older turns are folded into a rolling summary.
+        Each session id has its own buffer; None (no session) has no history.
+        """
+        if session_id is None:
+            return None
+        from conversation_buffer import ConversationBuffer
+
+        with self._sessions_lock:
+            history = self.sessions.get(session_id)
+            if history is None:
+                history = ConversationBuffer(max_tokens=1500, entry_tokens=300, summary_tokens=300, summarizer=self.summary_agent.condense)
+                self.sessions[session_id] = history
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(session_id)
+            return history
+
+    @lazy_property
+    def compaction_pool(self):
+        """Worker threads that fold old turns into the rolling summary after answers are returned."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        return ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-compaction")
+
+    def end_session(self, session_id):
+        """Forget a conversation's history."""
+        with self._sessions_lock:
+            self.sessions.pop(session_id, None)
+
+    def execute_agent_calls(self, function_json, original_user_question, max_workers=4, on_event=None, session_id=None):
+        """
+        Executes the router's plan. Agents are scheduled on a dependency graph built
+        from their declared inputs/outputs (see agent_graph.AGENT_IO), so independent
+        agents such as knowledge_agent and sql_agent run concurrently (at most
+        max_workers at a time) and dependents (chart_agent, summary_agent) start
+        once their inputs are ready.
+        If on_event is given it receives agent_started/agent_finished events and,
+        for the knowledge and summary agents, their answer tokens as they stream.
+        on_event may be called from worker threads.
+        session_id names the conversation the question belongs to; its earlier
+        turns are given to the Summary Agent (see session_history).
+        Sync wrapper over aexecute_agent_calls.
+        """
+        return run_sync(
+            self.aexecute_agent_calls(
+                function_json,
+                original_user_question,
+                on_event=on_event,
+                max_concurrency=max_workers,
+                session_id=session_id,
+            )
+        )
+
+    async def aexecute_agent_calls(self, function_json, original_user_question, on_event=None, max_concurrency=None, session_id=None):
+        """
+        Async implementation of execute_agent_calls. LLM-bound agents are awaited on
+        the event loop; blocking libraries (BigQuery, chart rendering) run in worker threads.
+        """
+        user_entry = [f"User: {original_user_question}"]
+        history = self.session_history(session_id)
+        print(f"User Question: {original_user_question}")
+
+        async def run_node(agent_call, inputs):
+            with span(self._span_name(agent_call)):
+                self._emit(on_event, "agent_started", agent_call)
+                outcome = await self.arun_agent_call(
+                    agent_call, original_user_question, inputs, user_entry, on_event, history=history
+                )
+                self._emit(on_event, "agent_finished", agent_call, output=(outcome or {}).get('json', {}))
+                return outcome
+
+        with span("agents.execute", agents=len(function_json or [])):
+            graph = AgentGraph(function_json)
+            outcomes = await graph.arun(run_node, max_concurrency=max_concurrency)
+            json_result = self._merge_outcomes(outcomes, original_user_question)
+        self._record_turn(history, original_user_question, json_result)
+        return json_result
+
+    def _merge_outcomes(self, outcomes, original_user_question):
+        json_result = {
+            'Chart': None,
+            'Query_Result': None,
+            'SQL_Query': None,
+            'Summary': None
+        }
+        result = f"User Question: {original_user_question}"
+
+        # Merge in plan order so the output does not depend on completion order
+        for outcome in outcomes:
+            result += outcome.get('result', '')
+            json_result.update(outcome.get('json', {}))
+
+        return json_result
+
+    async def arun_agent_call(self, agent_call, original_user_question, inputs, user_entry, on_event=None, history=None):
+        """
+        Runs a single agent call and returns its outputs. With on_event, the
+        knowledge and summary agents stream their answers as token events.
+        history is the session's ConversationBuffer, if any, for the Summary Agent.
+        """
+        agent = self._agent_name(agent_call)
+
+        if agent == 'knowledge_agent':
+            prompt = self._knowledge_prompt(agent_call)
+            if prompt is None:
+                return {}
+            try:
+                knowledge_agent = await aload(self, "knowledge_agent")
+                if on_event:
+                    results = await self._acollect_stream(
+                        knowledge_agent.astream_knowledge_agent(prompt, top_k=3), agent_call, on_event
+                    )
+                else:
+                    results = await knowledge_agent.aask_knowledge_agent(prompt, top_k=3)
+            except Exception as e:
+                print(f"Error executing knowledge agent: {e}")
+                return {}
+            return self._knowledge_outcome(results)
+
+        elif agent == 'sql_agent':
+            prompt = self._sql_prompt(agent_call)
+            if not prompt:
+                return {}
+            try:
+                sql_agent = await aload(self, "sql_agent")
+                sql_query = await sql_agent.agenerate_query(prompt)
+                return await asyncio.to_thread(
+                    self._execute_sql, sql_query, prompt, original_user_question
+                )
+            except Exception as e:
+                print(f"Error executing sql_agent: {e}")
+                return {}
+
+        elif agent == 'chart_agent':
+            return await asyncio.to_thread(self._run_chart_agent, inputs)
+
+        elif agent == 'summary_agent':
+            summary = None
+            try:
+                summary_agent = await aload(self, "summary_agent")
+                conversation = self._summary_conversation(inputs, user_entry, history)
+                if on_event:
+                    summary = await self._acollect_stream(
+                        summary_agent.astream_summary(conversation), agent_call, on_event
+                    )
                 else:
-                    print(f"Unknown agent: {agent}")
+                    summary = await summary_agent.agenerate_summary(conversation)
+            except Exception as e:
+                print(f"Error executing summary_agent: {e}")
+            return self._summary_outcome(summary)
+
+        return {}
+
+    def _emit(self, on_event, event, agent_call, **fields):
+        if on_event:
+            on_event({'event': event, 'agent': (agent_call or {}).get('Agent'), **fields})
+
+    async def _acollect_stream(self, chunks, agent_call, on_event):
+        """Forward streamed text as token events and return the joined text."""
+        parts = []
+        async for text in chunks:
+            parts.append(text)
+            self._emit(on_event, "token", agent_call, text=text)
+        return "".join(parts) or None
+
+    def _print_banner(self, title):
+        print("\n====================")
+        print(title)
+        print("====================")
+
+    def _span_name(self, agent_call):
+        return f"agent.{(agent_call or {}).get('Agent') or 'unknown'}"
+
+    def _agent_name(self, agent_call):
+        agent = (agent_call or {}).get('Agent')
+        if not agent:
+            print("Warning: Missing 'Agent' key in function_json.")
+        elif agent in ['analysis_agent', 'follow_up_agent']:
+            print(f"Agent {agent} is not implemented.")
+        elif agent not in ['knowledge_agent', 'sql_agent', 'chart_agent', 'summary_agent']:
+            print(f"Unknown agent: {agent}")
+        return agent
+
+    def _knowledge_prompt(self, agent_call):
+        self._print_banner("Knowledge Agent")
+        args = agent_call.get('args')
+        if not args:
+            print("Warning: Missing 'args' for knowledge_agent call.")
+            return None
+        prompt = args.get('prompt')
+        print(f"Knowledge Agent Prompt: {prompt}")
+        return prompt
+
+    def _knowledge_outcome(self, results):
+        print(f"Knowledge Agent Results: {results}")
+        return {
+            'knowledge': results,
+            'conversation': [[f"Knowledge Agent: {results}"]],
+            'result': f"\nKnowledge Agent: {results}",
+        }
+
+    def _sql_prompt(self, agent_call):
+        self._print_banner("SQL Agent")
+        args = agent_call.get('args')
+        prompt = args.get('prompt') if args else None
+        if not prompt:
+            print("Warning: Missing 'prompt' for sql_agent call.")
+        else:
+            print(f"SQL Agent Prompt: {prompt}")
+        return prompt
+
+    def _execute_sql(self, sql_query, prompt, original_user_question):
+        """Run a generated query, let the debugger repair it, and build the outcome."""
+        import pandas as pd
+        from result_stream import describe_result
+
+        print(f"Pre-Validated SQL Query: {sql_query}")
+
+        if sql_query is None:
+            print("Warning: The SQL query generation returned None.")
+
+        if not isinstance(sql_query, str):
+            print("Error: The generated SQL query is not a string.")
+
+        # Cache misses are dry-run first; an over-budget query comes back as an error message
+        query_result = self.sql_agent.send_query(sql_query)
+
+        print(f"Pre-Validation Query Result: {query_result}")
+        sql_query, query_result, description = self.sql_debugger.validate_and_fix_sql(sql_query, original_user_question, query_result)
+
+        # Only queries that ran and returned rows are worth reusing
+        if isinstance(query_result, pd.DataFrame) and len(query_result) > 0:
+            self.sql_agent.remember_query(prompt, sql_query)
+
+        # Prompts get a bounded preview plus column statistics, never the whole result
+        result_text = describe_result(query_result)
+        return {
+            'sql_query': sql_query,
+            'query_result': query_result,
+            'conversation': [
+                [f"SQL Query Results: {result_text}"],
+                [f"SQL Query: {sql_query}"],
+            ],
+            'result': f"\nSQL Query Results:\n{result_text}",
+            'json': {'SQL_Query': sql_query, 'Query_Result': result_text},
+        }
+
+    def _run_chart_agent(self, inputs):
+        self._print_banner("Vega Agent")
+        chart = None
+        try:
+            query_results = inputs.get('query_result', [])
+            if query_results:
+                chart = self.vega_agent.get_vega_chart(query_results[-1], "no additional prompt")
+                print(f"Generated Chart: {str(chart)}")
+            else:
+                print("Error: chart agent tried running, however no SQL results have been produced.")
+        except Exception as e:
+            print(f"Error executing chart_agent: {e}")
 
+        return {
+            'chart': chart,
+            'result': f"\nVega Agent: {chart}",
+            'json': {'Chart': chart},
+        }
 
+    def _summary_conversation(self, inputs, user_entry, history=None):
+        """
+        The Summary Agent's conversation: session history and the question are
+        pinned, agent outputs are digested to the agent's token budget.
+        """
+        self._print_banner("Summary Agent")
+        conversation = self.summary_agent.new_conversation()
+        if history is not None and (len(history) or history.summary):
+            # Rendered as is: compaction runs after each turn, never while a user waits
+            conversation.add(f"Earlier in this session:\n{history.render(compact=False)}", pinned=True)
+        conversation.extend(user_entry, pinned=True)
+        for entries in inputs.get('conversation', []):
+            conversation.extend(entries)
+        return conversation
 
-            return json_result
+    def _record_turn(self, history, original_user_question, json_result):
+        """
+        Add the finished turn to the session history. Folding older turns into
+        the rolling summary may call the LLM, so it is left to compaction_pool
+        and the answer is returned without waiting for it.
+        """
+        answer = json_result.get('Summary') or json_result.get('Query_Result')
+        if history is None or not answer:
+            return
+        try:
+            history.extend([f"User: {original_user_question}", f"Assistant: {answer}"])
+            self.compaction_pool.submit(self._compact_history, history)
+        except Exception as e:
+            logger.warning(f"Could not record the turn in the session history: {e}")
 
+    def _compact_history(self, history):
+        try:
+            history.compact()
+        except Exception as e:
+            logger.warning(f"Could not compact the session history: {e}")
 
-        
-        
+    def _summary_outcome(self, summary):
+        return {
+            'summary': summary,
+            'conversation': [[f"Summary Agent: {summary}"]],
+            'result': f"\nSummary Agent: {summary}",
+            'json': {'Summary': summary},
+        }
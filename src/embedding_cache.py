@@ -0,0 +1,132 @@
+# module/embedding_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from llm_cache import InMemoryLRUCache
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+def embedding_key(deployment, text):
+    """Content hash of a text for a given embedding deployment."""
+    return hashlib.sha256(f"{deployment}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of float32 embedding vectors keyed by (deployment, text hash).
+    An in-memory LRU sits in front of a SQLite table, so re-indexing an unchanged
+    corpus and repeated queries never call the embeddings endpoint.
+    """
+
+    def __init__(self, path="../output/embedding_cache/embeddings.sqlite3", max_memory_entries=10000):
+        self.path = path
+        self.memory = InMemoryLRUCache(max_entries=max_memory_entries, ttl_seconds=None)
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+        else:
+            # Memory-only cache
+            self._conn = None
+
+    def get_many(self, deployment, texts):
+        """Return a list aligned with texts holding float32 vectors or None for misses."""
+        keys = [embedding_key(deployment, text) for text in texts]
+        vectors = [self.memory.get(key) for key in keys]
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self._conn is not None:
+            stored = self._read([keys[i] for i in missing])
+            for i in missing:
+                vector = stored.get(keys[i])
+                if vector is not None:
+                    vectors[i] = vector
+                    self.memory.set(keys[i], vector)
+
+        with self._lock:
+            found_on_disk = sum(1 for i in missing if vectors[i] is not None)
+            self.disk_hits += found_on_disk
+            self.misses += len(missing) - found_on_disk
+        return vectors
+
+    def put_many(self, deployment, texts, vectors):
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = embedding_key(deployment, text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self.memory.set(key, vector)
+            rows.append((key, time.time(), sqlite3.Binary(vector.tobytes())))
+
+        if rows and self._conn is not None:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, stored_at, vector) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+
+    def _read(self, keys):
+        stored = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    stored[key] = np.frombuffer(blob, dtype=np.float32)
+        return stored
+
+    def stats(self):
+        with self._lock:
+            memory_hits = self.memory.hits
+            lookups = memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+
+
+# Cache shared by every EmbeddingClient that does not bring its own; created on first use.
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_embedding_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+def set_default_embedding_cache(cache):
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
@@ -0,0 +1,284 @@
+# module/embedding_client.py
+import time
+import random
+import asyncio
+import contextvars
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from llm_manager import get_llm_manager
+from embedding_cache import get_default_embedding_cache
+from token_counter import count_tokens, truncate_tokens
+from rate_limiter import get_rate_limiter, PRIORITY_INTERACTIVE
+from telemetry import span, counter
+from single_flight import single_flight
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+embedding_texts = counter("embedding_texts_total", "Texts requested for embedding, by cache outcome")
+embedding_retries = counter("embedding_retries_total", "Embedding batches retried after throttling or errors")
+embedding_flight = single_flight("embedding")
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when a batch cannot be embedded after all retries."""
+
+
+class EmbeddingClient:
+    """
+    Embedding pipeline for the Azure OpenAI embeddings REST endpoint.
+    Batches are sized by token count, sent concurrently over the shared pooled
+    HTTP client, retried on 429/5xx honoring Retry-After, and returned in the
+    same order as the input texts. Texts already in the embedding cache are
+    not sent at all, and a request for the same texts as one already in flight
+    waits for that one instead of being sent again. Each batch waits for the deployment's quota in the shared
+    rate limiter; index builds pass PRIORITY_BULK so user queries go first.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        api_base,
+        api_version,
+        deployment,
+        max_concurrency=4,
+        max_batch_size=100,
+        max_batch_tokens=8000,
+        max_input_tokens=8191,
+        max_retries=5,
+        backoff_seconds=1.0,
+        cache=None,
+        use_cache=True,
+        priority=PRIORITY_INTERACTIVE,
+    ):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.api_version = api_version
+        self.deployment = deployment
+        self.max_concurrency = max_concurrency
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.cache = cache
+        self.use_cache = use_cache
+        self.priority = priority
+
+    @property
+    def url(self):
+        return f"{self.api_base}/openai/deployments/{self.deployment}/embeddings?api-version={self.api_version}"
+
+    @property
+    def headers(self):
+        return {"Content-Type": "application/json", "api-key": self.api_key}
+
+    def _prepare(self, texts):
+        """
+        Normalize texts and truncate anything over the model's input limit.
+        Empty texts are sent as a single space so results stay aligned with the input.
+        Returns (texts, token_counts).
+        """
+        prepared, token_counts = [], []
+        for text in texts:
+            text = truncate_tokens(str(text) if text else " ", self.max_input_tokens)
+            prepared.append(text)
+            token_counts.append(count_tokens(text))
+        return prepared, token_counts
+
+    def make_batches(self, texts):
+        """Split texts into batches bounded by both item count and token count."""
+        prepared, token_counts = self._prepare(texts)
+        batches, batch, batch_tokens = [], [], 0
+        for text, n_tokens in zip(prepared, token_counts):
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or batch_tokens + n_tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, preferring the server's hint."""
+        if response is not None:
+            retry_after_ms = response.headers.get("retry-after-ms")
+            retry_after = response.headers.get("retry-after")
+            try:
+                if retry_after_ms:
+                    return float(retry_after_ms) / 1000
+                if retry_after:
+                    return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+
+    def _parse(self, response, batch):
+        data = sorted(response.json().get("data", []), key=lambda item: item["index"])
+        if len(data) != len(batch):
+            raise EmbeddingError(
+                f"Expected {len(batch)} embeddings, received {len(data)}."
+            )
+        return [item["embedding"] for item in data]
+
+    def _count_retry(self, active_span):
+        active_span.add("retries")
+        embedding_retries.inc(deployment=self.deployment)
+
+    def _wait_before_retry(self, attempt, response, active_span):
+        """Back off before the next attempt. A 429 pauses the whole deployment in the rate limiter."""
+        delay = self._retry_delay(attempt, response)
+        logger.warning(f"Retrying embedding batch in {delay:.2f}s (attempt {attempt + 1}).")
+        self._count_retry(active_span)
+        if response is not None and response.status_code == 429:
+            get_rate_limiter().get(self.deployment).throttled(delay)
+            return 0.0  # the next acquire waits out the pause
+        return delay
+
+    def _embed_batch(self, batch, priority=None):
+        http_client = get_llm_manager().get_http_client()
+        limiter = get_rate_limiter().get(self.deployment)
+        tokens = sum(count_tokens(text) for text in batch)
+        priority = self.priority if priority is None else priority
+        with span("embedding.batch", deployment=self.deployment, size=len(batch)) as s:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                limiter.acquire(tokens, priority)
+                try:
+                    response = http_client.post(self.url, headers=self.headers, json={"input": batch})
+                    if response.status_code == 200:
+                        return self._parse(response, batch)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise EmbeddingError(
+                            f"Embedding request failed: {response.status_code} - {response.text}"
+                        )
+                except httpx.TransportError as e:
+                    logger.warning(f"Embedding request transport error: {e}")
+
+                if attempt < self.max_retries:
+                    time.sleep(self._wait_before_retry(attempt, response, s))
+
+            raise EmbeddingError(f"Embedding batch failed after {self.max_retries} retries.")
+
+    async def _aembed_batch(self, batch, semaphore, priority=None):
+        http_client = get_llm_manager().get_async_http_client()
+        limiter = get_rate_limiter().get(self.deployment)
+        tokens = sum(count_tokens(text) for text in batch)
+        priority = self.priority if priority is None else priority
+        async with semaphore:
+            with span("embedding.batch", deployment=self.deployment, size=len(batch)) as s:
+                for attempt in range(self.max_retries + 1):
+                    response = None
+                    await limiter.aacquire(tokens, priority)
+                    try:
+                        response = await http_client.post(
+                            self.url, headers=self.headers, json={"input": batch}
+                        )
+                        if response.status_code == 200:
+                            return self._parse(response, batch)
+                        if response.status_code not in RETRYABLE_STATUS_CODES:
+                            raise EmbeddingError(
+                                f"Embedding request failed: {response.status_code} - {response.text}"
+                            )
+                    except httpx.TransportError as e:
+                        logger.warning(f"Embedding request transport error: {e}")
+
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(self._wait_before_retry(attempt, response, s))
+
+                raise EmbeddingError(f"Embedding batch failed after {self.max_retries} retries.")
+
+    def get_cache(self):
+        """Return the embedding cache, or None if caching is off."""
+        if not self.use_cache:
+            return None
+        return self.cache if self.cache is not None else get_default_embedding_cache()
+
+    def _lookup(self, texts):
+        """
+        Split texts into cached vectors and the unique texts still to embed.
+        Returns (normalized_texts, cached_vectors, missing_texts).
+        """
+        texts = [str(text) if text else " " for text in texts]
+        cache = self.get_cache()
+        if cache is None:
+            cached = [None] * len(texts)
+        else:
+            cached = cache.get_many(self.deployment, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+
+        hits = sum(v is not None for v in cached)
+        embedding_texts.inc(hits, deployment=self.deployment, cache="hit")
+        embedding_texts.inc(len(texts) - hits, deployment=self.deployment, cache="miss")
+        return texts, cached, missing
+
+    def _merge(self, texts, cached, missing, fresh):
+        cache = self.get_cache()
+        if cache is not None and missing:
+            cache.put_many(self.deployment, missing, fresh)
+
+        fresh_by_text = dict(zip(missing, fresh))
+        return [
+            vector.tolist() if vector is not None else fresh_by_text[text]
+            for text, vector in zip(texts, cached)
+        ]
+
+    def embed(self, texts, priority=None):
+        """
+        Embed texts, returning one vector per input text in input order.
+        priority overrides the client's rate-limiter priority for this call.
+        """
+        with span("embedding.embed", deployment=self.deployment, texts=len(texts)) as s:
+            texts, cached, missing = self._lookup(texts)
+            s.set(cache_hits=len(texts) - sum(v is None for v in cached))
+            fresh = []
+            if missing:
+                fresh, shared = embedding_flight.do(
+                    (self.deployment, tuple(missing)), self._embed_missing, missing, priority, s
+                )
+                s.set(coalesced=shared)
+            return self._merge(texts, cached, missing, fresh)
+
+    def _embed_missing(self, missing, priority, active_span):
+        batches = self.make_batches(missing)
+        active_span.set(batches=len(batches))
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            results = [self._embed_batch(batch, priority) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                # Each batch runs in a copy of this context so its span nests under this one
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self._embed_batch, batch, priority)
+                    for batch in batches
+                ]
+                results = [future.result() for future in futures]
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def aembed(self, texts, priority=None):
+        """Async counterpart of embed."""
+        with span("embedding.embed", deployment=self.deployment, texts=len(texts)) as s:
+            texts, cached, missing = self._lookup(texts)
+            s.set(cache_hits=len(texts) - sum(v is None for v in cached))
+            fresh = []
+            if missing:
+                fresh, shared = await embedding_flight.ado(
+                    (self.deployment, tuple(missing)), self._aembed_missing, missing, priority, s
+                )
+                s.set(coalesced=shared)
+            return self._merge(texts, cached, missing, fresh)
+
+    async def _aembed_missing(self, missing, priority, active_span):
+        batches = self.make_batches(missing)
+        active_span.set(batches=len(batches))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(
+            *(self._aembed_batch(batch, semaphore, priority) for batch in batches)
+        )
+        return [vector for batch_vectors in results for vector in batch_vectors]
@@ -0,0 +1,76 @@
+# module/few_shot.py
+from similarity import normalize_rows, cosine_top_k
+from token_counter import count_tokens
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+QUESTION_KEYS = ("question", "prompt", "description", "title", "name")
+SQL_KEYS = ("sql", "query", "sql_query")
+
+
+def normalize_examples(raw):
+    """
+    Coerce sample queries into [{"question": ..., "sql": ...}].
+    Accepts a {question: sql} mapping or a list of dicts using common key names.
+    """
+    if isinstance(raw, dict):
+        if any(key in raw for key in ("examples", "queries", "sample_queries")):
+            raw = raw.get("examples") or raw.get("queries") or raw.get("sample_queries")
+        else:
+            return [{"question": q, "sql": sql} for q, sql in raw.items() if isinstance(sql, str)]
+
+    examples = []
+    for item in raw or []:
+        if not isinstance(item, dict):
+            continue
+        question = next((item[k] for k in QUESTION_KEYS if item.get(k)), None)
+        sql = next((item[k] for k in SQL_KEYS if item.get(k)), None)
+        if question and sql:
+            examples.append({"question": question, "sql": sql})
+    return examples
+
+
+class FewShotIndex:
+    """
+    Sample queries indexed by the embedding of their questions.
+    retrieve() returns the k most similar examples that fit a token budget.
+    """
+
+    def __init__(self, examples, embedding_client, k=3, max_tokens=1500):
+        self.examples = examples
+        self.embedding_client = embedding_client
+        self.k = k
+        self.max_tokens = max_tokens
+        self.matrix = None
+        if examples:
+            # Built when the SQL agent is first used, so at default priority
+            self.matrix = normalize_rows(embedding_client.embed([example["question"] for example in examples]))
+            logger.info(f"Indexed {len(examples)} sample queries for few-shot retrieval.")
+
+    def _select(self, query_vector, exclude_sql=()):
+        indices, _ = cosine_top_k(self.matrix, query_vector, self.k + len(exclude_sql))
+        selected, used = [], 0
+        for i in indices[0]:
+            example = self.examples[i]
+            if example["sql"] in exclude_sql:
+                continue
+            cost = count_tokens(f"Question: {example['question']}\nSQL: {example['sql']}")
+            if used + cost > self.max_tokens:
+                break
+            selected.append(example)
+            used += cost
+            if len(selected) == self.k:
+                break
+        return selected
+
+    def retrieve(self, question, exclude_sql=()):
+        if self.matrix is None:
+            return []
+        return self._select(self.embedding_client.embed([question])[0], exclude_sql)
+
+    async def aretrieve(self, question, exclude_sql=()):
+        if self.matrix is None:
+            return []
+        return self._select((await self.embedding_client.aembed([question]))[0], exclude_sql)
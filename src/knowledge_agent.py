@@ -1,12 +1,22 @@
 import os
 import json
 import time
-import requests
-from IPython.display import display, Markdown
-import chromadb
-from chromadb.config import Settings
-from base_agent import SuperAgent
-from datetime import datetime  # Import datetime for timestamp functionality
+import hashlib
+import asyncio
+import numpy as np
+from base_agent import SuperAgent, display_markdown
+from telemetry import span, counter
+from embedding_client import EmbeddingClient
+from async_bridge import run_sync, iterate_sync
+from rate_limiter import PRIORITY_BULK
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vector_store import create_vector_store
+from vector_snapshot import (
+    import_legacy_json,
+    load_snapshot,
+    save_snapshot,
+    snapshot_exists,
+)
 from logging_config import setup_logger
 
 # Set up the logger for this module
@@ -14,8 +24,29 @@ logger = setup_logger(__name__)
 
 logger.info("This is an info log from the current module.")
 
+knowledge_lookups = counter(
+    "knowledge_lookups_total", "Knowledge base lookups, by path (exact term, hybrid, vector only)"
+)
+
+
+def document_id(text, metadata=None):
+    """Stable id derived from a document's content and metadata."""
+    payload = json.dumps([text, metadata], sort_keys=True, default=str)
+    return "doc_" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
 
 class KnowledgeAgent(SuperAgent):
+    # Documents per add() call; capped at the vector store's max batch size.
+    ingest_batch_size = 1000
+    # Exact glossary terms are answered from the lexical index without an
+    # embedding call; other queries fuse BM25 and vector rankings.
+    use_lexical_index = True
+    # Results taken from each ranking before fusing
+    fusion_candidates = 10
+    # Vector index backend (see vector_store): "numpy" exact search suits
+    # glossary-sized corpora, "ivf" larger ones, "chroma" keeps Chroma.
+    vector_backend = "numpy"
+
     def __init__(
         self,
         embed_api_key,
@@ -28,6 +59,10 @@ class KnowledgeAgent(SuperAgent):
         api_base,
         api_version,
         gpt_deployment,
+        snapshot_dtype="float32",
+        embedding_client=None,
+        vector_backend=None,
+        vector_store_options=None,
     ):
         super().__init__(
             name="Knowledge Agent",
@@ -41,174 +76,345 @@ class KnowledgeAgent(SuperAgent):
         self.embed_api_base = embed_api_base
         self.embed_gpt_deployment = embed_gpt_deployment
         self.embed_api_version = embed_api_version
-        self.chroma_client = chromadb.Client(Settings())
+        self.embedding_client = embedding_client or EmbeddingClient(
+            embed_api_key, embed_api_base, embed_api_version, embed_gpt_deployment
+        )
+        self.lexical_index = None
+        self.vector_backend = vector_backend or self.vector_backend
+        self.vector_store_options = vector_store_options or {}
+        self.stores = {}  # collection name -> VectorStore
 
         collection_name = "main"
-        # Check for stored chroma output
-        store_path = f"../output/chroma_outputs/{collection_name}_collection.json"
-
-        if os.path.isfile(store_path):
-            # Extract ids and embeddings from the JSON
-            with open(store_path, "r") as f:
-                data = json.load(f)
-
-            # ids = data['ids']
-            embeddings = data["embeddings"]
-            metadatas = data["metadatas"]
-            documents = data["documents"]
-
-            self.main_collection = self.get_or_create_collection(
-                collection_name, documents, metadatas, embeddings
+        # Check for a stored binary snapshot, falling back to the legacy JSON dump
+        snapshot_dir = f"../output/chroma_outputs/{collection_name}_snapshot"
+        legacy_store_path = f"../output/chroma_outputs/{collection_name}_collection.json"
+
+        if not snapshot_exists(snapshot_dir) and os.path.isfile(legacy_store_path):
+            print(f"Migrating legacy JSON store {legacy_store_path} to {snapshot_dir}")
+            legacy = import_legacy_json(legacy_store_path)
+            save_snapshot(
+                snapshot_dir,
+                legacy["ids"],
+                legacy["embeddings"],
+                legacy["documents"],
+                legacy["metadatas"],
+                dtype=snapshot_dtype,
             )
+
+        # Start the timer
+        start_time = time.time()
+        has_snapshot = snapshot_exists(snapshot_dir)
+
+        if has_snapshot:
+            # Memory-mapped load: no parsing. The numpy backends search the mapped
+            # matrix in place, so its pages stay shared across worker processes;
+            # other backends (and older, unnormalized snapshots) copy it in.
+            data = load_snapshot(snapshot_dir)
+
+            store = self.open_store(collection_name)
+            if data.get("normalized") and store.adopt(
+                data["ids"], data["documents"], data["embeddings"], data["metadatas"]
+            ):
+                self.main_collection = store
+            else:
+                self.main_collection = self.get_or_create_collection(
+                    collection_name,
+                    data["documents"],
+                    data["metadatas"],
+                    data["embeddings"],
+                    ids=data["ids"],
+                )
             print(
-                f"Data successfully added to the Chroma collection: {collection_name}"
+                f"Data successfully added to the {self.vector_backend} collection: {collection_name}"
             )
-
         else:
-            # Start the timer
-            start_time = time.time()
+            self.main_collection = self.open_store(collection_name)
 
-            # Get or create the 'main' collection
-            self.main_collection = self.get_or_create_collection(
-                collection_name, initial_data_texts, initial_metadata
-            )
+        # Embed and upsert only documents that are new or changed since the snapshot
+        changes = {}
+        if initial_data_texts is not None:
+            changes = self.sync_collection(initial_data_texts, initial_metadata)
 
+        if not has_snapshot or changes.get("added") or changes.get("removed") or changes.get("rekeyed"):
             # End the timer
-            end_time = time.time()
-            execution_time = end_time - start_time  # Calculate elapsed time
+            execution_time = time.time() - start_time  # Calculate elapsed time
 
             # Retrieve collection data
             collection_data = self.main_collection.get(
                 include=["documents", "metadatas", "embeddings"]
             )
 
-            # Convert the NumPy array to a list
-            collection_data["embeddings"] = collection_data["embeddings"].tolist()
-
-            # Add the execution time and current timestamp to the JSON data
-            collection_data["execution_time_seconds"] = execution_time
-
-            # Get the current timestamp in ISO format
-            current_timestamp = datetime.now().isoformat()
-            collection_data["timestamp"] = current_timestamp
-
-            # Serialize the dictionary to a JSON string
-            json_data = json.dumps(collection_data, indent=4)
-
-            # Save the JSON data to a file
-            with open(store_path, "w") as file:
-                file.write(json_data)
+            save_snapshot(
+                snapshot_dir,
+                collection_data["ids"],
+                collection_data["embeddings"],
+                collection_data["documents"],
+                collection_data["metadatas"],
+                dtype=snapshot_dtype,
+                extra={"execution_time_seconds": execution_time},
+            )
 
             print(
-                f"Collection data saved to {store_path} with execution time: {execution_time:.4f} seconds at {current_timestamp}"
+                f"Collection data saved to {snapshot_dir} with execution time: {execution_time:.4f} seconds"
             )
 
+        self.refresh_lexical_index()
+
         self.system_prompt = """
         You are expert knowledge agent that will be used with a few other agents to come up with answers to a user's question. These users work for NBCU and you are an expert in NBCU knowledge. You will be a asked a general question and you will need to answer it. The query may be sent to a vector database to get specific answers to terms used in NBCU. You may or may not want to use the results from this vector db to help you in answering your question.
         
         """
 
     def get_or_create_collection(
-        self, collection_name, texts, metadata, embeddings=None
+        self, collection_name, texts, metadata, embeddings=None, ids=None
     ):
         """Retrieve or create the main collection."""
-        collections = self.chroma_client.list_collections()
-
-        # Search for the collection named 'main'
-        main_collection = next(
-            (c for c in collections if c.name == collection_name), None
-        )
+        main_collection = self.stores.get(collection_name)
 
-        if main_collection:
+        if main_collection is not None and main_collection.count():
             print(f"Collection '{collection_name}' exists.")
             return main_collection
         else:
             # Generate embeddings and create a new collection if 'main' does not exist
-            if not embeddings:
-                embeddings = self.generate_embeddings(texts)
+            if embeddings is None:
+                embeddings = self.generate_embeddings(texts, priority=PRIORITY_BULK)
 
-            print(f"EMBEDDINGS: {embeddings}")
+            print(f"EMBEDDINGS: {len(embeddings)} vectors")
             return self.create_initial_collection(
-                collection_name, embeddings, texts, metadata
+                collection_name, embeddings, texts, metadata, ids=ids
             )
 
-    def generate_embeddings(self, texts, batch_size=100):
-        """Generate embeddings for given texts in batches."""
-        embeddings = []
-        headers = {"Content-Type": "application/json", "api-key": self.embed_api_key}
-        url = f"{self.embed_api_base}/openai/deployments/{self.embed_gpt_deployment}/embeddings?api-version={self.embed_api_version}"
+    def generate_embeddings(self, texts, batch_size=None, priority=None):
+        """
+        Generate embeddings for given texts, one vector per text in input order.
+        Raises EmbeddingError instead of dropping a batch, so vectors never
+        misalign with texts and metadata. Ingestion passes PRIORITY_BULK so
+        it queues behind user queries.
+
+        batch_size is accepted for callers of the old signature but unused:
+        the EmbeddingClient batches requests itself, bounded by both item
+        count (max_batch_size) and tokens (max_batch_tokens), so a fixed item
+        count here could exceed the deployment's per-request token limit.
+        """
+        return self.embedding_client.embed(texts, priority=priority)
 
-        # Process texts in batches
-        for i in range(0, len(texts), batch_size):
-            batch = [str(text) for text in texts[i : i + batch_size] if text]
+    async def agenerate_embeddings(self, texts, priority=None):
+        """Async counterpart of generate_embeddings."""
+        return await self.embedding_client.aembed(texts, priority=priority)
 
-            # Skip empty batches
-            if not batch:
-                print(f"Skipping empty batch at index {i}")
-                continue
+    def sync_collection(self, texts, metadata):
+        """
+        Incrementally bring main_collection in line with the given corpus.
+        Documents are identified by a content-derived id, so only added or
+        changed documents are embedded; removed ones are deleted, and stored
+        vectors under older ids (e.g. vector_{i}) are re-keyed without re-embedding.
+        """
+        metadata = metadata if metadata is not None else [None] * len(texts)
+        incoming = {}
+        for text, meta in zip(texts, metadata):
+            if text:
+                incoming.setdefault(document_id(text, meta), (text, meta))
+
+        stored = self.main_collection.get(include=["documents", "metadatas", "embeddings"])
+        kept = {}  # content id -> (stored id, embedding)
+        to_delete = []
+        for stored_id, doc, meta, embedding in zip(
+            stored["ids"], stored["documents"], stored["metadatas"], stored["embeddings"]
+        ):
+            content_id = document_id(doc, meta)
+            if content_id in incoming and content_id not in kept:
+                kept[content_id] = (stored_id, embedding)
+            else:
+                to_delete.append(stored_id)
 
-            data = {"input": batch}
-            response = requests.post(url, headers=headers, json=data)
+        rekeyed = [cid for cid, (sid, _) in kept.items() if sid != cid]
+        to_delete.extend(kept[cid][0] for cid in rekeyed)
+        added = [cid for cid in incoming if cid not in kept]
 
-            if response.status_code == 200:
-                batch_embeddings = [
-                    item["embedding"] for item in response.json().get("data", [])
-                ]
-                embeddings.extend(batch_embeddings)
+        if to_delete:
+            batch_size = self._effective_batch_size()
+            for start in range(0, len(to_delete), batch_size):
+                self.main_collection.delete(ids=to_delete[start : start + batch_size])
 
-            else:
-                print(
-                    f"Error generating embeddings for batch starting at index {i}: {response.status_code} - {response.text}"
-                )
+        new_embeddings = (
+            self.generate_embeddings([incoming[cid][0] for cid in added], priority=PRIORITY_BULK)
+            if added
+            else []
+        )
+        upsert_ids = rekeyed + added
+        if upsert_ids:
+            self.add_in_batches(
+                self.main_collection,
+                [kept[cid][1] for cid in rekeyed] + list(new_embeddings),
+                [incoming[cid][0] for cid in upsert_ids],
+                [incoming[cid][1] for cid in upsert_ids],
+                ids=upsert_ids,
+            )
+
+        changes = {
+            "added": len(added),
+            "removed": len(to_delete) - len(rekeyed),
+            "rekeyed": len(rekeyed),
+            "unchanged": len(kept) - len(rekeyed),
+        }
+        logger.info(f"Knowledge base sync: {changes}")
+        print(f"Knowledge base sync: {changes}")
+        if self.lexical_index is not None and (added or to_delete):
+            self.refresh_lexical_index()
+        return changes
+
+    def refresh_lexical_index(self):
+        """Rebuild the lexical index from the documents in main_collection."""
+        if not self.use_lexical_index:
+            return
+        data = self.main_collection.get(include=["documents", "metadatas"])
+        self.lexical_index = LexicalIndex(data["ids"], data["documents"], data["metadatas"])
+
+    def open_store(self, collection_name):
+        """The vector store for a collection, created empty on first use."""
+        store = self.stores.get(collection_name)
+        if store is None:
+            store = create_vector_store(self.vector_backend, collection_name, **self.vector_store_options)
+            self.stores[collection_name] = store
+        return store
+
+    def _effective_batch_size(self, batch_size=None, store=None):
+        batch_size = batch_size or self.ingest_batch_size
+        store = store if store is not None else self.main_collection
+        max_batch_size = store.max_batch_size
+        return min(batch_size, max_batch_size) if max_batch_size else batch_size
+
+    def create_initial_collection(
+        self, collection_name, embeddings, texts, metadata, ids=None, batch_size=None
+    ):
+        """Create a new collection and upload initial data with embeddings in batches."""
+        collection = self.open_store(collection_name)
+        self.add_in_batches(collection, embeddings, texts, metadata, ids, batch_size)
+        return collection
 
-        return embeddings
+    def add_in_batches(self, collection, embeddings, texts, metadata, ids=None, batch_size=None):
+        """
+        Add documents to a collection in chunks of batch_size (capped at the
+        store's max batch size), reporting progress and ingest throughput.
+        """
+        total = len(embeddings)
+        if ids is None:
+            ids = [f"vector_{i}" for i in range(total)]
 
-    def create_initial_collection(self, collection_name, embeddings, texts, metadata):
-        """Create a new collection and upload initial data with embeddings."""
-        collection = self.chroma_client.create_collection(name=collection_name)
+        batch_size = self._effective_batch_size(batch_size, collection)
 
-        for i, embedding in enumerate(embeddings):
+        start_time = time.time()
+        for start in range(0, total, batch_size):
+            end = min(start + batch_size, total)
             collection.add(
-                ids=[f"vector_{i}"],  # Unique ID for each item
-                documents=[texts[i]],  # Document to store
-                embeddings=[embedding],  # Corresponding embedding
-                metadatas=[metadata[i]],  # Metadata
+                ids=list(ids[start:end]),  # Unique ID for each item
+                documents=list(texts[start:end]),  # Documents to store
+                embeddings=np.asarray(embeddings[start:end], dtype=np.float32),
+                metadatas=list(metadata[start:end]),  # Metadata
             )
-        return collection
+            print(f"Ingested {end}/{total} documents into '{collection.name}'")
+
+        elapsed = time.time() - start_time
+        self.ingest_stats = {
+            "documents": total,
+            "batch_size": batch_size,
+            "batches": -(-total // batch_size) if total else 0,
+            "seconds": elapsed,
+            "documents_per_second": total / elapsed if elapsed > 0 else float(total),
+        }
+        logger.info(f"Ingest stats for '{collection.name}': {self.ingest_stats}")
+        print(
+            f"Ingested {total} documents in {elapsed:.2f} seconds "
+            f"({self.ingest_stats['documents_per_second']:.1f} docs/s)"
+        )
+        return self.ingest_stats
 
     def query_knowledge_base(self, query, top_k):
         """
         Query the knowledge base and retrieve top_k results.
-        Enhanced with pprint and Jupyter display for better readability.
+        Sync wrapper over aquery_knowledge_base.
         """
+        return run_sync(self.aquery_knowledge_base(query, top_k))
 
-        # We could 
+    async def aquery_knowledge_base(self, query, top_k):
+        """
+        Query the knowledge base and retrieve top_k results: exact glossary
+        terms from the lexical index, everything else from the fused lexical
+        and vector rankings.
+        Enhanced with pprint and Jupyter display for better readability.
+        """
         try:
-            # Generate embeddings
-            query_embedding = self.generate_embeddings([query])[0]
-
-            results = self.main_collection.query(
-                query_embeddings=query_embedding, n_results=top_k
-            )
+            results = self._exact_lookup(query, top_k)
+            if results is not None:
+                return results
+            lexical = self._lexical_search(query)
+
+            query_embedding = (await self.agenerate_embeddings([query]))[0]
+
+            # Vector stores are synchronous; keep the event loop free while searching
+            with span("vector.query", top_k=top_k, backend=self.vector_backend):
+                results = await asyncio.to_thread(
+                    self.main_collection.query,
+                    query_embeddings=query_embedding,
+                    n_results=max(top_k, self.fusion_candidates) if lexical else top_k,
+                )
 
-            return results
+            return self._fuse(results, lexical, top_k)
 
         except Exception as e:
             error_message = f"Error during query execution: {e}"
-            print(error_message)  # Print error to console
-            display(Markdown(f"**Error:** {error_message}"))  # Jupyter rich display
+            print(error_message)
+            display_markdown(f"**Error:** {error_message}")
             return None
 
-    def ask_knowledge_agent(self, query, top_k=3):
-        """
-        Use the vector db results along with the LLM to respond to the user question.
-
-        """
-
-        # Lookup query in vector db
-        vector_db_result = self.query_knowledge_base(query, top_k=3)
-
-        user_prompt = f"""
+    def _exact_lookup(self, query, top_k):
+        """Documents defining exactly the queried term, or None."""
+        if self.lexical_index is None:
+            return None
+        with span("lexical.exact") as s:
+            indices = self.lexical_index.exact(query)[:top_k]
+            s.set(matches=len(indices))
+        if not indices:
+            return None
+        knowledge_lookups.inc(path="exact")
+        return self.lexical_index.results(indices)
+
+    def _lexical_search(self, query):
+        if self.lexical_index is None:
+            return []
+        with span("lexical.search") as s:
+            hits = self.lexical_index.search(query, k=self.fusion_candidates)
+            s.set(matches=len(hits))
+        return hits
+
+    def _fuse(self, vector_results, lexical, top_k):
+        """Reciprocal rank fusion of the vector results and BM25 hits, shaped like a Chroma result."""
+        if not lexical:
+            knowledge_lookups.inc(path="vector")
+            return vector_results
+        knowledge_lookups.inc(path="hybrid")
+
+        documents = {}
+        for doc_id, doc, meta in zip(
+            vector_results["ids"][0], vector_results["documents"][0], vector_results["metadatas"][0]
+        ):
+            documents[doc_id] = (doc, meta)
+        index = self.lexical_index
+        lexical_ids = [index.ids[i] for i, _ in lexical]
+        for doc_id in lexical_ids:
+            i = index.positions[doc_id]
+            documents.setdefault(doc_id, (index.documents[i], index.metadatas[i]))
+
+        fused = reciprocal_rank_fusion([vector_results["ids"][0], lexical_ids])[:top_k]
+        return {
+            "ids": [[doc_id for doc_id, _ in fused]],
+            "documents": [[documents[doc_id][0] for doc_id, _ in fused]],
+            "metadatas": [[documents[doc_id][1] for doc_id, _ in fused]],
+            "scores": [[score for _, score in fused]],
+        }
+
+    def build_user_prompt(self, query, vector_db_result):
+        return f"""
         
         Here is the result from the vector DB. 
         {vector_db_result}. Remeber, we are simply selecting the 3 closest vectors to what was in the original user question. 
@@ -222,9 +428,39 @@ class KnowledgeAgent(SuperAgent):
         
         """
 
-        # Use LLM
-        response = self.call_gpt(
+    def ask_knowledge_agent(self, query, top_k=3):
+        """
+        Use the vector db results along with the LLM to respond to the user question.
+        Sync wrapper over aask_knowledge_agent.
+        """
+        return run_sync(self.aask_knowledge_agent(query, top_k))
+
+    async def aask_knowledge_agent(self, query, top_k=3):
+        """
+        Use the vector db results along with the LLM to respond to the user question.
+        """
+        vector_db_result = await self.aquery_knowledge_base(query, top_k=3)
+
+        user_prompt = self.build_user_prompt(query, vector_db_result)
+
+        response = await self.acall_gpt(
             user_prompt=user_prompt, system_prompt=self.system_prompt
         )
 
         return response
+
+    def stream_knowledge_agent(self, query, top_k=3):
+        """
+        Streaming counterpart of ask_knowledge_agent: the vector lookup runs first,
+        then the answer is yielded as it is generated.
+        """
+        yield from iterate_sync(self.astream_knowledge_agent(query, top_k))
+
+    async def astream_knowledge_agent(self, query, top_k=3):
+        """
+        Async implementation of stream_knowledge_agent.
+        """
+        vector_db_result = await self.aquery_knowledge_base(query, top_k=top_k)
+        user_prompt = self.build_user_prompt(query, vector_db_result)
+        async for text in self.astream_gpt(user_prompt=user_prompt, system_prompt=self.system_prompt):
+            yield text
@@ -0,0 +1,50 @@
+# module/lazy.py
+import asyncio
+import threading
+
+
+class lazy_property:
+    """
+    Like functools.cached_property, but safe under concurrent first access:
+    the first caller builds the value while others wait for it, so agents run
+    in parallel by the agent graph never construct the same resource twice.
+    The value is stored on the instance, so later reads (and assignments,
+    e.g. injecting a fake in tests) bypass the descriptor entirely.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        values = instance.__dict__
+        if self.name in values:
+            return values[self.name]
+        # dict.setdefault is atomic, so every thread sees the same lock
+        lock = values.setdefault(f"_{self.name}_lock", threading.Lock())
+        with lock:
+            if self.name not in values:
+                values[self.name] = self.factory(instance)
+        return values[self.name]
+
+
+def is_loaded(instance, name):
+    """True once a lazy_property has been built on this instance."""
+    return name in instance.__dict__
+
+
+async def aload(instance, name):
+    """
+    Read a lazy_property from async code. The first read builds the value in a
+    worker thread, so a factory that blocks (loading indexes, embedding a
+    corpus) never stalls the event loop and the other requests on it.
+    """
+    if is_loaded(instance, name):
+        return instance.__dict__[name]
+    return await asyncio.to_thread(getattr, instance, name)
@@ -0,0 +1,153 @@
+# module/lexical_index.py
+import re
+import math
+import numpy as np
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:['&.-][a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when where which who why with".split()
+)
+
+# Glossary entries usually start "Term: definition", "Term - definition" or "Term is ..."
+_TERM_PREFIX = re.compile(r"^\s*(?P<term>[^:\n]{1,60}?)\s*(?::|\s[-–—]\s|\s(?:is|are|means|refers to)\s)")
+
+# Terms longer than this are descriptions, not glossary keys
+MAX_TERM_WORDS = 6
+
+# Metadata fields that name the term a document defines (e.g. {"term": "Churn"})
+TERM_KEYS = ("term", "name", "title", "keyword", "acronym", "alias", "aliases")
+
+_ARTICLES = ("the ", "a ", "an ")
+
+
+def tokenize(text, keep_stopwords=False):
+    tokens = _TOKEN.findall(str(text or "").lower())
+    return tokens if keep_stopwords else [t for t in tokens if t not in STOPWORDS]
+
+
+def normalize_term(text):
+    """Canonical form of a term for exact matching: lowercase words, no punctuation or leading article."""
+    term = " ".join(tokenize(text, keep_stopwords=True))
+    for article in _ARTICLES:
+        if term.startswith(article):
+            return term[len(article):]
+    return term
+
+
+def term_candidates(document, metadata=None):
+    """The glossary terms a document defines: term-like metadata fields and its leading term."""
+    candidates = []
+    for key, value in (metadata or {}).items():
+        if str(key).lower() not in TERM_KEYS or not isinstance(value, str):
+            continue
+        # Aliases may be listed as "MAU, monthly actives"
+        candidates.extend(v for v in value.split(",") if 0 < len(v.split()) <= MAX_TERM_WORDS)
+    document = str(document or "")
+    if 0 < len(document.split()) <= MAX_TERM_WORDS:
+        candidates.append(document)
+    match = _TERM_PREFIX.match(document)
+    if match and len(match.group("term").split()) <= MAX_TERM_WORDS:
+        candidates.append(match.group("term"))
+    return {normalize_term(c) for c in candidates} - {""}
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse ranked lists of ids: each id scores sum(1 / (k + rank)) over the lists
+    it appears in. Returns [(id, score)] best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    In-process inverted index over documents and their metadata.
+    - exact(query): documents whose glossary term equals the query, e.g. "churn"
+      for "Churn: share of subscribers who cancel...". No scoring, no network.
+    - search(query, k): Okapi BM25 ranking for everything else.
+    The index is immutable; rebuild it when the collection changes.
+    """
+
+    def __init__(self, ids, documents, metadatas=None, k1=1.5, b=0.75):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas) if metadatas is not None else [None] * len(self.ids)
+        self.k1 = k1
+        self.b = b
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+        self.terms = {}  # normalized glossary term -> [doc index]
+        postings = {}  # token -> {doc index: term frequency}
+        lengths = np.zeros(len(self.ids), dtype=np.float32)
+        for i, (document, metadata) in enumerate(zip(self.documents, self.metadatas)):
+            for term in term_candidates(document, metadata):
+                self.terms.setdefault(term, []).append(i)
+            meta_text = " ".join(str(v) for v in (metadata or {}).values() if isinstance(v, (str, int, float)))
+            tokens = tokenize(f"{document} {meta_text}")
+            lengths[i] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[i] = counts.get(i, 0) + 1
+
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+        # token -> (doc indices, term frequencies, idf)
+        self.postings = {}
+        n = len(self.ids)
+        for token, counts in postings.items():
+            idf = math.log(1 + (n - len(counts) + 0.5) / (len(counts) + 0.5))
+            self.postings[token] = (
+                np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)),
+                np.fromiter(counts.values(), dtype=np.float32, count=len(counts)),
+                idf,
+            )
+        logger.info(f"Lexical index: {n} documents, {len(self.postings)} tokens, {len(self.terms)} glossary terms")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def exact(self, query):
+        """Indices of documents whose glossary term is the query (ignoring case, punctuation and a plural s)."""
+        term = normalize_term(query)
+        if not term:
+            return []
+        matches = self.terms.get(term)
+        if matches is None and term.endswith("s"):
+            matches = self.terms.get(term[:-1])
+        return list(matches or [])
+
+    def search(self, query, k=10):
+        """[(doc index, BM25 score)] for the best k documents containing any query token."""
+        if not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / max(self.average_length, 1e-9))
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            docs, tf, idf = posting
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def results(self, indices, scores=None):
+        """Documents in the shape of a Chroma query result (one query)."""
+        return {
+            "ids": [[self.ids[i] for i in indices]],
+            "documents": [[self.documents[i] for i in indices]],
+            "metadatas": [[self.metadatas[i] for i in indices]],
+            "scores": [list(scores) if scores is not None else [None] * len(indices)],
+        }
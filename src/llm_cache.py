@@ -0,0 +1,188 @@
+# module/llm_cache.py
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+def make_cache_key(deployment, system_prompt, user_prompt, functions=None, **params):
+    """
+    Build a content-addressed key for an LLM request.
+    Every field that can change the response is part of the hash.
+    """
+    payload = {
+        "deployment": deployment,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "functions": functions,
+        "params": params,
+    }
+    serialized = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Base class for LLM response caches.
+    Subclasses implement _get and _set; hit/miss counting lives here.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value is None:
+            return
+        self._set(key, value)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+
+class InMemoryLRUCache(ResponseCache):
+    """Process-local LRU cache with an optional time-to-live per entry."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        super().__init__(ttl_seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self._expired(stored_at):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(ResponseCache):
+    """
+    On-disk cache backed by SQLite so responses survive restarts
+    and can be shared by worker processes on the same host.
+    """
+
+    def __init__(self, path="../output/llm_cache/responses.sqlite3", ttl_seconds=None):
+        super().__init__(ttl_seconds=ttl_seconds)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            stored_at, blob = row
+            if self._expired(stored_at):
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        try:
+            return pickle.loads(blob)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {key}: {e}")
+            return None
+
+    def _set(self, key, value):
+        try:
+            blob = pickle.dumps(value)
+        except Exception as e:
+            logger.warning(f"Response for {key} is not cacheable: {e}")
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stored_at, value) VALUES (?, ?, ?)",
+                (key, time.time(), sqlite3.Binary(blob)),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Cache used by every SuperAgent that does not bring its own.
+_default_cache = InMemoryLRUCache()
+
+
+def get_default_cache():
+    return _default_cache
+
+
+def set_default_cache(cache):
+    """Swap the shared cache, e.g. for a SQLiteCache. Pass None to disable caching."""
+    global _default_cache
+    _default_cache = cache
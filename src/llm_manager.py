@@ -0,0 +1,176 @@
+# module/llm_manager.py
+import asyncio
+import threading
+import httpx
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+class LLMManager:
+    """
+    Central registry of LLM clients. Hands out one shared, connection-pooled
+    client per (endpoint, api_version, key) so agents reuse TLS connections
+    instead of each opening their own pool. An async connection pool only
+    works on the event loop it was created on, so async clients are pooled
+    per running loop.
+    """
+
+    def __init__(
+        self,
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=30.0,
+        timeout=60.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self._clients = {}
+        self._async_clients = {}  # event loop -> {key: client}
+        self._http_client = None
+        self._async_http_clients = {}  # event loop -> client
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        """
+        Update pool settings (max_connections, max_keepalive_connections,
+        keepalive_expiry, timeout). Clients are looked up on every call (see
+        pooled_client), so later calls get new clients with the new limits.
+        Clients already handed out are not closed: requests in flight on them
+        finish normally, and their pools are released once nothing uses them.
+        """
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith("_"):
+                raise ValueError(f"Unknown LLMManager setting: {name}")
+            setattr(self, name, value)
+        with self._lock:
+            self._clients = {}
+            self._async_clients = {}
+            self._http_client = None
+            self._async_http_clients = {}
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _loop_entry(self, table, default):
+        """
+        table[running loop], created with default() on first use; entries for
+        closed loops are dropped. Call with the lock held.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for stale in [l for l in table if l is not None and l.is_closed()]:
+            del table[stale]
+        entry = table.get(loop)
+        if entry is None:
+            entry = table[loop] = default()
+        return entry
+
+    def get_client(self, api_base, api_version, api_key):
+        """Return the shared AzureOpenAI client for this endpoint and key."""
+        key = (api_base, api_version, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # openai is slow to import; defer it until the first client is needed
+                from openai import AzureOpenAI
+
+                logger.info(f"Creating pooled AzureOpenAI client for {api_base}")
+                client = AzureOpenAI(
+                    api_version=api_version,
+                    azure_endpoint=api_base,
+                    api_key=api_key,
+                    http_client=httpx.Client(limits=self._limits(), timeout=self.timeout),
+                )
+                self._clients[key] = client
+            return client
+
+    def get_async_client(self, api_base, api_version, api_key):
+        """Return the shared AsyncAzureOpenAI client for this endpoint and key on the running event loop."""
+        key = (api_base, api_version, api_key)
+        with self._lock:
+            clients = self._loop_entry(self._async_clients, dict)
+            client = clients.get(key)
+            if client is None:
+                from openai import AsyncAzureOpenAI
+
+                logger.info(f"Creating pooled AsyncAzureOpenAI client for {api_base}")
+                client = AsyncAzureOpenAI(
+                    api_version=api_version,
+                    azure_endpoint=api_base,
+                    api_key=api_key,
+                    http_client=httpx.AsyncClient(limits=self._limits(), timeout=self.timeout),
+                )
+                clients[key] = client
+            return client
+
+    def get_http_client(self):
+        """Shared pooled HTTP client for raw REST calls (e.g. embeddings)."""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self._limits(), timeout=self.timeout)
+            return self._http_client
+
+    def get_async_http_client(self):
+        """Shared pooled async HTTP client for raw REST calls (e.g. embeddings) on the running event loop."""
+        with self._lock:
+            return self._loop_entry(
+                self._async_http_clients,
+                lambda: httpx.AsyncClient(limits=self._limits(), timeout=self.timeout),
+            )
+
+    def close(self):
+        """Close the sync clients and forget every pooled client."""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            if self._http_client is not None:
+                self._http_client.close()
+            # Async clients must be closed from their event loop; drop them here.
+            self._clients = {}
+            self._async_clients = {}
+            self._http_client = None
+            self._async_http_clients = {}
+
+
+class pooled_client:
+    """
+    Agent attribute for the manager's shared client matching the agent's
+    api_base, api_version and api_key. It is looked up on every access, so
+    agents always use a client that is current (after configure()) and, for
+    async clients, bound to the running event loop. None if the agent has no
+    endpoint or key. Assigning the attribute (e.g. a fake in tests) overrides
+    the lookup.
+    """
+
+    def __init__(self, asynchronous=False):
+        self.asynchronous = asynchronous
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if not (instance.api_key and instance.api_base):
+            return None
+        manager = get_llm_manager()
+        get_client = manager.get_async_client if self.asynchronous else manager.get_client
+        return get_client(instance.api_base, instance.api_version, instance.api_key)
+
+
+# Registry shared by every agent in the process.
+_default_manager = LLMManager()
+
+
+def get_llm_manager():
+    return _default_manager
@@ -0,0 +1,190 @@
+# module/pre_router.py
+import os
+import re
+import json
+import threading
+import numpy as np
+from similarity import normalize_rows, cosine_top_k
+from telemetry import counter
+from atomic_write import write_json_atomic
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+pre_router_outcomes = counter(
+    "pre_router_total", "Plans decided locally (rule, similar) or left to the LLM planner (llm)"
+)
+
+SUMMARY_PROMPT = "Provide a final summary of the conversation."
+
+# Glossary lookups, e.g. "What is the definition of churn?", "Define ARPU", "What does MAU mean?"
+_DEFINITION_PATTERNS = [
+    re.compile(
+        r"^\s*(?:what(?:'s|\s+is|\s+are)\s+)?(?:the\s+)?(?:definition|meaning)\s+of\s+(?P<term>.+?)\s*\??\s*$",
+        re.I,
+    ),
+    re.compile(r"^\s*(?:please\s+)?define\s+(?P<term>.+?)\s*[.?]?\s*$", re.I),
+    re.compile(r"^\s*what\s+does\s+(?P<term>.+?)\s+mean\s*\??\s*$", re.I),
+    re.compile(r"^\s*how\s+(?:do|does)\s+(?:we|you|one)\s+define\s+(?P<term>.+?)\s*\??\s*$", re.I),
+]
+
+# Terms that turn a "definition" question into a data question
+_DATA_WORDS = re.compile(
+    r"\b(last|this|next|per|by|trend|top|how many|count|total|average|compare|between|since|during|\d{4})\b",
+    re.I,
+)
+
+
+def plan_template(agents, question):
+    """A plan for the given agent sequence, with the question as each agent's prompt."""
+    return [
+        {
+            "Agent": agent,
+            "args": {"prompt": SUMMARY_PROMPT if agent == "summary_agent" else question},
+        }
+        for agent in agents
+    ]
+
+
+def plan_shape(agent_calls):
+    """The agent sequence of a plan, e.g. ("knowledge_agent", "summary_agent")."""
+    return tuple(call.get("Agent") for call in agent_calls or [] if isinstance(call, dict))
+
+
+class PreRouter:
+    """
+    Decides plans locally so simple questions skip the LLM planner.
+    Two stages, cheapest first:
+    - rules: glossary questions ("What is the definition of churn?") map to the
+      knowledge_agent -> summary_agent plan the planner's own prompt prescribes;
+    - similarity: questions are embedded and compared with questions the LLM
+      planner has already planned. If the nearest neighbour scores at least
+      threshold and every neighbour within margin of it has the same agent
+      sequence, that sequence is reused with the new question as the prompt.
+    Anything else returns None and goes to the LLM planner, whose plans are
+    then learned for next time.
+    """
+
+    def __init__(
+        self,
+        embedding_client=None,
+        threshold=0.92,
+        margin=0.05,
+        k=5,
+        max_examples=5000,
+        path="../output/pre_router/plans.json",
+    ):
+        self.embedding_client = embedding_client
+        self.threshold = threshold
+        self.margin = margin
+        self.k = k
+        self.max_examples = max_examples
+        self.path = path
+        self.examples = []  # [{"question": ..., "agents": [...]}]
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if path and os.path.isfile(path) and embedding_client is not None:
+            examples = self._read(path)
+            if examples:
+                # Loaded on the first question, while it waits: default priority
+                vectors = embedding_client.embed([e["question"] for e in examples])
+                self._extend(examples, vectors)
+            logger.info(f"Loaded {len(self.examples)} labeled plans from {path}")
+
+    def rule_plan(self, question):
+        """Plan for a question the rules recognise, or None."""
+        for pattern in _DEFINITION_PATTERNS:
+            match = pattern.match(question or "")
+            if match:
+                term = match.group("term").strip(" \"'`")
+                if term and len(term.split()) <= 6 and not _DATA_WORDS.search(term):
+                    pre_router_outcomes.inc(outcome="rule")
+                    logger.info(f"Pre-router rule matched glossary lookup for {term!r}")
+                    return [
+                        {"Agent": "knowledge_agent", "args": {"prompt": term}},
+                        {"Agent": "summary_agent", "args": {"prompt": SUMMARY_PROMPT}},
+                    ]
+        return None
+
+    def _read(self, path):
+        """Stored labeled plans, or [] (with a warning) if the file cannot be parsed."""
+        try:
+            with open(path, "r") as f:
+                examples = json.load(f)
+            if not isinstance(examples, list) or not all(
+                isinstance(e, dict) and "question" in e and isinstance(e.get("agents"), list)
+                for e in examples
+            ):
+                raise ValueError("expected a list of question/agents pairs")
+            return examples
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable pre-router plans {path}, starting empty: {e}")
+            return []
+
+    def _extend(self, examples, vectors):
+        with self._lock:
+            rows = normalize_rows(vectors)
+            self.matrix = rows if not self.examples else np.vstack([self.matrix, rows])
+            self.examples.extend(examples)
+            if len(self.examples) > self.max_examples:
+                overflow = len(self.examples) - self.max_examples
+                self.examples = self.examples[overflow:]
+                self.matrix = self.matrix[overflow:]
+
+    def _classify(self, question, query_vector):
+        with self._lock:
+            if not self.examples:
+                return None
+            indices, scores = cosine_top_k(self.matrix, query_vector, self.k)
+            neighbours = [
+                (float(score), tuple(self.examples[i]["agents"]))
+                for i, score in zip(indices[0], scores[0])
+            ]
+
+        best_score, agents = neighbours[0]
+        if best_score < self.threshold:
+            return None
+        # Neighbours that are nearly as close but planned differently mean the call is not clear-cut
+        if any(shape != agents for score, shape in neighbours if score >= best_score - self.margin):
+            return None
+        logger.info(f"Pre-router reused plan {agents} (similarity {best_score:.3f})")
+        return plan_template(agents, question)
+
+    def similar_plan(self, question):
+        """Plan reused from similar past questions, or None."""
+        plan = None
+        if self.embedding_client is not None and self.examples:
+            plan = self._classify(question, self.embedding_client.embed([question])[0])
+        pre_router_outcomes.inc(outcome="similar" if plan else "llm")
+        return plan
+
+    async def asimilar_plan(self, question):
+        """Async counterpart of similar_plan."""
+        plan = None
+        if self.embedding_client is not None and self.examples:
+            plan = self._classify(question, (await self.embedding_client.aembed([question]))[0])
+        pre_router_outcomes.inc(outcome="similar" if plan else "llm")
+        return plan
+
+    def learn(self, question, agent_calls):
+        """Remember the agent sequence the LLM planner chose for a question."""
+        agents = plan_shape(agent_calls)
+        if self.embedding_client is None or not agents:
+            return
+        if any(e["question"] == question and tuple(e["agents"]) == agents for e in self.examples):
+            return
+        vector = self.embedding_client.embed([question])[0]
+        self._extend([{"question": question, "agents": list(agents)}], [vector])
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # One writer at a time, so an older copy never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                examples = list(self.examples)
+            write_json_atomic(self.path, examples)
@@ -0,0 +1,237 @@
+# module/query_cache.py
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# String literals and quoted identifiers are kept verbatim; comments are dropped.
+_SQL_TOKENS = re.compile(
+    r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|(--[^\n]*|\#[^\n]*|/\*.*?\*/)""",
+    re.S,
+)
+
+
+# Keywords and common functions, which BigQuery matches case-insensitively.
+# Everything else is left as written: table and dataset names are case-sensitive.
+SQL_KEYWORDS = frozenset(
+    """
+    all and any array as asc between by case cast cross current_date
+    current_timestamp date datetime desc distinct else end except exists extract
+    false following from full group having if ifnull in inner interval is join
+    lateral left like limit not null nulls offset on or order outer over
+    partition preceding qualify range right rows safe_cast select struct
+    timestamp true union unnest using when where window with
+    avg count countif max min sum coalesce lower upper round
+    date_add date_sub date_diff date_trunc format_date timestamp_trunc
+    """.split()
+)
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _normalize_code(code):
+    code = _WORD.sub(
+        lambda m: m.group(0).lower() if m.group(0).lower() in SQL_KEYWORDS else m.group(0),
+        code,
+    )
+    return re.sub(r"\s+", " ", code)
+
+
+def normalize_sql(query):
+    """
+    Canonical form of a query for cache lookups: comments removed, whitespace
+    collapsed, trailing semicolons dropped and keywords (SQL_KEYWORDS)
+    lower-cased. Identifiers, string literals and backtick names are kept as
+    written, since BigQuery table and dataset names are case-sensitive.
+    """
+    parts = []  # alternating normalized code and verbatim literals
+    code = ""
+    position = 0
+    for match in _SQL_TOKENS.finditer(query):
+        code += query[position : match.start()]
+        if match.group(1):
+            parts.append(_normalize_code(code))
+            parts.append(match.group(1))
+            code = ""
+        else:
+            code += " "
+        position = match.end()
+    code += query[position:]
+    parts.append(_normalize_code(code))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def dataframe_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class QueryResultCache:
+    """
+    Cache of query results keyed on (project, normalized SQL).
+    Results live in an in-memory LRU bounded by total DataFrame memory and are
+    also written as Parquet files, so a restarted process reloads them cheaply.
+    Entries expire after ttl_seconds.
+    """
+
+    def __init__(
+        self,
+        directory="../output/query_cache",
+        ttl_seconds=300,
+        max_memory_bytes=256 * 1024 * 1024,
+        max_disk_bytes=1024 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stored_at, df, nbytes)
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, project_id, query):
+        payload = f"{project_id}\0{normalize_sql(query)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def get(self, project_id, query):
+        """Return a copy of the cached DataFrame, or None."""
+        key = self.key(project_id, query)
+        df = self._get_memory(key)
+        if df is None and self.directory:
+            df = self._get_disk(key)
+            if df is not None:
+                self._put_memory(key, df, os.path.getmtime(self._path(key)))
+
+        with self._lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        # Callers may mutate the frame; never hand out the cached object itself
+        return df.copy() if df is not None else None
+
+    def put(self, project_id, query, df):
+        if not isinstance(df, pd.DataFrame):
+            return
+        key = self.key(project_id, query)
+        stored_at = time.time()
+        self._put_memory(key, df.copy(), stored_at)
+        if self.directory:
+            self._put_disk(key, df)
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, df, nbytes = entry
+            if self._expired(stored_at):
+                del self._entries[key]
+                self.memory_bytes -= nbytes
+                return None
+            self._entries.move_to_end(key)
+            return df
+
+    def _put_memory(self, key, df, stored_at):
+        nbytes = dataframe_bytes(df)
+        if nbytes > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.memory_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (stored_at, df, nbytes)
+            self.memory_bytes += nbytes
+            # Evict least recently used results until the memory budget holds
+            while self.memory_bytes > self.max_memory_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.memory_bytes -= evicted_bytes
+
+    def _get_disk(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        if self._expired(os.path.getmtime(path)):
+            self._remove(path)
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cached result {path}: {e}")
+            self._remove(path)
+            return None
+
+    def _put_disk(self, key, df):
+        path = self._path(key)
+        try:
+            df.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.warning(f"Could not write query result to {path}: {e}")
+            self._remove(path + ".tmp")
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete the oldest Parquet files until the disk budget holds."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet"):
+                path = os.path.join(self.directory, name)
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "memory_bytes": self.memory_bytes,
+            }
+
+
+# Cache shared by every SQLAgent that does not bring its own; created on first use.
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_query_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = QueryResultCache()
+        return _default_cache
+
+
+def set_default_query_cache(cache):
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
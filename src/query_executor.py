@@ -1 +1,161 @@
+# module/query_executor.py
+import re
+import sqlite3
+import threading
+import pandas as pd
+from logging_config import setup_logger
 
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+class QueryExecutor:
+    """
+    Interface for running SQL and returning a DataFrame.
+    project_id identifies the backend in cache keys.
+    """
+
+    project_id = None
+
+    def run(self, query):
+        raise NotImplementedError
+
+    def dry_run(self, query):
+        """Estimate a query without running it: {"bytes_processed": int or None, "tables": [...]}."""
+        raise NotImplementedError
+
+    def last_stats(self):
+        """Statistics of the last query this thread ran, e.g. {"bytes_processed": ...}."""
+        return getattr(getattr(self, "_local", None), "stats", None)
+
+    def stream(self, query, batch_rows=10000):
+        """Yield the result as DataFrame batches; backends override this to page results."""
+        yield self.run(query)
+
+
+class BigQueryExecutor(QueryExecutor):
+    """
+    Runs queries on BigQuery. run() materializes the result through pandas_gbq;
+    stream() pages it as Arrow record batches through the BigQuery client.
+    """
+
+    def __init__(self, project_id, credentials=None):
+        self.project_id = project_id
+        self.credentials = credentials
+        self._client = None
+        self._local = threading.local()
+
+    def get_credentials(self):
+        """Explicit credentials, or application default credentials looked up on first use."""
+        if self.credentials is None:
+            import google.auth
+
+            self.credentials, _ = google.auth.default()
+        return self.credentials
+
+    def get_client(self):
+        if self._client is None:
+            from google.cloud import bigquery
+
+            self._client = bigquery.Client(project=self.project_id, credentials=self.get_credentials())
+        return self._client
+
+    def run(self, query):
+        import pandas_gbq
+
+        return pandas_gbq.read_gbq(
+            query,
+            project_id=self.project_id,
+            credentials=self.get_credentials(),
+            progress_bar_type=None,
+        )
+
+    def dry_run(self, query):
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = self.get_client().query(query, job_config=job_config)
+        return {
+            "bytes_processed": job.total_bytes_processed,
+            "tables": [
+                f"{table.project}.{table.dataset_id}.{table.table_id}"
+                for table in job.referenced_tables or []
+            ],
+        }
+
+    def stream(self, query, batch_rows=10000):
+        job = self.get_client().query(query)
+        rows = job.result(page_size=batch_rows)
+        self._local.stats = {"bytes_processed": job.total_bytes_processed}
+        for record_batch in rows.to_arrow_iterable():
+            yield record_batch.to_pandas()
+
+
+# "SCAN t", "SCAN TABLE t", "SEARCH t USING INDEX ..." lines of EXPLAIN QUERY PLAN
+_PLAN_TABLE = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)")
+
+
+class SQLiteExecutor(QueryExecutor):
+    """
+    Local stand-in for BigQuery backed by SQLite, for tests and offline development.
+    """
+
+    def __init__(self, path=":memory:", project_id="local"):
+        self.project_id = project_id
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.queries_run = 0
+
+    def load_table(self, name, df):
+        with self._lock:
+            df.to_sql(name, self.connection, index=False, if_exists="replace")
+
+    def run(self, query):
+        with self._lock:
+            self.queries_run += 1
+            return pd.read_sql_query(query, self.connection)
+
+    def dry_run(self, query):
+        """
+        Estimate from EXPLAIN QUERY PLAN. Every table the plan touches counts in
+        full (rows x average row size, sampled), which is also how BigQuery bills
+        an unpartitioned table, LIMIT or not.
+        """
+        with self._lock:
+            plan = self.connection.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+            known = {
+                row[0]
+                for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+            tables = []
+            for row in plan:
+                match = _PLAN_TABLE.match(row[-1])
+                if match and match.group(2) in known and match.group(2) not in tables:
+                    tables.append(match.group(2))
+
+            bytes_processed = 0
+            for table in tables:
+                rows = self.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                sample = pd.read_sql_query(f'SELECT * FROM "{table}" LIMIT 100', self.connection)
+                row_bytes = sample.memory_usage(index=False, deep=True).sum() / max(len(sample), 1)
+                bytes_processed += int(rows * row_bytes)
+        return {"bytes_processed": bytes_processed, "tables": tables}
+
+    def stream(self, query, batch_rows=10000):
+        with self._lock:
+            self.queries_run += 1
+            self._local.stats = {"bytes_processed": None}
+            cursor = self.connection.execute(query)
+            columns = [c[0] for c in cursor.description or []]
+            try:
+                rows = cursor.fetchmany(batch_rows)
+                # An empty result still yields one batch so the columns survive
+                yield pd.DataFrame.from_records(rows, columns=columns)
+                while rows:
+                    rows = cursor.fetchmany(batch_rows)
+                    if rows:
+                        yield pd.DataFrame.from_records(rows, columns=columns)
+            finally:
+                cursor.close()
@@ -0,0 +1,320 @@
+# module/rate_limiter.py
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from token_counter import count_tokens
+from telemetry import counter, histogram
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# Lower values are served first when a deployment is at its quota
+PRIORITY_INTERACTIVE = 0  # routing, clarification, summaries: a user is waiting
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2  # ingestion embeddings, background compaction
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_DEFAULT: "default", PRIORITY_BULK: "bulk"}
+
+# Completion tokens assumed for a chat call until its usage is known
+DEFAULT_COMPLETION_TOKENS = 400
+
+# Async waiters re-check at least this often, since they are not woken on release
+_ASYNC_POLL_SECONDS = 0.05
+
+rate_limit_wait = histogram("rate_limit_wait_seconds", "Time spent queued for quota before a call")
+rate_limited = counter("rate_limited_total", "Calls rejected by the service with 429 Too Many Requests")
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when quota does not become available within the caller's timeout."""
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def estimate_chat_tokens(request, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    """
+    Up-front token estimate for a chat completion request (the kwargs passed to
+    chat.completions.create): prompt tokens plus the expected completion.
+    """
+    tokens = sum(count_tokens(m.get("content") or "") + 4 for m in request.get("messages", []))
+    if request.get("functions"):
+        tokens += count_tokens(json.dumps(request["functions"]))
+    return tokens + (request.get("max_tokens") or completion_tokens)
+
+
+def usage_tokens(chat_completion):
+    """Total tokens a completion actually used, or None if it did not report usage."""
+    usage = getattr(chat_completion, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def retry_after_seconds(error, default=1.0):
+    """Seconds a 429 asks us to wait, from Retry-After headers on an exception or response."""
+    response = getattr(error, "response", error)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def is_rate_limited(error):
+    """True for a 429 from the OpenAI SDK (RateLimitError) or an httpx response."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding up to per_minute units. A per_minute
+    of None means unlimited. The level may go negative when a call turns out to
+    use more than was reserved; later calls then wait for the debt to refill.
+    """
+
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self.level = float(per_minute or 0)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def clamp(self, amount):
+        """Amounts above capacity could never be granted; treat them as a full bucket."""
+        return min(amount, self.per_minute) if self.per_minute else amount
+
+    def wait_time(self, amount, now):
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        missing = amount - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount, now):
+        if self.per_minute:
+            self._refill(now)
+            self.level -= amount
+
+    def give(self, amount, now):
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.per_minute, self.level + amount)
+
+
+class Reservation:
+    """Quota reserved for one call; settle() corrects the token estimate once usage is known."""
+
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, actual_tokens):
+        if actual_tokens is None:
+            return
+        self.limiter._adjust(self.tokens - actual_tokens)
+        self.tokens = actual_tokens
+
+
+class DeploymentLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one deployment, with
+    callers served in priority order (then arrival order). Only the head of the
+    queue may take quota, so bulk work cannot starve interactive calls by
+    grabbing capacity as it refills. After a 429 the whole deployment pauses
+    for the Retry-After period instead of every caller retrying at once.
+    """
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _wait_time(self, key, tokens, now):
+        """Seconds until key may proceed; None while another caller is ahead of it."""
+        if self._waiters[0] != key:
+            return None
+        return max(
+            self.paused_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+        )
+
+    def _enqueue(self, tokens, priority):
+        key = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, key)
+        return key, self.tokens.clamp(tokens)
+
+    def _grant(self, key, tokens, now):
+        heapq.heappop(self._waiters)
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self._cond.notify_all()
+        return Reservation(self, tokens)
+
+    def _abandon(self, key):
+        if key in self._waiters:
+            self._waiters.remove(key)
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def _record_wait(self, started, priority):
+        rate_limit_wait.observe(
+            time.monotonic() - started, deployment=self.name, priority=PRIORITY_NAMES.get(priority, priority)
+        )
+
+    def acquire(self, tokens, priority=PRIORITY_DEFAULT, timeout=None):
+        """
+        Block until a request slot and tokens are available; returns a Reservation.
+        On an event loop thread it only grants quota that is free right away:
+        waiting there would stall the loop, and async waiters ahead in the queue
+        could never run to take their turn, so it raises instead (use aacquire).
+        """
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            key, tokens = self._enqueue(tokens, priority)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(key, tokens, now)
+                    if wait is not None and wait <= 0:
+                        reservation = self._grant(key, tokens, now)
+                        break
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise RateLimitTimeout(f"No quota for {self.name} within {timeout}s")
+                        wait = min(wait, deadline - now) if wait is not None else deadline - now
+                    if _in_event_loop():
+                        raise RuntimeError(
+                            f"No quota for {self.name} is free and acquire() would block the event loop; "
+                            "await aacquire() instead"
+                        )
+                    self._cond.wait(wait)
+            except BaseException:
+                self._abandon(key)
+                raise
+        self._record_wait(started, priority)
+        return reservation
+
+    async def aacquire(self, tokens, priority=PRIORITY_DEFAULT, timeout=None):
+        """Async counterpart of acquire; waits without blocking the event loop."""
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            key, tokens = self._enqueue(tokens, priority)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    wait = self._wait_time(key, tokens, now)
+                    if wait is not None and wait <= 0:
+                        reservation = self._grant(key, tokens, now)
+                        break
+                if deadline is not None and now >= deadline:
+                    raise RateLimitTimeout(f"No quota for {self.name} within {timeout}s")
+                await asyncio.sleep(min(wait or _ASYNC_POLL_SECONDS, _ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                self._abandon(key)
+            raise
+        self._record_wait(started, priority)
+        return reservation
+
+    def _adjust(self, tokens):
+        """Return unused reserved tokens (positive) or charge an overrun (negative)."""
+        with self._cond:
+            now = time.monotonic()
+            if tokens >= 0:
+                self.tokens.give(tokens, now)
+            else:
+                self.tokens.take(-tokens, now)
+            self._cond.notify_all()
+
+    def throttled(self, retry_after):
+        """Pause the deployment after a 429."""
+        rate_limited.inc(deployment=self.name)
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logger.warning(f"{self.name} was rate limited; pausing calls for {retry_after:.2f}s")
+
+
+class RateLimiter:
+    """
+    Shared per-deployment limiters. Deployments without configured quotas are
+    not throttled up front but still pause after a 429:
+
+        get_rate_limiter().configure("gpt-4o", requests_per_minute=300, tokens_per_minute=50000)
+    """
+
+    def __init__(self):
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, deployment, requests_per_minute=None, tokens_per_minute=None):
+        """Set a deployment's quota. Calls already queued keep waiting on the old limiter."""
+        with self._lock:
+            self.limiters[deployment] = DeploymentLimiter(deployment, requests_per_minute, tokens_per_minute)
+
+    def get(self, deployment):
+        with self._lock:
+            limiter = self.limiters.get(deployment)
+            if limiter is None:
+                limiter = self.limiters[deployment] = DeploymentLimiter(deployment)
+            return limiter
+
+    @contextmanager
+    def reserve(self, deployment, tokens, priority=PRIORITY_DEFAULT, timeout=None):
+        """
+        Wait for quota, then run the block; a 429 raised inside it pauses the deployment.
+        `with limiter.reserve(deployment, tokens) as quota: ...; quota.settle(actual_tokens)`
+        """
+        limiter = self.get(deployment)
+        reservation = limiter.acquire(tokens, priority, timeout)
+        try:
+            yield reservation
+        except Exception as e:
+            if is_rate_limited(e):
+                limiter.throttled(retry_after_seconds(e))
+            raise
+
+    @asynccontextmanager
+    async def areserve(self, deployment, tokens, priority=PRIORITY_DEFAULT, timeout=None):
+        """Async counterpart of reserve."""
+        limiter = self.get(deployment)
+        reservation = await limiter.aacquire(tokens, priority, timeout)
+        try:
+            yield reservation
+        except Exception as e:
+            if is_rate_limited(e):
+                limiter.throttled(retry_after_seconds(e))
+            raise
+
+
+# Limiter shared by every agent in the process.
+_default_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    return _default_rate_limiter
@@ -0,0 +1,132 @@
+# module/result_stream.py
+import math
+import pandas as pd
+from query_cache import dataframe_bytes
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+class ResultSummary:
+    """
+    Per-column statistics accumulated batch by batch, so a result of any size
+    is described in constant memory. Numeric columns merge count/mean/variance
+    with the parallel (Chan) update; every column tracks non-null and null counts.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.truncated = False
+        self.columns = {}
+
+    def update(self, batch):
+        self.rows += len(batch)
+        for name in batch.columns:
+            series = batch[name]
+            stats = self.columns.setdefault(
+                str(name), {"dtype": str(series.dtype), "count": 0, "nulls": 0}
+            )
+            values = series.dropna()
+            stats["nulls"] += len(series) - len(values)
+            if (
+                pd.api.types.is_numeric_dtype(series)
+                and not pd.api.types.is_bool_dtype(series)
+                and len(values)
+            ):
+                self._merge_numeric(stats, values.astype(float))
+            else:
+                stats["count"] += len(values)
+
+    def _merge_numeric(self, stats, values):
+        n_a, n_b = stats["count"], len(values)
+        mean_b = float(values.mean())
+        m2_b = float(((values - mean_b) ** 2).sum())
+        if n_a == 0:
+            stats.update(mean=mean_b, m2=m2_b, min=float(values.min()), max=float(values.max()))
+        else:
+            delta = mean_b - stats["mean"]
+            total = n_a + n_b
+            stats["mean"] += delta * n_b / total
+            stats["m2"] += m2_b + delta * delta * n_a * n_b / total
+            stats["min"] = min(stats["min"], float(values.min()))
+            stats["max"] = max(stats["max"], float(values.max()))
+        stats["count"] = n_a + n_b
+
+    def as_dict(self):
+        columns = {}
+        for name, stats in self.columns.items():
+            column = {k: v for k, v in stats.items() if k != "m2"}
+            if "m2" in stats:
+                column["std"] = math.sqrt(stats["m2"] / stats["count"]) if stats["count"] > 1 else 0.0
+            columns[name] = column
+        return {"rows": self.rows, "truncated": self.truncated, "columns": columns}
+
+
+def collect_result(batches, max_rows=1000, max_bytes=16 * 1024 * 1024, max_scan_rows=None):
+    """
+    Consume DataFrame batches, keeping only the first max_rows rows (and at most
+    max_bytes of them) as a sample. Statistics cover every scanned row; scanning
+    stops after max_scan_rows if set. The sample keeps the query's row order and
+    carries the statistics in sample.attrs["summary"].
+    """
+    summary = ResultSummary()
+    kept, kept_rows, kept_bytes = [], 0, 0
+    columns = None
+    for batch in batches:
+        if columns is None:
+            columns = batch.columns
+        if max_scan_rows is not None and summary.rows + len(batch) > max_scan_rows:
+            batch = batch.iloc[: max_scan_rows - summary.rows]
+            summary.truncated = True
+        summary.update(batch)
+
+        room = max_rows - kept_rows
+        if room > 0 and kept_bytes < max_bytes:
+            part = batch.iloc[:room]
+            part_bytes = dataframe_bytes(part)
+            if kept_bytes + part_bytes > max_bytes and len(part):
+                # Keep as many rows as fit, assuming roughly even row sizes
+                fit = int(len(part) * (max_bytes - kept_bytes) / part_bytes)
+                part = part.iloc[:fit]
+                part_bytes = dataframe_bytes(part)
+            kept.append(part)
+            kept_rows += len(part)
+            kept_bytes += part_bytes
+
+        if summary.truncated:
+            break
+
+    if kept:
+        sample = pd.concat(kept, ignore_index=True)
+    else:
+        sample = pd.DataFrame(columns=columns)
+    sample.attrs["summary"] = summary.as_dict()
+    if summary.rows > len(sample):
+        logger.info(f"Kept a {len(sample)}-row sample of {summary.rows} result rows.")
+    return sample
+
+
+def describe_result(result, preview_rows=20):
+    """
+    Text for prompts and the conversation: a preview of the sample plus the
+    streamed statistics, instead of the whole frame.
+    """
+    if not isinstance(result, pd.DataFrame):
+        return str(result)
+
+    summary = result.attrs.get("summary")
+    total = summary["rows"] if summary else len(result)
+    lines = [result.head(preview_rows).to_string(index=False)]
+    shown = min(len(result), preview_rows)
+    if total > shown:
+        scanned = "at least " if summary and summary["truncated"] else ""
+        lines.append(f"(showing {shown} of {scanned}{total} rows)")
+        # Rows not shown are still described by the column statistics
+        for name, stats in (summary or {}).get("columns", {}).items():
+            if "mean" in stats:
+                lines.append(
+                    f"{name}: mean={stats['mean']:.4g} std={stats['std']:.4g} "
+                    f"min={stats['min']:.4g} max={stats['max']:.4g} nulls={stats['nulls']}"
+                )
+    return "\n".join(lines)
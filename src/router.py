@@ -1,6 +1,14 @@
 # module/router.py
 from common_imports import *
+import json
+import asyncio
+from llm_manager import pooled_client
+from lazy import lazy_property, aload
+from async_bridge import run_sync, iterate_sync
+from telemetry import span, record_llm_usage
+from rate_limiter import get_rate_limiter, estimate_chat_tokens, usage_tokens, PRIORITY_INTERACTIVE
 from conversational_agent import ConversationalAgent
+from pre_router import PreRouter
 
 from clarification_agent import ClarificationAgent
 from logging_config import setup_logger
@@ -29,24 +37,12 @@ class Router:
         self.api_key = api_key
         self.api_base = api_base
         self.api_version = api_version
-        self.client = AzureOpenAI(
-            api_version=api_version, azure_endpoint=api_base, api_key=api_key
-        )
-        self.conversational_agent = ConversationalAgent(
-            embed_api_key,
-            embed_api_base,
-            embed_api_version,
-            embed_gpt_deployment,
-            initial_data_texts,
-            initial_metadata,
-            api_key=api_key,
-            api_base=api_base,
-            api_version=api_version,
-            gpt_deployment=gpt_deployment,
-        )
-        self.clarification_agent = ClarificationAgent(
-            api_key, api_base, api_version, gpt_deployment
-        )
+        self.embed_api_key = embed_api_key
+        self.embed_api_base = embed_api_base
+        self.embed_api_version = embed_api_version
+        self.embed_gpt_deployment = embed_gpt_deployment
+        self.initial_data_texts = initial_data_texts
+        self.initial_metadata = initial_metadata
         logger.info("Initializing Router instance")
 
         # Tweak the summary agent to always run. This is ok if only the knowledge agent runs.
@@ -111,6 +107,37 @@ class Router:
             }
         ]
 
+    # Clients and agents are created on first use to keep worker cold starts short
+
+    client = pooled_client()
+    async_client = pooled_client(asynchronous=True)
+
+    @lazy_property
+    def conversational_agent(self):
+        return ConversationalAgent(
+            self.embed_api_key,
+            self.embed_api_base,
+            self.embed_api_version,
+            self.embed_gpt_deployment,
+            self.initial_data_texts,
+            self.initial_metadata,
+            api_key=self.api_key,
+            api_base=self.api_base,
+            api_version=self.api_version,
+            gpt_deployment=self.gpt_deployment,
+        )
+
+    @lazy_property
+    def clarification_agent(self):
+        return ClarificationAgent(
+            self.api_key, self.api_base, self.api_version, self.gpt_deployment
+        )
+
+    @lazy_property
+    def pre_router(self):
+        """Local rules and similarity classifier that can skip the planner call."""
+        return PreRouter(self.conversational_agent.embedding_client)
+
     def get_user_message(self, question):
         return f"""
             Come up with a plan for the following question: {question}.
@@ -119,134 +146,272 @@ class Router:
            otherwise return a minimum and clean response.
         """
 
+    def ask_user(self, clarifying_question):
+        """Prompt the user on the console for their clarifying response."""
+        print("System clarification question:\n", clarifying_question)
+        return input("\nPlease provide your clarification: ").strip()
+
+    async def _aask_user(self, clarifying_question):
+        # The sync API asks on the console; input() blocks, so keep it off the event loop
+        return await asyncio.to_thread(self.ask_user, clarifying_question)
+
     def clarify_question(self, question):
         """
-        Clarifies the user's question if ambiguity is detected.
-        Handles up to 3 clarification attempts and returns the clarified question.
-        If clarification fails, continues with the original question.
+        Clarifies the user's question if ambiguity is detected, asking the user
+        on the console. If clarification fails, continues with the original question.
         """
-        clarified_question = question
-
-        for attempt in range(3):  # Allow up to 3 clarification attempts
-            logger.info(f"Clarification attempt {attempt + 1}.")
+        return run_sync(self.aclarify_question(question, ask_user=self._aask_user))
 
-            # Detect ambiguity
-            clarification_needed = self.clarification_agent.detect_ambiguity(
-                clarified_question
-            )
+    async def aclarify_question(self, question, ask_user=None):
+        """
+        Single-pass clarification: each assessment returns both the ambiguity
+        verdict and the clarifying question, so an unambiguous question costs
+        exactly one model call. ask_user is an optional coroutine function that
+        returns the user's clarification; without it, ambiguous questions
+        proceed with the best guess. Handles up to 3 clarification attempts and
+        returns the clarified question.
+        """
+        clarified_question = question
 
-            if clarification_needed:
-                logger.info("Ambiguity detected. Asking for clarification.")
+        for attempt in range(1, 4):  # Allow up to 3 clarification attempts
+            logger.info(f"Clarification attempt {attempt}.")
+            assessment = await self.clarification_agent.aassess_query(clarified_question)
 
-                # 1) The LLM generates the clarifying question
-                clarifying_question = self.clarification_agent.clarify_query(
-                    clarified_question
+            if not assessment["needs_clarification"]:
+                logger.info(
+                    "No ambiguity detected. Proceeding with the clarified question."
                 )
+                return clarified_question
+            logger.info("Ambiguity detected. Asking for clarification.")
 
-                if not clarifying_question:
-                    logger.warning(
-                        "No clarification question was generated. Proceeding with the best guess."
-                    )
-                    return clarified_question  # Proceed with the current question
-
-                # 2) Prompt the user for their clarifying response
-                print("System clarification question:\n", clarifying_question)
-                user_clarification = input(
-                    "\nPlease provide your clarification: "
-                ).strip()
-
-                if not user_clarification:
-                    logger.warning(
-                        "User did not provide clarification. Proceeding with the best guess."
-                    )
-                    return clarified_question  # Proceed
-
-                # 3) Append the user's clarification to the question
-                clarified_question = (
-                    f"{clarified_question}\nUser clarified: {user_clarification}"
+            # 1) The clarifying question arrives with the verdict
+            clarifying_question = assessment["clarifying_question"]
+            if not clarifying_question:
+                logger.warning(
+                    "No clarification question was generated. Proceeding with the best guess."
                 )
+                return clarified_question
 
-            else:
-                logger.info(
-                    "No ambiguity detected. Proceeding with the clarified question."
+            # 2) Ask the user for their clarifying response
+            user_clarification = (await ask_user(clarifying_question)).strip() if ask_user else ""
+            if not user_clarification:
+                logger.warning(
+                    "User did not provide clarification. Proceeding with the best guess."
                 )
-                break
+                return clarified_question
 
-        else:
-            logger.warning(
-                "Maximum clarification attempts reached. Proceeding with the best guess."
+            # 3) Append the user's clarification and re-assess
+            clarified_question = (
+                f"{clarified_question}\nUser clarified: {user_clarification}"
             )
 
+        logger.warning(
+            "Maximum clarification attempts reached. Proceeding with the best guess."
+        )
         return clarified_question
 
-    def route_question(self, question):
+    def plan_request(self, question):
+        """Build the chat completion arguments for the planning call."""
+        messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": self.get_user_message(question)},
+        ]
+        return {
+            "model": self.gpt_deployment,
+            "messages": messages,
+            "temperature": 0,
+            "functions": self.functions,
+            "seed": 42,  # Set a seed for reproducibility
+        }
+
+    def parse_plan(self, response):
         """
-        Routes the user's question by orchestrating agent calls.
-        If ambiguity is detected, uses the Clarification Agent to resolve it.
+        Extract the agent calls from the planning response.
+        Returns (agent_calls, error_message); exactly one of them is None.
         """
-        logger.info(f"Received question: {question}")
-
-        # Step 1: Check for ambiguity before clarification
-        if self.clarification_agent.detect_ambiguity(question):
-            logger.info("Ambiguity detected. Invoking clarify_question.")
-            clarified_question = self.clarify_question(question)
-            if clarified_question:
-                # answer_question =   user.input(f"Clarified question: {clarified_question}")
-                logger.info(f"Clarified question: {clarified_question}")
-                question = clarified_question
+        if response.choices[0].message.function_call:
+            function = response.choices[0].message.function_call
+            if function.name == "execute_agent_calls":
+                logger.info(f"Routing question to execute_agent_calls")
+                args = json.loads(function.arguments)
+                return args["agent_calls"], None
             else:
-                logger.warning(
-                    "Failed to clarify the question. Aborting routing process."
+                print(
+                    f"Error: AI returned a function other than execute_agent_calls. \n{response.choices[0].message}"
                 )
-                return "The question could not be clarified. Please refine your query."
+                return None, "AI returned a function other than execute_agent_calls."
         else:
-            logger.info("No ambiguity detected. Proceeding with original question.")
-        # Step 2: Proceed with routing the question
-        system_msg = self.system_message
-        user_msg = self.get_user_message(question)
-        functions = self.functions
+            print(
+                f"Error: AI returned a function other than execute_agent_calls. \n{response.choices[0].message}"
+            )
 
-        messages = [
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": user_msg},
-        ]
+            return None, "AI did not return a function call."
+
+    def _error_message(self, e):
+        """What route_question returns when planning or execution fails."""
+        # openai is imported lazily, so its APIStatusError (429s included) is
+        # recognized by the status code it carries rather than by type
+        if getattr(e, "status_code", None) is not None:
+            return f"Error during classification: {e}"
+        return f"Error parsing: {e}"
 
+    async def _arule_plan(self, question):
         try:
-            response = self.client.chat.completions.create(
-                model=self.gpt_deployment,
-                messages=messages,
-                temperature=0,
-                functions=functions,
-                seed=42,  # Set a seed for reproducibility
-            )
+            # Built in a worker thread on first use: loading it embeds every learned question
+            pre_router = await aload(self, "pre_router")
+            return pre_router.rule_plan(question)
+        except Exception as e:
+            logger.warning(f"Pre-router rules failed, using the planner: {e}")
+            return None
 
-            # Parse response
-            if response.choices[0].message.content:
-                response.choices[0].message.content
-
-            if response.choices[0].message.function_call:
-                function = response.choices[0].message.function_call
-                if function.name == "execute_agent_calls":
-                    logger.info(f"Routing question to execute_agent_calls")
-                    args = json.loads(function.arguments)
-                    agent_calls = args["agent_calls"]
-                    return self.conversational_agent.execute_agent_calls(
-                        agent_calls, question
-                    )
-                else:
-                    print(
-                        f"Error: AI returned a function other than execute_agent_calls. \n{response.choices[0].message}"
-                    )
-                    return "AI returned a function other than execute_agent_calls."
-            else:
-                print(
-                    f"Error: AI returned a function other than execute_agent_calls. \n{response.choices[0].message}"
+    def _learn_plan(self, question, agent_calls):
+        try:
+            self.pre_router.learn(question, agent_calls)
+        except Exception as e:
+            logger.warning(f"Pre-router could not learn the plan: {e}")
+
+    async def _asimilar_plan(self, question):
+        try:
+            pre_router = await aload(self, "pre_router")
+            return await pre_router.asimilar_plan(question)
+        except Exception as e:
+            logger.warning(f"Pre-router lookup failed, using the planner: {e}")
+            return None
+
+    def plan_question(self, question):
+        """
+        Clarify and plan a question. Returns (question, agent_calls, error_message).
+        Glossary questions matched by the pre-router's rules skip both clarification
+        and planning; questions similar enough to previously planned ones skip the
+        planning call. Everything else goes to the LLM planner, and its plan is
+        learned by the pre-router. Sync wrapper over aplan_question.
+        """
+        return run_sync(self.aplan_question(question, ask_user=self._aask_user))
+
+    async def aplan_question(self, question, ask_user=None):
+        """
+        Async implementation of plan_question; see aclarify_question for ask_user.
+        """
+        agent_calls = await self._arule_plan(question)
+        if agent_calls:
+            return question, agent_calls, None
+
+        # Resolve any ambiguity (one assessment call for clear questions)
+        with span("router.clarify"):
+            clarified_question = await self.aclarify_question(question, ask_user=ask_user)
+        if clarified_question:
+            logger.info(f"Clarified question: {clarified_question}")
+        else:
+            logger.warning("Failed to clarify the question. Aborting routing process.")
+            return question, None, "The question could not be clarified. Please refine your query."
+
+        agent_calls = await self._asimilar_plan(clarified_question)
+        if agent_calls:
+            return clarified_question, agent_calls, None
+
+        with span("router.plan", model=self.gpt_deployment) as s:
+            request = self.plan_request(clarified_question)
+            async with get_rate_limiter().areserve(
+                self.gpt_deployment, estimate_chat_tokens(request), PRIORITY_INTERACTIVE
+            ) as quota:
+                response = await self.async_client.chat.completions.create(**request)
+                quota.settle(usage_tokens(response))
+            record_llm_usage(s, response, agent="router", model=self.gpt_deployment)
+        agent_calls, error_message = self.parse_plan(response)
+        if agent_calls:
+            # Learning embeds the question; keep that off the event loop
+            await asyncio.to_thread(self._learn_plan, clarified_question, agent_calls)
+        return clarified_question, agent_calls, error_message
+
+    def route_question(self, question, session_id=None):
+        """
+        Routes the user's question by orchestrating agent calls.
+        If ambiguity is detected, uses the Clarification Agent to resolve it.
+        session_id identifies the conversation (e.g. per user or chat) whose
+        earlier turns give follow-up questions their context; without one the
+        question is answered on its own. Sync wrapper over aroute_question.
+        """
+        return run_sync(self.aroute_question(question, ask_user=self._aask_user, session_id=session_id))
+
+    async def aroute_question(self, question, ask_user=None, session_id=None):
+        """
+        Async implementation of route_question, suitable for serving many
+        concurrent questions from one event loop (e.g. a FastAPI worker).
+        """
+        with span("router.route"):
+            logger.info(f"Received question: {question}")
+
+            try:
+                question, agent_calls, error_message = await self.aplan_question(
+                    question, ask_user=ask_user
                 )
+                if error_message:
+                    return error_message
 
-                return "AI did not return a function call."
+                return await self.conversational_agent.aexecute_agent_calls(
+                    agent_calls, question, session_id=session_id
+                )
 
-        except HttpResponseError as e:
-            return f"Error during classification: {e}"
+            except Exception as e:
+                return self._error_message(e)
 
+    def stream_question(self, question, session_id=None):
+        """
+        Streaming counterpart of route_question. Yields event dicts as the request
+        progresses: "plan" (with the clarified question), then "agent_started",
+        "token" (partial answer text from the knowledge and summary agents) and
+        "agent_finished" per agent, and finally "done" with the result
+        route_question would return, or "error". See streaming.sse_stream for
+        serving it as SSE, and route_question for session_id. Sync wrapper over
+        astream_question.
+        """
+        yield from iterate_sync(
+            self.astream_question(question, ask_user=self._aask_user, session_id=session_id)
+        )
+
+    async def astream_question(self, question, ask_user=None, session_id=None):
+        """
+        Async implementation of stream_question, e.g. for a FastAPI endpoint:
+        StreamingResponse(asse_stream(router.astream_question(q)), media_type="text/event-stream").
+        Stopping iteration early (client disconnect) cancels the remaining agents.
+        """
+        logger.info(f"Received question: {question}")
+        try:
+            question, agent_calls, error_message = await self.aplan_question(
+                question, ask_user=ask_user
+            )
         except Exception as e:
-            return f"Error parsing: {e}"
+            agent_calls, error_message = None, f"Error during planning: {e}"
+        if error_message:
+            yield {"event": "error", "message": error_message}
+            return
+        yield {"event": "plan", "question": question, "agent_calls": agent_calls}
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        finished = object()
+
+        def on_event(event):
+            # SQL and chart agents report from worker threads
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        async def run():
+            try:
+                result = await self.conversational_agent.aexecute_agent_calls(
+                    agent_calls, question, on_event=on_event, session_id=session_id
+                )
+                on_event({"event": "done", "result": result})
+            except Exception as e:
+                on_event({"event": "error", "message": f"Error executing agents: {e}"})
+            finally:
+                on_event(finished)
+
+        task = asyncio.create_task(run())
+        try:
+            while (event := await events.get()) is not finished:
+                yield event
+        finally:
+            if not task.done():
+                task.cancel()
+                # Wait until the agents in flight have been cancelled too (AgentGraph.arun)
+                await asyncio.gather(task, return_exceptions=True)
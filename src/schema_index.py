@@ -0,0 +1,138 @@
+# module/schema_index.py
+import re
+import numpy as np
+from similarity import normalize_rows
+from token_counter import count_tokens
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# Lines that open a table definition, e.g. "CREATE TABLE `proj.ds.views` (" or "Table: views"
+_TABLE_START = re.compile(
+    r"^\s*(?:create\s+(?:or\s+replace\s+)?table\s+|table(?:\s+name)?\s*[:\-]\s*)([`\"\w.\-]+)",
+    re.I,
+)
+
+_TABLE_END = re.compile(r"^\s*\)")
+
+
+def parse_schema(text):
+    """
+    Split a schema description into tables: [{"name", "header", "columns", "footer"}].
+    Tables start at CREATE TABLE / "Table:" lines; without those, blank-line
+    separated blocks are treated as one table each (first line is the header).
+    """
+    lines = text.splitlines()
+    blocks, block = [], []
+    has_headers = any(_TABLE_START.match(line) for line in lines)
+    for line in lines:
+        starts_table = _TABLE_START.match(line) if has_headers else not line.strip()
+        if starts_table and block:
+            blocks.append(block)
+            block = []
+        if line.strip():
+            block.append(line)
+    if block:
+        blocks.append(block)
+
+    tables = []
+    for block in blocks:
+        match = _TABLE_START.match(block[0])
+        name = match.group(1).strip('`"') if match else block[0].strip()
+        columns, footer = block[1:], []
+        # Closing ");" lines belong to the table, not to a column
+        while columns and _TABLE_END.match(columns[-1]):
+            footer.insert(0, columns.pop())
+        tables.append({"name": name, "header": block[0], "columns": columns, "footer": footer})
+    return tables
+
+
+def render_table(table, columns=None):
+    columns = table["columns"] if columns is None else columns
+    return "\n".join([table["header"], *columns, *table["footer"]])
+
+
+class SchemaIndex:
+    """
+    Embedding index over per-table and per-column schema chunks.
+    Chunks are embedded once at startup. retrieve() returns only the tables and
+    columns most relevant to a question, within a token budget, so the prompt
+    stays flat as the warehouse grows. A schema that already fits the budget is
+    returned whole without any embedding call.
+    """
+
+    def __init__(self, schema_text, embedding_client, top_k_tables=5, max_tokens=3000):
+        self.schema_text = schema_text
+        self.embedding_client = embedding_client
+        self.top_k_tables = top_k_tables
+        self.max_tokens = max_tokens
+        self.tables = parse_schema(schema_text)
+        self.fits_budget = count_tokens(schema_text) <= max_tokens
+
+        # chunk_tables[i] is the table of chunk i; chunk_columns[i] its column index (None for the table chunk)
+        self.chunk_tables, self.chunk_columns, texts = [], [], []
+        for t, table in enumerate(self.tables):
+            column_names = ", ".join(line.strip().split()[0] for line in table["columns"] if line.strip())
+            texts.append(f"Table {table['name']}: {column_names}")
+            self.chunk_tables.append(t)
+            self.chunk_columns.append(None)
+            for c, line in enumerate(table["columns"]):
+                texts.append(f"{table['name']}.{line.strip()}")
+                self.chunk_tables.append(t)
+                self.chunk_columns.append(c)
+        self.chunk_tables = np.asarray(self.chunk_tables)
+
+        self.matrix = None
+        if not self.fits_budget and texts:
+            # Built when the SQL agent is first used, i.e. while a user waits:
+            # default priority, not PRIORITY_BULK
+            self.matrix = normalize_rows(self.embedding_client.embed(texts))
+            logger.info(f"Indexed {len(texts)} schema chunks across {len(self.tables)} tables.")
+
+    def _select(self, query_vector):
+        scores = self.matrix @ normalize_rows(query_vector)[0]
+
+        # A table is as relevant as its best chunk
+        table_scores = np.full(len(self.tables), -np.inf, dtype=np.float32)
+        np.maximum.at(table_scores, self.chunk_tables, scores)
+        ranked_tables = np.argsort(-table_scores)[: self.top_k_tables]
+
+        sections, used = [], 0
+        for t in ranked_tables:
+            table = self.tables[t]
+            full = render_table(table)
+            cost = count_tokens(full)
+            if used + cost > self.max_tokens:
+                # Keep the header and the best-scoring columns that still fit
+                column_scores = {
+                    self.chunk_columns[i]: scores[i]
+                    for i in np.flatnonzero(self.chunk_tables == t)
+                    if self.chunk_columns[i] is not None
+                }
+                kept = []
+                cost = count_tokens("\n".join([table["header"], *table["footer"]]))
+                for c in sorted(column_scores, key=column_scores.get, reverse=True):
+                    line_cost = count_tokens(table["columns"][c])
+                    if used + cost + line_cost > self.max_tokens:
+                        break
+                    kept.append(c)
+                    cost += line_cost
+                if used + cost > self.max_tokens:
+                    break
+                full = render_table(table, [table["columns"][c] for c in sorted(kept)])
+            sections.append(full)
+            used += cost
+        return "\n\n".join(sections)
+
+    def retrieve(self, question):
+        """Schema text relevant to the question, within max_tokens."""
+        if self.matrix is None:
+            return self.schema_text
+        return self._select(self.embedding_client.embed([question])[0])
+
+    async def aretrieve(self, question):
+        """Async counterpart of retrieve."""
+        if self.matrix is None:
+            return self.schema_text
+        return self._select((await self.embedding_client.aembed([question]))[0])
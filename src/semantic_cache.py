@@ -0,0 +1,124 @@
+# module/semantic_cache.py
+import os
+import json
+import threading
+import numpy as np
+from similarity import normalize_rows, cosine_top_k
+from atomic_write import write_json_atomic
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+class SemanticSQLCache:
+    """
+    Cache of (question, validated SQL) pairs searched by question embedding.
+    A match at or above reuse_threshold is reused as-is; matches at or above
+    seed_threshold are returned as few-shot examples for the SQL prompt.
+    Keep reuse_threshold high: paraphrases that differ only in a filter
+    ("last week" vs "last month") can still score close to 1.
+    """
+
+    def __init__(
+        self,
+        embedding_client,
+        reuse_threshold=0.97,
+        seed_threshold=0.80,
+        max_entries=5000,
+        path="../output/semantic_cache/sql_cache.json",
+    ):
+        self.embedding_client = embedding_client
+        self.reuse_threshold = reuse_threshold
+        self.seed_threshold = seed_threshold
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = []  # [{"question": ..., "sql": ...}]
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.reused = 0
+        self.seeded = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if path and os.path.isfile(path):
+            entries = self._read(path)
+            if entries:
+                # Question embeddings come from the embedding cache on restart. Loaded
+                # when the SQL agent is first used, so at default priority.
+                vectors = self.embedding_client.embed([e["question"] for e in entries])
+                self._extend(entries, vectors)
+            logger.info(f"Loaded {len(self.entries)} cached question/SQL pairs from {path}")
+
+    def _read(self, path):
+        """Stored pairs, or [] (with a warning) if the file cannot be parsed."""
+        try:
+            with open(path, "r") as f:
+                entries = json.load(f)
+            if not isinstance(entries, list) or not all(
+                isinstance(e, dict) and "question" in e and "sql" in e for e in entries
+            ):
+                raise ValueError("expected a list of question/SQL pairs")
+            return entries
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable semantic SQL cache {path}, starting empty: {e}")
+            return []
+
+    def _extend(self, entries, vectors):
+        with self._lock:
+            rows = normalize_rows(vectors)
+            self.matrix = rows if not self.entries else np.vstack([self.matrix, rows])
+            self.entries.extend(entries)
+            if len(self.entries) > self.max_entries:
+                # Drop the oldest pairs
+                overflow = len(self.entries) - self.max_entries
+                self.entries = self.entries[overflow:]
+                self.matrix = self.matrix[overflow:]
+
+    def _matches(self, query_vector, k):
+        with self._lock:
+            if not self.entries:
+                return []
+            indices, scores = cosine_top_k(self.matrix, query_vector, k)
+            matches = [
+                {"score": float(score), **self.entries[i]}
+                for i, score in zip(indices[0], scores[0])
+                if score >= self.seed_threshold
+            ]
+
+        if matches and matches[0]["score"] >= self.reuse_threshold:
+            self.reused += 1
+        elif matches:
+            self.seeded += 1
+        return matches
+
+    def lookup(self, question, k=3):
+        """Return up to k prior pairs scoring at least seed_threshold, best first."""
+        if not self.entries:
+            return []
+        return self._matches(self.embedding_client.embed([question])[0], k)
+
+    async def alookup(self, question, k=3):
+        """Async counterpart of lookup."""
+        if not self.entries:
+            return []
+        return self._matches((await self.embedding_client.aembed([question]))[0], k)
+
+    def add(self, question, sql):
+        """Remember a question and the SQL that answered it."""
+        if any(e["question"] == question and e["sql"] == sql for e in self.entries):
+            return
+        vector = self.embedding_client.embed([question])[0]
+        self._extend([{"question": question, "sql": sql}], [vector])
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # One writer at a time, so an older copy never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                entries = list(self.entries)
+            write_json_atomic(self.path, entries)
+
+    def stats(self):
+        return {"entries": len(self.entries), "reused": self.reused, "seeded": self.seeded}
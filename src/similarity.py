@@ -0,0 +1,35 @@
+# module/similarity.py
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of matrix with every row scaled to unit length."""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_top_k(normalized_matrix, queries, k):
+    """
+    Vectorized nearest-neighbour search by cosine similarity.
+    normalized_matrix must already have unit-length rows (see normalize_rows);
+    queries may be one vector or a batch. Returns (indices, scores), each of
+    shape (n_queries, min(k, n_rows)), best match first.
+    """
+    queries = normalize_rows(queries)
+    n_rows = normalized_matrix.shape[0]
+    k = min(k, n_rows)
+    if k == 0:
+        empty = np.empty((queries.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    scores = queries @ normalized_matrix.T
+    if k < n_rows:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_rows), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(candidate_scores, order, axis=1)
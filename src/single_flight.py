@@ -0,0 +1,159 @@
+# module/single_flight.py
+import asyncio
+import threading
+from concurrent.futures import Future
+from telemetry import counter
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+single_flight_calls = counter(
+    "single_flight_total",
+    "Calls by group and role: leaders did the work, followers shared an identical in-flight call",
+)
+
+
+# Result given to followers when the call itself was cancelled or interrupted
+# rather than failing: they retry instead of inheriting the cancellation.
+_ABANDONED = object()
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key (the
+    leader) does the work, and callers arriving while it is in flight (the
+    followers) wait for and share its result or exception. Only results and
+    Exceptions are shared; if the call is cancelled or interrupted, followers
+    retry. Nothing is kept after the call finishes; caching completed results
+    is left to the caches. Sync and async callers share the same in-flight table.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._tasks = set()  # running ado() calls, referenced until they finish
+        self.leaders = 0
+        self.deduplicated = 0
+
+    def _join(self, key, wait=True):
+        """
+        Return (future, leader) for key, registering a new call if none is in flight.
+        With wait=False an in-flight call is not joined and (None, False) is returned.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+                leader = True
+            elif not wait:
+                return None, False
+            else:
+                self.deduplicated += 1
+                leader = False
+        single_flight_calls.inc(group=self.name, role="leader" if leader else "follower")
+        return future, leader
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_result(_ABANDONED)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless an identical call (same key) is in flight.
+        Returns (result, shared); shared is True when the result came from another caller.
+        """
+        # Blocking an event loop on an in-flight call could deadlock if its leader
+        # is a coroutine on that same loop, so such callers run on their own
+        while True:
+            future, leader = self._join(key, wait=not _in_event_loop())
+            if future is None:
+                logger.warning(f"{self.name}: sync call inside an event loop; not joining the in-flight call")
+                return fn(*args, **kwargs), False
+            if leader:
+                break
+            result = future.result()
+            if result is not _ABANDONED:
+                return result, True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """
+        Async counterpart of do; fn is a coroutine function. The call runs as a
+        task of its own, so cancelling a caller (the leader included, e.g. when
+        a streaming client disconnects) only detaches that caller; the call
+        carries on for the others.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            # Shielded: a cancelled follower must not cancel the shared future
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            if result is not _ABANDONED:
+                return result, True
+
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._settle(key, future, task))
+        return await asyncio.shield(task), False
+
+    def _settle(self, key, future, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._finish(key, future, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, future, error=task.exception())
+        else:
+            self._finish(key, future, task.result())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "group": self.name,
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "deduplicated": self.deduplicated,
+            }
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def single_flight(name):
+    """The process-wide SingleFlight group with this name."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def single_flight_stats():
+    """Leaders and deduplicated calls for every group, e.g. for a status endpoint."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
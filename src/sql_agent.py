@@ -1,12 +1,19 @@
 # module/sql_agent.py
 from common_imports import *
+import json
+import time
 from base_agent import SuperAgent
-from query_executor import QueryExecutor
+from query_executor import BigQueryExecutor
+from query_cache import get_default_query_cache
+from semantic_cache import SemanticSQLCache
+from schema_index import SchemaIndex
+from few_shot import FewShotIndex, normalize_examples
+from result_stream import collect_result
+from sql_preflight import SQLPreflight
+from telemetry import span, counter
+from single_flight import single_flight
+from async_bridge import run_sync
 
-import pandas_gbq
-import google.auth
-
-credentials, project = google.auth.default()
 project_id = "XXXXX"
 
 from logging_config import setup_logger
@@ -16,23 +23,61 @@ logger = setup_logger(__name__)
 
 logger.info("This is an info log from the current module.")
 
+sql_generated = counter("sql_generated_total", "Queries produced, by source (reused from the semantic cache or generated)")
+sql_queries = counter("sql_queries_total", "Queries sent, by result cache outcome")
+sql_preflight = counter("sql_preflight_total", "Pre-flight decisions, by action")
+query_flight = single_flight("sql_query")
+
 
 class SQLAgent(SuperAgent):
-    def __init__(self, api_key, api_base, api_version, gpt_deployment):
+    # Set to False to always hit the warehouse
+    use_query_cache = True
+
+    # Results are streamed in pages and only a bounded sample is kept (with
+    # statistics over every row in sample.attrs["summary"]); set stream_results
+    # to False to materialize the full frame.
+    stream_results = True
+    max_result_rows = 1000
+    max_result_bytes = 16 * 1024 * 1024
+    max_scan_rows = None
+
+    # Dry-run queries against the byte budget before they run
+    use_preflight = True
+
+    def __init__(
+        self,
+        api_key,
+        api_base,
+        api_version,
+        gpt_deployment,
+        executor=None,
+        query_cache=None,
+        embedding_client=None,
+        preflight=None,
+    ):
         self.api_key = api_key
         self.api_base = api_base
         self.api_version = api_version
         self.gpt_deployment = gpt_deployment
         self.name = "sql_agent"
-        self.client = AzureOpenAI(
-            api_version=self.api_version,
-            azure_endpoint=self.api_base,
-            api_key=self.api_key,
-        )
 
         # Initialize the parent class
         super().__init__("SQL Agent", api_key, api_base, api_version, gpt_deployment)
 
+        # Where queries run (BigQuery by default) and where their results are cached
+        # Default credentials are resolved by the executor on its first query
+        self.executor = executor or BigQueryExecutor(project_id)
+        self.query_cache = query_cache
+        self.preflight = preflight or SQLPreflight(self.executor)
+
+        # Prior (question, validated SQL) pairs, searched by question similarity
+        self.semantic_cache = None
+        if embedding_client is not None:
+            try:
+                self.semantic_cache = SemanticSQLCache(embedding_client)
+            except Exception as e:
+                logger.warning(f"Semantic SQL cache unavailable, generating every query: {e}")
+
         # Load SQL-specific resources
         with open("../data/sql_schema.txt", "r") as f:
             self.table_structure = f.read()
@@ -40,11 +85,43 @@ class SQLAgent(SuperAgent):
         with open("../data/sample_queries.json", "r") as f:
             self.sample_queries = json.load(f)
 
-    def generate_query(self, question):
-        # Start timer
-        start_time = time.time()
+        # Per-table/per-column schema chunks, embedded once so prompts only carry what is relevant
+        self.schema_index = None
+        if embedding_client is not None:
+            try:
+                self.schema_index = SchemaIndex(self.table_structure, embedding_client)
+            except Exception as e:
+                logger.warning(f"Schema index unavailable, using the full schema: {e}")
+
+        # Sample queries indexed by question, so prompts carry only the closest few
+        self.few_shot_index = None
+        if embedding_client is not None:
+            try:
+                self.few_shot_index = FewShotIndex(
+                    normalize_examples(self.sample_queries), embedding_client
+                )
+            except Exception as e:
+                logger.warning(f"Few-shot index unavailable, prompting without samples: {e}")
+
+    async def arelevant_schema(self, question):
+        """Schema text for the tables and columns relevant to the question."""
+        if self.schema_index is None:
+            return self.table_structure
+        try:
+            return await self.schema_index.aretrieve(question)
+        except Exception as e:
+            logger.warning(f"Schema retrieval failed, using the full schema: {e}")
+            return self.table_structure
+
+    def build_prompts(self, question, examples=None, table_structure=None):
+        """
+        Prepare the system and user prompts for query generation.
+        examples are {"question": ..., "sql": ...} pairs shown as few-shot references;
+        table_structure defaults to the full schema.
+        """
+        if table_structure is None:
+            table_structure = self.table_structure
 
-        # Prepare the system and user prompts
         system_prompt = (
             "You are an expert data analyst specializing in Google Cloud's BigQuery. "
             "Your task is to generate efficient, optimized, and accurate BigQuery SQL queries based on the user's input. "
@@ -53,18 +130,80 @@ class SQLAgent(SuperAgent):
 
         user_prompt = (
             f"Here is the table structure and a sample query for reference:\n\n"
-            f"Table Structure:\n{self.table_structure}\n\n"
+            f"Table Structure:\n{table_structure}\n\n"
             "Example Query:\n"
-            
+            f"{self.format_examples(examples)}"
+            f"\nBusiness Question: {question}\n\n"
             "Generate the SQL query to answer the business question. Only return the SQL code without formatting, code block delimiters, or backticks."
             "Avoid using reserved keywords as aliases."
         )
+        return system_prompt, user_prompt
+
+    def format_examples(self, examples):
+        return "".join(
+            f"Question: {example['question']}\nSQL: {example['sql']}\n\n"
+            for example in examples or []
+        )
+
+    async def asample_examples(self, question, matches=()):
+        """Sample queries most similar to the question, skipping SQL already in matches."""
+        if self.few_shot_index is None:
+            return []
+        try:
+            return await self.few_shot_index.aretrieve(question, {m["sql"] for m in matches})
+        except Exception as e:
+            logger.warning(f"Few-shot retrieval failed: {e}")
+            return []
+
+    def _reusable(self, matches):
+        """Return the SQL of a near-identical prior question, if there is one."""
+        if matches and matches[0]["score"] >= self.semantic_cache.reuse_threshold:
+            logger.info(
+                f"Reusing SQL from a prior question (similarity {matches[0]['score']:.3f})."
+            )
+            return matches[0]["sql"]
+        return None
+
+    async def asimilar_queries(self, question):
+        """Prior validated queries for similar questions; empty if unavailable."""
+        if self.semantic_cache is None:
+            return []
+        try:
+            return await self.semantic_cache.alookup(question)
+        except Exception as e:
+            logger.warning(f"Semantic SQL cache lookup failed: {e}")
+            return []
 
+    def remember_query(self, question, sql):
+        """Store a validated query so similar questions can reuse it."""
+        if self.semantic_cache is None or not sql:
+            return
         try:
-            # Use the parent class method to call GPT
-            query = self.call_gpt(user_prompt, system_prompt)
+            self.semantic_cache.add(question, sql)
+        except Exception as e:
+            logger.warning(f"Could not store query in the semantic SQL cache: {e}")
+
+    def generate_query(self, question):
+        """SQL answering the question; sync wrapper over agenerate_query."""
+        return run_sync(self.agenerate_query(question))
+
+    async def agenerate_query(self, question):
+        matches = await self.asimilar_queries(question)
+        reused = self._reusable(matches)
+        if reused:
+            sql_generated.inc(source="reused")
+            return reused
+        sql_generated.inc(source="llm")
+
+        system_prompt, user_prompt = self.build_prompts(
+            question,
+            examples=matches + await self.asample_examples(question, matches),
+            table_structure=await self.arelevant_schema(question),
+        )
+
+        try:
+            query = await self.acall_gpt(user_prompt, system_prompt)
             if query:
-                # Ensure query is not None or empty
                 return query
 
             else:
@@ -74,27 +213,96 @@ class SQLAgent(SuperAgent):
             print(f"An error occurred while generating the query: {e}")
             return None
 
-        # End timer and calculate execution time
-        execution_time = time.time() - start_time
-        print(f"Execution time: {round(execution_time, 2)} seconds")
+    def get_query_cache(self):
+        """Return the query result cache, or None if caching is off."""
+        if not self.use_query_cache:
+            return None
+        return self.query_cache if self.query_cache is not None else get_default_query_cache()
+
+    def fetch_result(self, query):
+        if not self.stream_results:
+            return self.executor.run(query)
+        return collect_result(
+            self.executor.stream(query),
+            max_rows=self.max_result_rows,
+            max_bytes=self.max_result_bytes,
+            max_scan_rows=self.max_scan_rows,
+        )
 
-        return query
+    def preflight_query(self, query):
+        """
+        Check a query against the byte budget before sending it.
+        Returns an error message when the query is rejected, else None.
+        """
+        if not self.use_preflight or not isinstance(query, str):
+            return None
+
+        with span("sql.preflight") as s:
+            check = self.preflight.check(query)
+            estimate = check["estimate"] or {}
+            s.set(action=check["action"], estimated_bytes=estimate.get("bytes_processed"), tables=estimate.get("tables"))
+        sql_preflight.inc(action=check["action"])
+        if check["action"] == "rejected":
+            print(f"Preflight Error: {check['reason']}")
+            return f"Preflight Error: {check['reason']}"
+        return None
 
     def send_query(self, query):
-        try:
-            indata = pandas_gbq.read_gbq(
-                query,
-                project_id="project_id",
-                credentials=credentials,
-                progress_bar_type=None,
-                progress_bar_type="tqdm_notebook",
+        """
+        Run a query and return its result, or an error message. A cached result
+        is returned without a dry run; only cache misses are checked against
+        the byte budget (preflight_query), and rejected queries are not run.
+        """
+        with span("sql.execute", project=self.executor.project_id) as s:
+            query_cache = self.get_query_cache()
+            if query_cache is not None:
+                cached = query_cache.get(self.executor.project_id, query)
+                if cached is not None:
+                    logger.info("Query result cache hit.")
+                    s.set(cache="hit", rows=len(cached))
+                    sql_queries.inc(cache="hit")
+                    return cached
+            s.set(cache="miss")
+            sql_queries.inc(cache="miss")
+
+            rejection = self.preflight_query(query)
+            if rejection:
+                s.set(error=rejection)
+                return rejection
+
+            # The same query already running for another caller is waited for, not re-run
+            indata, shared = query_flight.do(
+                (self.executor.project_id, query), self._run_query, query, query_cache, s
             )
+            s.set(coalesced=shared)
+            if shared and hasattr(indata, "copy"):
+                indata = indata.copy()  # callers may modify their frame, as with cache hits
+            return indata
+
+    def _run_query(self, query, query_cache, active_span):
+        try:
+            started = time.perf_counter()
+            indata = self.fetch_result(query)
             if len(indata) == 0:
                 message = "Data returned no records, try again."
                 print(message)  # Standard output
 
-        except pandas_gbq.gbq.GenericGBQException as e:
-            return f"General Error: {e}"
         except Exception as e:
             print(f"General Error: {e}")
+            active_span.set(error=str(e))
+            return f"General Error: {e}"
+
+        # Actual cost next to the pre-flight estimate
+        stats = self.executor.last_stats() or {}
+        rows = indata.attrs.get("summary", {}).get("rows", len(indata))
+        active_span.set(rows=rows, bytes_processed=stats.get("bytes_processed"))
+        self.preflight.record(
+            query,
+            rows=rows,
+            bytes_processed=stats.get("bytes_processed"),
+            seconds=time.perf_counter() - started,
+        )
+
+        if query_cache is not None:
+            query_cache.put(self.executor.project_id, query, indata)
         return indata
@@ -0,0 +1,123 @@
+# module/sql_preflight.py
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from query_cache import normalize_sql
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+class SQLPreflight:
+    """
+    Dry-runs generated SQL before it reaches the warehouse.
+    Queries estimated above max_bytes are rejected with the tables they scan.
+    They are not rewritten with a LIMIT: BigQuery bills the columns it reads
+    across the whole table, so only partition or clustering filters and fewer
+    columns lower the cost. Estimates are kept until
+    the query runs, then written next to the actual rows/bytes/seconds so the
+    budget can be tuned from real numbers.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_bytes=10 * 1024**3,
+        log_path="../output/sql_preflight/estimates.jsonl",
+        max_pending=256,
+    ):
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.log_path = log_path
+        self.max_pending = max_pending
+        self.records = deque(maxlen=1000)
+        self.rejected = 0
+        self._pending = OrderedDict()  # normalized query -> check result
+        self._lock = threading.Lock()
+        if log_path and os.path.dirname(log_path):
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    def estimate(self, query):
+        try:
+            return self.executor.dry_run(query)
+        except NotImplementedError:
+            return None
+        except Exception as e:
+            # An invalid query fails the same way when it runs; let the debugger see that error
+            logger.warning(f"Dry run failed: {e}")
+            return {"bytes_processed": None, "tables": [], "error": str(e)}
+
+    def _within_budget(self, estimate):
+        return (
+            estimate is None
+            or estimate.get("bytes_processed") is None
+            or estimate["bytes_processed"] <= self.max_bytes
+        )
+
+    def check(self, query):
+        """
+        Returns {"action": "ok" | "rejected", "query", "estimate", "reason"}.
+        """
+        estimate = self.estimate(query)
+        result = {"action": "ok", "query": query, "estimate": estimate, "reason": None}
+
+        if not self._within_budget(estimate):
+            tables = ", ".join(estimate.get("tables") or []) or "unknown tables"
+            result.update(
+                action="rejected",
+                reason=(
+                    f"Query would scan {format_bytes(estimate['bytes_processed'])}, "
+                    f"above the {format_bytes(self.max_bytes)} budget (tables: {tables}). "
+                    "A LIMIT does not reduce the bytes scanned; filter on partition or "
+                    "clustering columns, or select fewer columns."
+                ),
+            )
+            self.rejected += 1
+            logger.warning(result["reason"])
+
+        with self._lock:
+            self._pending[normalize_sql(result["query"])] = result
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+        return result
+
+    def record(self, query, rows=None, bytes_processed=None, seconds=None):
+        """Log the actuals of a query that ran next to its pre-flight estimate."""
+        with self._lock:
+            check = self._pending.pop(normalize_sql(query), None)
+        estimate = (check or {}).get("estimate") or {}
+        record = {
+            "time": time.time(),
+            "query": query,
+            "action": check["action"] if check else None,
+            "estimated_bytes": estimate.get("bytes_processed"),
+            "tables": estimate.get("tables"),
+            "actual_bytes": bytes_processed,
+            "rows": rows,
+            "seconds": seconds,
+        }
+        self.records.append(record)
+        if self.log_path:
+            try:
+                with self._lock, open(self.log_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write pre-flight record to {self.log_path}: {e}")
+        return record
+
+    def stats(self):
+        return {
+            "rejected": self.rejected,
+            "recorded": len(self.records),
+        }
@@ -0,0 +1,23 @@
+# module/streaming.py
+import json
+
+
+def format_sse(event):
+    """
+    Encode one event dict as a server-sent event: the "event" field names the
+    SSE event type and the whole dict is sent as JSON data.
+    """
+    payload = json.dumps(event, default=str)
+    return f"event: {event.get('event', 'message')}\ndata: {payload}\n\n"
+
+
+def sse_stream(events):
+    """Wrap Router.stream_question events for a text/event-stream response."""
+    for event in events:
+        yield format_sse(event)
+
+
+async def asse_stream(events):
+    """Async counterpart of sse_stream, for Router.astream_question."""
+    async for event in events:
+        yield format_sse(event)
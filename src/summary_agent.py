@@ -1,6 +1,9 @@
 # module/summary_agent.py
 import pprint
 from base_agent import SuperAgent
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_BULK
+from conversation_buffer import ConversationBuffer
+from async_bridge import run_sync, iterate_sync
 from logging_config import setup_logger
 
 # Set up the logger for this module
@@ -9,19 +12,38 @@ logger.info("This is an info log from the current module.")
 
 
 class SummaryAgent(SuperAgent):
+    # Token budgets for the conversation inlined into the prompt
+    max_conversation_tokens = 3000
+    max_entry_tokens = 800
+    priority = PRIORITY_INTERACTIVE
+
     def __init__(self, api_key, api_base, api_version, gpt_deployment):
         self.api_key = api_key
         self.api_base = api_base
         self.api_version = api_version
         self.gpt_deployment = gpt_deployment
-        self.name = "sql_agent"
+        self.name = "summary_agent"
 
         # Initialize the parent class
         super().__init__(
             "Summary Agent", api_key, api_base, api_version, gpt_deployment
         )
 
-    def generate_summary(self, conversation):
+    def new_conversation(self, summarizer=None):
+        """An empty conversation buffer sized for this agent's prompt."""
+        return ConversationBuffer(
+            max_tokens=self.max_conversation_tokens,
+            entry_tokens=self.max_entry_tokens,
+            summarizer=summarizer,
+        )
+
+    def build_prompts(self, conversation):
+        # Raw lists are budgeted too, so large agent outputs cannot blow up the prompt
+        if not isinstance(conversation, ConversationBuffer):
+            entries = conversation
+            conversation = self.new_conversation()
+            conversation.extend(entries)
+
         # Prepare the system and user prompts
 
         system_prompt = """           
@@ -37,14 +59,37 @@ class SummaryAgent(SuperAgent):
             Below is the information shared by other agents in the conversation. Summarize the key insights in 2 sentences or fewer, 
             focusing only on the results and findings without mentioning how the analysis was conducted or referring to data sources or processes.
 
-            Conversation: {conversation}
+            Conversation: {conversation.render()}
+            """
+        return system_prompt, user_prompt
+
+    def condense(self, text):
+        """
+        Condense earlier turns of a session into a short paragraph; used as the
+        summarizer of the rolling session history.
+        """
+        system_prompt = """
+            You condense chat history for an analytics assistant. Keep the questions asked,
+            key figures and conclusions; drop everything else.
             """
+        user_prompt = f"""
+            Condense the following conversation into at most 4 sentences.
+
+            Conversation: {text}
+            """
+        # Compaction happens after the answer is out; let waiting users go first
+        return self.call_gpt(user_prompt, system_prompt, priority=PRIORITY_BULK)
+
+    def generate_summary(self, conversation):
+        """Sync wrapper over agenerate_summary."""
+        return run_sync(self.agenerate_summary(conversation))
+
+    async def agenerate_summary(self, conversation):
+        system_prompt, user_prompt = self.build_prompts(conversation)
 
         try:
-            # Use the parent class method to call GPT
-            query = self.call_gpt(user_prompt, system_prompt)
+            query = await self.acall_gpt(user_prompt, system_prompt)
             if query:
-                # Ensure query is not None or empty
                 pprint.pprint(query)
                 return query
 
@@ -55,5 +100,15 @@ class SummaryAgent(SuperAgent):
             print(f"An error occurred while generating the query: {e}")
             return None
 
+    def stream_summary(self, conversation):
+        """Yield the summary text as it is generated."""
+        yield from iterate_sync(self.astream_summary(conversation))
+
+    async def astream_summary(self, conversation):
+        """Async implementation of stream_summary."""
+        system_prompt, user_prompt = self.build_prompts(conversation)
+        async for text in self.astream_gpt(user_prompt, system_prompt):
+            yield text
+
 
 #        return query
@@ -0,0 +1,268 @@
+# module/telemetry.py
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The span enclosing the current code; asyncio tasks and asyncio.to_thread inherit it
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label key -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self.values.get(_label_key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as {type(metric).__name__}")
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.start_time = time.time()
+        self.duration = None
+        self.status = "ok"
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name, amount=1):
+        """Increment a numeric attribute, e.g. retries."""
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_seconds": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Keeps the most recent finished spans in memory. Spans nest through a
+    context variable, so an agent's LLM and SQL calls appear under the agent
+    span, which appears under the request that planned it.
+    """
+
+    def __init__(self, registry, max_spans=10000, export_path=None):
+        self.registry = registry
+        self.spans = deque(maxlen=max_spans)
+        self.export_path = export_path
+        self._lock = threading.Lock()
+        self.durations = registry.histogram(
+            "stage_duration_seconds", "Wall-clock time per pipeline stage"
+        )
+        self.errors = registry.counter("stage_errors_total", "Stages that raised")
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.set(error=f"{type(e).__name__}: {e}")
+            self.errors.inc(stage=name)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration = time.perf_counter() - span._started
+            self.durations.observe(span.duration, stage=name)
+            self._finish(span)
+
+    def record(self, name, started, status="ok", **attributes):
+        """
+        Record a stage that already finished, timed from started (time.perf_counter()).
+        For generators, which must not hold a span open across yields: the
+        context variable would leak into the consumer between chunks.
+        """
+        span = Span(name, attributes, _current_span.get())
+        span.start_time -= time.perf_counter() - started
+        span.duration = time.perf_counter() - started
+        span.status = status
+        if status != "ok":
+            self.errors.inc(stage=name)
+        self.durations.observe(span.duration, stage=name)
+        self._finish(span)
+        return span
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+        if self.export_path:
+            try:
+                with self._lock, open(self.export_path, "a") as f:
+                    f.write(json.dumps(span.as_dict(), default=str) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not export span to {self.export_path}: {e}")
+
+    def export(self, trace_id=None):
+        """Finished spans as JSON-ready dicts, optionally for one trace only."""
+        with self._lock:
+            spans = list(self.spans)
+        return [s.as_dict() for s in spans if trace_id is None or s.trace_id == trace_id]
+
+    def export_json(self, path, trace_id=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.export(trace_id), f, indent=2, default=str)
+
+
+_registry = MetricsRegistry()
+_tracer = Tracer(_registry)
+
+
+def get_registry():
+    return _registry
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attributes):
+    """Time a block as a stage of the default tracer: `with span("sql.execute") as s: ...`"""
+    return _tracer.span(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def counter(name, help_text=""):
+    return _registry.counter(name, help_text)
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS):
+    return _registry.histogram(name, help_text, buckets)
+
+
+def record_llm_usage(active_span, chat_completion, **labels):
+    """Copy token usage from a chat completion onto a span and the token counters."""
+    usage = getattr(chat_completion, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    active_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    tokens = counter("llm_tokens_total", "Tokens sent to and received from the LLM")
+    tokens.inc(prompt_tokens, kind="prompt", **labels)
+    tokens.inc(completion_tokens, kind="completion", **labels)
@@ -0,0 +1,50 @@
+# module/token_counter.py
+import threading
+import tiktoken
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Rough characters-per-token ratio for English text, used when the tiktoken
+# encoding files cannot be loaded (e.g. no network access to download them).
+APPROX_CHARS_PER_TOKEN = 4
+
+_encodings = {}
+_lock = threading.Lock()
+
+
+def get_encoding(name=DEFAULT_ENCODING):
+    """Return the cached tiktoken encoding, or None if it cannot be loaded."""
+    with _lock:
+        if name not in _encodings:
+            try:
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(
+                    f"Could not load tiktoken encoding {name}, estimating token counts instead: {e}"
+                )
+                _encodings[name] = None
+        return _encodings[name]
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    text = str(text)
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return -(-len(text) // APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens, encoding_name=DEFAULT_ENCODING):
+    """Cut text down to at most max_tokens tokens."""
+    text = str(text)
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return text[: max_tokens * APPROX_CHARS_PER_TOKEN]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,134 @@
+# module/vector_snapshot.py
+import os
+import json
+import uuid
+import numpy as np
+from similarity import normalize_rows
+from atomic_write import write_json_atomic
+from datetime import datetime
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+# A snapshot is a pair of files named by version (embeddings-<v>.npy and
+# records-<v>.json) plus a manifest naming the current pair. Writers create a
+# new pair and then swap the manifest in one step, so readers always get
+# vectors and records from the same save. Snapshots written before the
+# manifest existed are plain embeddings.npy + records.json and still load.
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+RECORDS_FILE = "records.json"
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _snapshot_files(directory):
+    """(embeddings path, records path) of the current snapshot."""
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        return os.path.join(directory, EMBEDDINGS_FILE), os.path.join(directory, RECORDS_FILE)
+    return os.path.join(directory, manifest["embeddings"]), os.path.join(directory, manifest["records"])
+
+
+def snapshot_exists(directory):
+    return all(os.path.isfile(path) for path in _snapshot_files(directory))
+
+
+def save_snapshot(directory, ids, embeddings, documents, metadatas, dtype="float32", extra=None):
+    """
+    Persist a collection as a binary embedding matrix (.npy) plus a JSON file
+    with ids, documents and metadata. dtype may be "float32" or "float16".
+    Rows are stored unit-normalized, so a float32 snapshot can back a numpy
+    vector store without being copied (see VectorStore.adopt). Both files are
+    written under a new version and published together by replacing the
+    manifest, so readers never pair vectors and records from different saves.
+    """
+    os.makedirs(directory, exist_ok=True)
+    matrix = np.asarray(embeddings)
+    if matrix.size:
+        matrix = normalize_rows(matrix)
+    matrix = np.ascontiguousarray(matrix.astype(dtype, copy=False))
+
+    records = {
+        "ids": list(ids),
+        "documents": list(documents),
+        "metadatas": list(metadatas),
+        "dtype": str(matrix.dtype),
+        "normalized": True,
+        "count": int(matrix.shape[0]),
+        "dimension": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "timestamp": datetime.now().isoformat(),
+    }
+    records.update(extra or {})
+    if len(records["ids"]) != records["count"]:
+        raise ValueError(f"{len(records['ids'])} ids for {records['count']} embeddings")
+
+    previous = _snapshot_files(directory)
+    version = uuid.uuid4().hex[:12]
+    manifest = {"embeddings": f"embeddings-{version}.npy", "records": f"records-{version}.json"}
+    np.save(os.path.join(directory, manifest["embeddings"]), matrix)
+    write_json_atomic(os.path.join(directory, manifest["records"]), records)
+    write_json_atomic(os.path.join(directory, MANIFEST_FILE), manifest)
+
+    # Readers that already opened the old files keep them (the mapping survives unlinking)
+    for path in previous:
+        _remove(path)
+    logger.info(f"Saved snapshot of {records['count']} vectors to {directory}")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load_snapshot(directory, mmap=True):
+    """
+    Load a snapshot. With mmap=True the embedding matrix is memory-mapped
+    read-only, so loading is near-instant and pages are shared between
+    worker processes through the OS page cache.
+    """
+    for attempt in range(3):
+        embeddings_path, records_path = _snapshot_files(directory)
+        try:
+            with open(records_path, "r") as f:
+                records = json.load(f)
+            embeddings = np.load(embeddings_path, mmap_mode="r" if mmap else None)
+            break
+        except FileNotFoundError:
+            # A concurrent save replaced this version between reading the manifest and the files
+            if attempt == 2:
+                raise
+
+    if len(embeddings) != len(records["ids"]):
+        raise ValueError(
+            f"Snapshot in {directory} has {len(embeddings)} vectors but {len(records['ids'])} records"
+        )
+    records["embeddings"] = embeddings
+    return records
+
+
+def import_legacy_json(json_path):
+    """
+    Read the old indent=4 JSON dump of a Chroma collection.
+    Only used once to migrate to the binary snapshot format.
+    """
+    with open(json_path, "r") as f:
+        data = json.load(f)
+
+    embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+    ids = data.get("ids") or [f"vector_{i}" for i in range(len(embeddings))]
+    return {
+        "ids": ids,
+        "embeddings": embeddings,
+        "documents": data["documents"],
+        "metadatas": data["metadatas"],
+    }
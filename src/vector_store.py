@@ -0,0 +1,342 @@
+# module/vector_store.py
+import threading
+import numpy as np
+from similarity import normalize_rows, cosine_top_k
+from logging_config import setup_logger
+
+# Set up the logger for this module
+logger = setup_logger(__name__)
+
+
+def _as_batch(query_embeddings):
+    """One query vector or a batch of them, as a 2-D float32 array."""
+    return np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+
+
+class VectorStore:
+    """
+    The collection interface KnowledgeAgent works against, a subset of a Chroma
+    collection's: add, get, delete, count and query. Results use Chroma's
+    shapes; query returns one list per query vector and cosine distances.
+    """
+
+    # Largest add() batch accepted, or None for no limit
+    max_batch_size = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def add(self, ids, documents, embeddings, metadatas=None):
+        raise NotImplementedError
+
+    def adopt(self, ids, documents, embeddings, metadatas=None):
+        """
+        Fill an empty store with unit-normalized vectors, using the given array
+        as-is when the backend can (e.g. a memory-mapped snapshot). Returns
+        False when the backend cannot, in which case callers add() them instead.
+        """
+        return False
+
+    def get(self, include=("documents", "metadatas")):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=10):
+        raise NotImplementedError
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact search held in process: one normalized float32 matrix, searched for a
+    whole batch of queries with a single matmul plus argpartition
+    (similarity.cosine_top_k). Vectors are stored unit-normalized, so get()
+    returns normalized embeddings (Azure OpenAI embeddings already are).
+    Safe to share between threads: writes, the lazy matrix merge and (in
+    IVFVectorStore) lazy training hold the store's lock.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.positions = {}  # id -> row
+        self._blocks = []  # normalized rows added since the matrix was last consolidated
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.RLock()
+
+    @property
+    def matrix(self):
+        # Batches are stacked once, on first read, instead of on every add()
+        with self._lock:
+            if self._blocks:
+                blocks = ([self._matrix] if len(self._matrix) else []) + self._blocks
+                self._matrix = np.vstack(blocks)
+                self._blocks = []
+                self._changed()
+            return self._matrix
+
+    def _changed(self):
+        """Hook for subclasses whose derived structures depend on the matrix."""
+
+    def add(self, ids, documents, embeddings, metadatas=None):
+        ids = [str(i) for i in ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"Duplicate ids in {self.name}: within the batch")
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        rows = normalize_rows(embeddings)
+        if len(rows) != len(ids) or len(documents) != len(ids) or len(metadatas) != len(ids):
+            raise ValueError("ids, documents, embeddings and metadatas must have the same length")
+
+        with self._lock:
+            duplicates = [i for i in ids if i in self.positions]
+            if duplicates:
+                raise ValueError(f"Duplicate ids in {self.name}: {duplicates[:5]}")
+            start = len(self.ids)
+            self.positions.update((doc_id, start + i) for i, doc_id in enumerate(ids))
+            self.ids.extend(ids)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self._blocks.append(rows)
+
+    def adopt(self, ids, documents, embeddings, metadatas=None):
+        # Searches only read the matrix, so a read-only memory map can back it
+        # directly; add() and delete() build a new in-memory matrix.
+        if embeddings.dtype != np.float32 or embeddings.ndim != 2:
+            return False
+        if len(embeddings) != len(ids) or len(documents) != len(ids):
+            return False
+        with self._lock:
+            if self.ids:
+                return False
+            self.ids = [str(i) for i in ids]
+            self.documents = list(documents)
+            self.metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+            self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self._matrix = embeddings
+            self._changed()
+        return True
+
+    def get(self, include=("documents", "metadatas")):
+        result = {"ids": list(self.ids)}
+        if "documents" in include:
+            result["documents"] = list(self.documents)
+        if "metadatas" in include:
+            result["metadatas"] = list(self.metadatas)
+        if "embeddings" in include:
+            result["embeddings"] = self.matrix
+        return result
+
+    def delete(self, ids):
+        with self._lock:
+            doomed = {self.positions[i] for i in ids if i in self.positions}
+            if not doomed:
+                return
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[list(doomed)] = False
+            matrix = self.matrix[keep]
+            self.ids = [v for v, k in zip(self.ids, keep) if k]
+            self.documents = [v for v, k in zip(self.documents, keep) if k]
+            self.metadatas = [v for v, k in zip(self.metadatas, keep) if k]
+            self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self._matrix = matrix
+            self._changed()
+
+    def count(self):
+        return len(self.ids)
+
+    def _index(self):
+        """What a search reads, taken under the lock so it is consistent."""
+        return self.matrix
+
+    def _search(self, index, queries, k):
+        return cosine_top_k(index, queries, k)
+
+    def search(self, queries, k):
+        """(indices, scores) of the k best rows per query, best first."""
+        with self._lock:
+            index = self._index()
+        return self._search(index, queries, k)
+
+    def query(self, query_embeddings, n_results=10):
+        queries = _as_batch(query_embeddings)
+        # delete() replaces these lists, so rows found in this index map to these ids
+        with self._lock:
+            index = self._index()
+            ids, documents, metadatas = self.ids, self.documents, self.metadatas
+        if not ids:
+            empty = [[] for _ in range(len(queries))]
+            return {"ids": empty, "documents": empty, "metadatas": empty, "distances": empty}
+        indices, scores = self._search(index, queries, n_results)
+        return {
+            "ids": [[ids[i] for i in row if i >= 0] for row in indices],
+            "documents": [[documents[i] for i in row if i >= 0] for row in indices],
+            "metadatas": [[metadatas[i] for i in row if i >= 0] for row in indices],
+            "distances": [
+                [float(1 - s) for i, s in zip(row, row_scores) if i >= 0]
+                for row, row_scores in zip(indices, scores)
+            ],
+        }
+
+    def memory_bytes(self):
+        """Bytes held by the vectors (documents and metadata not included)."""
+        return self.matrix.nbytes
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """
+    Approximate search for larger corpora: an inverted file over spherical
+    k-means clusters. Each query scores the n_lists centroids, then searches
+    exactly within its n_probe closest clusters. Corpora smaller than
+    min_train_size are searched exhaustively; the clustering is retrained
+    lazily after the contents change.
+    """
+
+    def __init__(self, name, n_lists=None, n_probe=8, min_train_size=2000, iterations=10, seed=0):
+        super().__init__(name)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists = None  # cluster -> row indices
+
+    def _changed(self):
+        self.centroids = None
+        self.lists = None
+
+    def _assign(self, matrix, centroids, chunk=16384):
+        # Chunked so the (rows x clusters) score matrix stays small
+        return np.concatenate(
+            [np.argmax(matrix[start : start + chunk] @ centroids.T, axis=1) for start in range(0, len(matrix), chunk)]
+        )
+
+    def train(self):
+        with self._lock:
+            self._train(self.matrix)
+
+    def _train(self, matrix):
+        n = len(matrix)
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(self.seed)
+        # Train on a sample; k-means converges long before it has seen every row
+        sample = matrix[rng.choice(n, size=min(n, n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(sample[np.argsort(assignment, kind="stable")], starts[~empty], axis=0)
+            # Re-seed empty clusters with random sample points
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        assignment = self._assign(matrix, centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = [order[bounds[c] : bounds[c + 1]] for c in range(n_lists)]
+        logger.info(f"Trained IVF index for {self.name}: {n} vectors in {n_lists} lists")
+
+    def _index(self):
+        # The clustering is read with the matrix it was trained on
+        matrix = self.matrix
+        if len(matrix) < self.min_train_size:
+            return matrix, None, None
+        if self.centroids is None:
+            self._train(matrix)
+        return matrix, self.centroids, self.lists
+
+    def _search(self, index, queries, k):
+        matrix, centroids, lists = index
+        if centroids is None:
+            return cosine_top_k(matrix, queries, k)
+
+        queries = normalize_rows(queries)
+        n_probe = min(self.n_probe, len(centroids))
+        probes = np.argpartition(-(queries @ centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        k = min(k, len(matrix))
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, clusters in enumerate(probes):
+            candidates = np.concatenate([lists[c] for c in clusters])
+            if not len(candidates):
+                continue
+            found, found_scores = cosine_top_k(matrix[candidates], queries[q], k)
+            indices[q, : found.shape[1]] = candidates[found[0]]
+            scores[q, : found.shape[1]] = found_scores[0]
+        return indices, scores
+
+    def memory_bytes(self):
+        extra = 0
+        if self.centroids is not None:
+            extra = self.centroids.nbytes + sum(l.nbytes for l in self.lists)
+        return super().memory_bytes() + extra
+
+
+class ChromaVectorStore(VectorStore):
+    """Adapter over a Chroma collection (ephemeral in-process client unless one is given)."""
+
+    def __init__(self, name, client=None):
+        super().__init__(name)
+        if client is None:
+            # chromadb takes most of a second to import; only pay for it when this backend is used
+            import chromadb
+            from chromadb.config import Settings
+
+            client = chromadb.Client(Settings())
+        self.client = client
+        self.collection = client.get_or_create_collection(name=name)
+
+    @property
+    def max_batch_size(self):
+        """Largest add() batch the Chroma client accepts (API differs across versions)."""
+        if hasattr(self.client, "get_max_batch_size"):
+            return self.client.get_max_batch_size()
+        return getattr(self.client, "max_batch_size", None)
+
+    def add(self, ids, documents, embeddings, metadatas=None):
+        self.collection.add(
+            ids=list(ids),
+            documents=list(documents),
+            embeddings=np.asarray(embeddings, dtype=np.float32).tolist(),
+            metadatas=list(metadatas) if metadatas is not None else None,
+        )
+
+    def get(self, include=("documents", "metadatas")):
+        return self.collection.get(include=list(include))
+
+    def delete(self, ids):
+        self.collection.delete(ids=list(ids))
+
+    def count(self):
+        return self.collection.count()
+
+    def query(self, query_embeddings, n_results=10):
+        return self.collection.query(
+            query_embeddings=_as_batch(query_embeddings).tolist(), n_results=n_results
+        )
+
+
+VECTOR_BACKENDS = {
+    "numpy": NumpyVectorStore,
+    "ivf": IVFVectorStore,
+    "chroma": ChromaVectorStore,
+}
+
+
+def create_vector_store(backend, name, **options):
+    """A new store of the given backend ("numpy", "ivf" or "chroma")."""
+    try:
+        cls = VECTOR_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown vector backend {backend!r}; expected one of {sorted(VECTOR_BACKENDS)}")
+    return cls(name, **options)
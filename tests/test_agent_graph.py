@@ -0,0 +1,153 @@
+# tests/test_agent_graph.py
+import asyncio
+import threading
+import time
+
+from agent_graph import AgentGraph
+
+
+def call(agent):
+    return {"Agent": agent, "args": {"prompt": agent}}
+
+
+PLAN = [call("knowledge_agent"), call("sql_agent"), call("chart_agent"), call("summary_agent")]
+
+
+def test_dependencies_follow_declared_inputs():
+    graph = AgentGraph(PLAN)
+    assert graph.dependencies == {0: set(), 1: set(), 2: {1}, 3: {0, 1}}
+
+
+def test_dependents_start_after_their_inputs_and_receive_them():
+    events = []
+
+    async def run_node(agent_call, inputs):
+        agent = agent_call["Agent"]
+        events.append(("start", agent))
+        await asyncio.sleep(0.01 if agent == "sql_agent" else 0)
+        events.append(("end", agent))
+        return {"conversation": [agent], "query_result": f"{agent} rows", "inputs": inputs}
+
+    outputs = asyncio.run(AgentGraph(PLAN).arun(run_node))
+
+    for dependent, dependency in (("chart_agent", "sql_agent"), ("summary_agent", "knowledge_agent"), ("summary_agent", "sql_agent")):
+        assert events.index(("end", dependency)) < events.index(("start", dependent))
+    assert outputs[2]["inputs"] == {"query_result": ["sql_agent rows"]}
+    assert outputs[3]["inputs"] == {"conversation": [["knowledge_agent"], ["sql_agent"]]}
+    assert [o["conversation"] for o in outputs] == [[a["Agent"]] for a in PLAN]
+
+
+def test_failed_node_yields_empty_outputs_and_dependents_still_run():
+    async def run_node(agent_call, inputs):
+        if agent_call["Agent"] == "sql_agent":
+            raise RuntimeError("warehouse down")
+        return {"conversation": [agent_call["Agent"]], "inputs": inputs}
+
+    outputs = asyncio.run(AgentGraph(PLAN).arun(run_node))
+
+    assert outputs[1] == {}
+    assert outputs[2]["inputs"] == {"query_result": []}
+    assert outputs[3]["inputs"] == {"conversation": [["knowledge_agent"]]}
+
+
+def test_independent_nodes_run_concurrently_within_the_limit():
+    running, peak = 0, 0
+
+    async def run_node(agent_call, inputs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return {}
+
+    plan = [call("knowledge_agent"), call("sql_agent"), call("knowledge_agent")]
+    asyncio.run(AgentGraph(plan).arun(run_node))
+    assert peak == 3
+
+    peak = 0
+    asyncio.run(AgentGraph(plan).arun(run_node, max_concurrency=2))
+    assert peak == 2
+
+
+def test_sync_run_uses_worker_threads():
+    threads = set()
+    lock = threading.Lock()
+
+    def run_node(agent_call, inputs):
+        with lock:
+            threads.add(threading.current_thread().name)
+        time.sleep(0.02)
+        return {"conversation": [agent_call["Agent"]]}
+
+    outputs = AgentGraph(PLAN).run(run_node, max_workers=2)
+
+    assert [o["conversation"] for o in outputs] == [[a["Agent"]] for a in PLAN]
+    assert threading.current_thread().name not in threads
+
+
+def test_cancelling_the_run_cancels_nodes_in_flight():
+    started, cancelled, finished = [], [], []
+
+    async def run_node(agent_call, inputs):
+        started.append(agent_call["Agent"])
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(agent_call["Agent"])
+            raise
+        finished.append(agent_call["Agent"])
+        return {}
+
+    async def main():
+        run = asyncio.create_task(AgentGraph(PLAN).arun(run_node))
+        while len(started) < 2:
+            await asyncio.sleep(0)
+        run.cancel()  # e.g. the streaming client disconnected
+        try:
+            await run
+        except asyncio.CancelledError:
+            pass
+        # Checked before asyncio.run cancels whatever is left at shutdown
+        return run.cancelled(), sorted(cancelled)
+
+    assert asyncio.run(main()) == (True, ["knowledge_agent", "sql_agent"])
+    assert finished == []
+    # Dependents of the cancelled nodes never start
+    assert sorted(started) == ["knowledge_agent", "sql_agent"]
+
+
+def test_closing_a_stream_cancels_its_agents():
+    import router
+
+    cancelled = []
+
+    class Agents:
+        async def aexecute_agent_calls(self, agent_calls, question, on_event=None, session_id=None):
+            async def run_node(agent_call, inputs):
+                on_event({"event": "agent_started", "agent": agent_call["Agent"]})
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(agent_call["Agent"])
+                    raise
+                return {}
+
+            return await AgentGraph(agent_calls).arun(run_node)
+
+    async def plan(question, ask_user=None):
+        return question, PLAN[:2], None
+
+    r = router.Router.__new__(router.Router)
+    r.conversational_agent = Agents()
+    r.aplan_question = plan
+
+    async def main():
+        stream = r.astream_question("revenue?")
+        events = [await stream.__anext__() for _ in range(3)]
+        await stream.aclose()
+        return [e["event"] for e in events], sorted(cancelled)
+
+    events, stopped = asyncio.run(main())
+    assert events == ["plan", "agent_started", "agent_started"]
+    assert stopped == ["knowledge_agent", "sql_agent"]
@@ -0,0 +1,121 @@
+# tests/test_conversation_history.py
+import threading
+
+from conversation_buffer import ConversationBuffer
+from conversational_agent import ConversationalAgent
+from token_counter import count_tokens
+
+
+class StubSummarizer:
+    def __init__(self, release=None):
+        self.calls = []
+        self.release = release
+
+    def __call__(self, text):
+        self.calls.append(text)
+        if self.release is not None:
+            self.release.wait(5)
+        return "SUMMARY"
+
+    condense = __call__
+
+
+def words(n, label):
+    return " ".join(f"{label}{i}" for i in range(n))
+
+
+def test_long_entries_are_digested_to_the_entry_budget():
+    buffer = ConversationBuffer(entry_tokens=20)
+    buffer.add("\n".join(words(10, f"line{i}-") for i in range(30)))
+    assert buffer.entries[0]["tokens"] <= 30
+    assert "omitted" in buffer.entries[0]["text"]
+
+
+def test_compaction_folds_oldest_unpinned_entries_within_budget():
+    summarizer = StubSummarizer()
+    buffer = ConversationBuffer(max_tokens=40, entry_tokens=30, summary_tokens=10, summarizer=summarizer)
+    buffer.add("PINNED question", pinned=True)
+    for i in range(5):
+        buffer.add(words(8, f"turn{i}-"))
+
+    assert buffer.compact()
+
+    assert sum(e["tokens"] for e in buffer.entries) <= buffer.max_tokens
+    assert buffer.entries[0]["text"] == "PINNED question"
+    assert buffer.summary == "SUMMARY"
+    # Oldest turns went into the summary, newest stayed verbatim
+    assert "turn0-0" in summarizer.calls[0] and "turn4-0" not in summarizer.calls[0]
+    assert buffer.entries[-1]["text"].startswith("turn4-0")
+    assert not buffer.compact()  # within budget: nothing more to fold
+
+
+def test_summary_is_digested_without_a_summarizer_or_when_it_fails():
+    def failing(text):
+        raise RuntimeError("quota")
+
+    for summarizer in (None, failing):
+        buffer = ConversationBuffer(max_tokens=10, entry_tokens=50, summary_tokens=15, summarizer=summarizer)
+        buffer.extend([words(20, "a"), words(20, "b")])
+        buffer.compact()
+        assert buffer.summary and count_tokens(buffer.summary) <= 30
+
+
+def test_render_without_compaction_never_calls_the_summarizer():
+    summarizer = StubSummarizer()
+    buffer = ConversationBuffer(max_tokens=10, summarizer=summarizer)
+    buffer.extend([words(20, "a"), words(20, "b")])
+
+    assert "a0" in buffer.render(compact=False)
+    assert summarizer.calls == []
+    assert buffer.render().startswith("Earlier conversation (summary): SUMMARY")
+
+
+def make_agent(summarizer, max_sessions=None):
+    agent = ConversationalAgent("k", "https://example", "v", "emb", None, None, "k", "https://example", "v", "gpt")
+    agent.summary_agent = summarizer
+    if max_sessions is not None:
+        agent.max_sessions = max_sessions
+    return agent
+
+
+def test_sessions_are_isolated_and_none_has_no_history():
+    agent = make_agent(StubSummarizer())
+
+    agent._record_turn(agent.session_history("alice"), "alice question", {"Summary": "alice answer"})
+    agent._record_turn(agent.session_history("bob"), "bob question", {"Summary": "bob answer"})
+
+    alice = agent.session_history("alice").render(compact=False)
+    assert "alice question" in alice and "bob" not in alice
+    assert "alice" not in agent.session_history("bob").render(compact=False)
+    assert agent.session_history(None) is None
+
+
+def test_least_recently_used_sessions_are_evicted():
+    agent = make_agent(StubSummarizer(), max_sessions=2)
+    first = agent.session_history("a")
+    agent.session_history("b")
+    agent.session_history("a")  # a is now the most recently used
+    agent.session_history("c")
+
+    assert list(agent.sessions) == ["a", "c"]
+    assert agent.session_history("a") is first
+    agent.end_session("a")
+    assert "a" not in agent.sessions
+
+
+def test_turns_are_recorded_at_once_and_compacted_in_the_background():
+    release = threading.Event()
+    summarizer = StubSummarizer(release)
+    agent = make_agent(summarizer)
+    history = agent.session_history("s")
+    history.max_tokens = 20
+
+    for i in range(3):
+        agent._record_turn(history, words(10, f"q{i}-"), {"Summary": words(10, f"a{i}-")})
+
+    # The summarizer is blocked, yet recording returned and the history still renders
+    assert "q2-0" in history.render(compact=False)
+    release.set()
+    agent.compaction_pool.shutdown(wait=True)
+    assert summarizer.calls and history.summary == "SUMMARY"
+    assert sum(e["tokens"] for e in history.entries) <= history.max_tokens
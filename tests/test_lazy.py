@@ -0,0 +1,41 @@
+# tests/test_lazy.py
+import asyncio
+import threading
+import time
+
+from lazy import lazy_property, aload, is_loaded
+
+
+class Owner:
+    builds = 0
+
+    @lazy_property
+    def resource(self):
+        Owner.builds += 1
+        time.sleep(0.05)  # a blocking constructor, e.g. embedding an index
+        return threading.current_thread()
+
+
+def test_aload_builds_off_the_event_loop_once():
+    owner = Owner()
+    Owner.builds = 0
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while not is_loaded(owner, "resource"):
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticking = asyncio.create_task(ticker())
+        first, second = await asyncio.gather(aload(owner, "resource"), aload(owner, "resource"))
+        await ticking
+        return first, second, ticks
+
+    first, second, ticks = asyncio.run(main())
+    assert first is second is owner.resource
+    assert first is not threading.current_thread()
+    assert Owner.builds == 1
+    assert ticks > 1  # the loop kept running while the value was built
@@ -0,0 +1,142 @@
+# tests/test_lexical_index.py
+import asyncio
+
+import pytest
+
+from lexical_index import LexicalIndex, normalize_term, reciprocal_rank_fusion
+from knowledge_agent import KnowledgeAgent
+
+GLOSSARY = [
+    ("churn", "Churn: share of subscribers who cancel in a period.", {"term": "Churn"}),
+    ("mau", "MAU - monthly active users, each counted once per month.", {"aliases": "monthly actives, MAU"}),
+    ("retention", "Retention rate is the share of subscribers who stay subscribed.", None),
+    ("peacock", "Peacock is the streaming service.", None),
+    ("ad-load", "The ad load measures minutes of ads per hour of streaming.", None),
+]
+
+
+def glossary_index():
+    ids, documents, metadatas = zip(*GLOSSARY)
+    return LexicalIndex(ids, documents, metadatas)
+
+
+def ranked_ids(index, query, k=10):
+    return [index.ids[i] for i, _ in index.search(query, k)]
+
+
+def test_normalize_term_ignores_case_punctuation_and_leading_article():
+    assert normalize_term("  The Ad-Load? ") == "ad-load"
+    assert normalize_term("MAU") == "mau"
+    assert normalize_term("") == ""
+
+
+def test_exact_matches_glossary_terms_only():
+    index = glossary_index()
+    assert [index.ids[i] for i in index.exact("Churn")] == ["churn"]
+    assert [index.ids[i] for i in index.exact("the churn?")] == ["churn"]
+    assert [index.ids[i] for i in index.exact("churns")] == ["churn"]  # plural s
+    assert [index.ids[i] for i in index.exact("monthly actives")] == ["mau"]  # metadata alias
+    assert [index.ids[i] for i in index.exact("retention rate")] == ["retention"]  # "X is ..." prefix
+    assert index.exact("what is churn") == []
+    assert index.exact("subscribers") == []
+    assert index.exact("") == []
+
+
+def test_bm25_ranks_documents_matching_more_query_terms_first():
+    index = glossary_index()
+    assert ranked_ids(index, "subscribers who cancel") == ["churn", "retention"]
+    assert ranked_ids(index, "streaming") == ["peacock", "ad-load"]  # same tf, shorter document first
+    assert ranked_ids(index, "streaming", k=1) == ["peacock"]
+
+
+def test_bm25_weights_term_frequency_and_rarity():
+    index = LexicalIndex(
+        ["once", "twice", "rare"],
+        ["revenue report", "revenue revenue report", "report about margins"],
+    )
+    assert ranked_ids(index, "revenue") == ["twice", "once"]
+    # "margins" appears in one document, "report" in all three
+    assert ranked_ids(index, "report margins")[0] == "rare"
+    scores = dict(index.search("report margins"))
+    assert scores[index.positions["rare"]] > 2 * scores[index.positions["once"]]
+
+
+def test_bm25_ignores_stopwords_and_unknown_tokens():
+    index = glossary_index()
+    assert index.search("what is the") == []
+    assert index.search("zzz") == []
+    assert LexicalIndex([], []).search("churn") == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=1)
+    assert [item for item, _ in fused] == ["a", "c", "b"]
+    assert dict(fused) == pytest.approx({"a": 1 / 2 + 1 / 3, "c": 1 / 4 + 1 / 2, "b": 1 / 3})
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_results_are_shaped_like_a_chroma_query():
+    index = glossary_index()
+    results = index.results([1, 0], scores=[2.0, 1.0])
+    assert results["ids"] == [["mau", "churn"]]
+    assert results["documents"][0][1] == GLOSSARY[0][1]
+    assert results["metadatas"] == [[GLOSSARY[1][2], GLOSSARY[0][2]]]
+    assert results["scores"] == [[2.0, 1.0]]
+
+
+class StubCollection:
+    """Vector store returning a fixed ranking."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.queries = []
+
+    def query(self, query_embeddings, n_results):
+        self.queries.append(n_results)
+        documents = {doc_id: (doc, meta) for doc_id, doc, meta in GLOSSARY}
+        ids = self.ids[:n_results]
+        return {
+            "ids": [ids],
+            "documents": [[documents[i][0] for i in ids]],
+            "metadatas": [[documents[i][1] for i in ids]],
+        }
+
+
+def knowledge_agent(vector_ids, lexical=True):
+    agent = KnowledgeAgent.__new__(KnowledgeAgent)
+    agent.lexical_index = glossary_index() if lexical else None
+    agent.main_collection = StubCollection(vector_ids)
+    agent.embedded = []
+
+    async def agenerate_embeddings(texts, priority=None):
+        agent.embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    agent.agenerate_embeddings = agenerate_embeddings
+    return agent
+
+
+def test_exact_term_short_circuits_embedding_and_vector_search():
+    agent = knowledge_agent(["peacock"])
+    results = asyncio.run(agent.aquery_knowledge_base("Churn", top_k=3))
+    assert results["ids"] == [["churn"]]
+    assert agent.embedded == []
+    assert agent.main_collection.queries == []
+
+
+def test_other_queries_fuse_bm25_and_vector_rankings():
+    agent = knowledge_agent(["peacock", "retention"])
+    results = asyncio.run(agent.aquery_knowledge_base("subscribers who stay", top_k=2))
+    assert agent.embedded == ["subscribers who stay"]
+    assert agent.main_collection.queries == [KnowledgeAgent.fusion_candidates]
+    # retention is ranked by both lists, churn by BM25 only
+    assert results["ids"][0][0] == "retention"
+    assert results["documents"][0][0] == GLOSSARY[2][1]
+    assert len(results["ids"][0]) == 2
+
+
+def test_without_a_lexical_index_queries_go_to_the_vector_store():
+    agent = knowledge_agent(["peacock", "retention"], lexical=False)
+    results = asyncio.run(agent.aquery_knowledge_base("churn", top_k=2))
+    assert results["ids"] == [["peacock", "retention"]]
+    assert agent.main_collection.queries == [2]
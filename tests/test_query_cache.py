@@ -0,0 +1,151 @@
+# tests/test_query_cache.py
+import os
+import pandas as pd
+import pytest
+
+import query_cache
+from query_cache import QueryResultCache, normalize_sql, dataframe_bytes
+from query_executor import SQLiteExecutor
+
+QUERY = "SELECT show, SUM(hours) AS hours FROM Views GROUP BY show ORDER BY show"
+
+
+@pytest.fixture
+def executor():
+    executor = SQLiteExecutor()
+    executor.load_table(
+        "Views", pd.DataFrame({"show": ["a", "b", "a", "c"], "hours": [1.0, 2.0, 3.0, 4.0]})
+    )
+    return executor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_miss_then_hit(tmp_path, executor):
+    cache = QueryResultCache(directory=str(tmp_path))
+    assert cache.get(executor.project_id, QUERY) is None
+
+    result = executor.run(QUERY)
+    cache.put(executor.project_id, QUERY, result)
+    cached = cache.get(executor.project_id, QUERY)
+
+    pd.testing.assert_frame_equal(cached, result)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_hit_returns_a_copy(tmp_path, executor):
+    cache = QueryResultCache(directory=str(tmp_path))
+    cache.put(executor.project_id, QUERY, executor.run(QUERY))
+
+    hit = cache.get(executor.project_id, QUERY)
+    hit["hours"] = 0
+    assert cache.get(executor.project_id, QUERY)["hours"].sum() == 10.0
+
+
+def test_keyed_by_project(tmp_path, executor):
+    cache = QueryResultCache(directory=str(tmp_path))
+    cache.put("project-a", QUERY, executor.run(QUERY))
+    assert cache.get("project-b", QUERY) is None
+
+
+def test_reloaded_from_disk(tmp_path, executor):
+    QueryResultCache(directory=str(tmp_path)).put(executor.project_id, QUERY, executor.run(QUERY))
+
+    restarted = QueryResultCache(directory=str(tmp_path))
+    pd.testing.assert_frame_equal(restarted.get(executor.project_id, QUERY), executor.run(QUERY))
+
+
+def test_ttl_expiry(tmp_path, executor, clock):
+    cache = QueryResultCache(directory=str(tmp_path), ttl_seconds=60)
+    cache.put(executor.project_id, QUERY, executor.run(QUERY))
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (clock[0], clock[0]))
+
+    clock[0] += 30
+    assert cache.get(executor.project_id, QUERY) is not None
+
+    clock[0] += 31
+    assert cache.get(executor.project_id, QUERY) is None
+    assert cache.stats()["entries"] == 0
+    assert not any(name.endswith(".parquet") for name in os.listdir(tmp_path))
+
+
+def test_memory_eviction_is_lru_and_byte_bounded(executor):
+    frames = {
+        f"SELECT * FROM Views WHERE hours > {i}": executor.run(f"SELECT * FROM Views WHERE hours > {i}")
+        for i in range(3)
+    }
+    largest = max(dataframe_bytes(df) for df in frames.values())
+    cache = QueryResultCache(directory=None, max_memory_bytes=2 * largest)
+    first, second, third = frames
+
+    cache.put("p", first, frames[first])
+    cache.put("p", second, frames[second])
+    cache.get("p", first)  # first is now the most recently used
+    cache.put("p", third, frames[third])
+
+    assert cache.memory_bytes <= cache.max_memory_bytes
+    assert cache.get("p", second) is None
+    assert cache.get("p", first) is not None
+    assert cache.get("p", third) is not None
+
+
+def test_oversized_result_not_kept_in_memory(executor):
+    result = executor.run(QUERY)
+    cache = QueryResultCache(directory=None, max_memory_bytes=dataframe_bytes(result) - 1)
+    cache.put("p", QUERY, result)
+    assert cache.get("p", QUERY) is None
+    assert cache.memory_bytes == 0
+
+
+def test_disk_eviction_removes_oldest(tmp_path, executor):
+    cache = QueryResultCache(directory=str(tmp_path), max_disk_bytes=10**9)
+    queries = [f"SELECT * FROM Views WHERE hours > {i}" for i in range(3)]
+    for age, query in zip((300, 200, 100), queries):
+        cache.put("p", query, executor.run(query))
+        path = cache._path(cache.key("p", query))
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+
+    sizes = sorted(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    cache.max_disk_bytes = sum(sizes[-2:])
+    cache._evict_disk()
+
+    remaining = set(os.listdir(tmp_path))
+    assert os.path.basename(cache._path(cache.key("p", queries[0]))) not in remaining
+    assert len(remaining) == 2
+
+
+def test_equivalent_queries_share_an_entry(tmp_path, executor):
+    cache = QueryResultCache(directory=str(tmp_path))
+    cache.put(executor.project_id, QUERY, executor.run(QUERY))
+    variant = """
+        select show, sum(hours) as hours  -- total per show
+        FROM Views
+        group BY show order by show;
+    """
+    assert cache.get(executor.project_id, variant) is not None
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("SELECT  a,\n\tb FROM t;", "select a, b from t"),
+        ("SELECT 1 /* note */ -- trailing\n", "select 1"),
+        ("SELECT * FROM t WHERE name = 'It''s  UPPER'", "select * from t where name = 'It''s  UPPER'"),
+        ("SELECT COUNT(*) FROM `Proj.DataSet.Table`", "select count(*) from `Proj.DataSet.Table`"),
+        ("SELECT Show_Name FROM Views", "select Show_Name from Views"),
+    ],
+)
+def test_normalize_sql(query, expected):
+    assert normalize_sql(query) == expected
+
+
+def test_identifier_case_is_significant():
+    # BigQuery table and dataset names are case-sensitive
+    assert normalize_sql("SELECT * FROM ds.Events") != normalize_sql("SELECT * FROM ds.events")
+    assert normalize_sql("SELECT * FROM `p.DS.t`") != normalize_sql("SELECT * FROM `p.ds.t`")
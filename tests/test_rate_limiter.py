@@ -0,0 +1,115 @@
+# tests/test_rate_limiter.py
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import (
+    DeploymentLimiter,
+    RateLimiter,
+    RateLimitTimeout,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_DEFAULT,
+    PRIORITY_BULK,
+)
+
+
+class TooManyRequests(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after_ms):
+        super().__init__("429 Too Many Requests")
+        self.headers = {"retry-after-ms": str(retry_after_ms)}
+
+
+def test_callers_are_served_in_priority_then_arrival_order():
+    limiter = DeploymentLimiter("gpt", requests_per_minute=600)  # one request every 0.1s
+    limiter.requests.level = 0
+    served = []
+
+    async def call(name, priority):
+        await limiter.aacquire(1, priority)
+        served.append(name)
+
+    async def main():
+        await asyncio.gather(
+            call("bulk", PRIORITY_BULK),
+            call("default-1", PRIORITY_DEFAULT),
+            call("interactive", PRIORITY_INTERACTIVE),
+            call("default-2", PRIORITY_DEFAULT),
+        )
+
+    asyncio.run(main())
+    assert served == ["interactive", "default-1", "default-2", "bulk"]
+    assert limiter._waiters == []
+
+
+def test_settle_refunds_unused_tokens_and_charges_overruns():
+    limiter = DeploymentLimiter("gpt", tokens_per_minute=6000)
+    reservation = limiter.acquire(4000)
+    assert limiter.tokens.level == pytest.approx(2000, abs=5)
+
+    reservation.settle(1000)  # used less than estimated: 3000 back
+    assert limiter.tokens.level == pytest.approx(5000, abs=5)
+    reservation.settle(None)  # no usage reported: the estimate stands
+    assert limiter.tokens.level == pytest.approx(5000, abs=5)
+
+    reservation.settle(9000)  # overran by 8000: the bucket goes into debt
+    assert limiter.tokens.level == pytest.approx(-3000, abs=5)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(1, timeout=0.05)
+    assert limiter._waiters == []
+
+
+def test_estimates_above_capacity_are_clamped_to_a_full_bucket():
+    limiter = DeploymentLimiter("gpt", tokens_per_minute=1000)
+    reservation = limiter.acquire(50000, timeout=0.05)
+    assert reservation.tokens == 1000
+
+
+def test_a_429_pauses_the_deployment_for_retry_after():
+    rate_limiter = RateLimiter()
+
+    with pytest.raises(TooManyRequests):
+        with rate_limiter.reserve("gpt", 10):
+            raise TooManyRequests(retry_after_ms=200)
+
+    limiter = rate_limiter.get("gpt")
+    assert limiter.paused_until > time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(10, timeout=0.05)
+
+    started = time.monotonic()
+
+    async def main():
+        async with rate_limiter.areserve("gpt", 10):
+            pass
+
+    asyncio.run(main())
+    assert 0.1 <= time.monotonic() - started < 1.0
+
+
+def test_sync_acquire_on_an_event_loop_raises_instead_of_blocking():
+    limiter = DeploymentLimiter("gpt", requests_per_minute=60)
+    limiter.requests.level = 0
+
+    async def main():
+        waiter = asyncio.create_task(limiter.aacquire(1))
+        await asyncio.sleep(0)  # the async caller is queued ahead
+        with pytest.raises(RuntimeError, match="aacquire"):
+            limiter.acquire(1)
+        assert len(limiter._waiters) == 1  # only the async caller is left queued
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(main())
+    assert limiter._waiters == []
+
+
+def test_sync_acquire_on_an_event_loop_takes_free_quota():
+    limiter = DeploymentLimiter("gpt", requests_per_minute=60)
+
+    async def main():
+        return limiter.acquire(1)
+
+    assert asyncio.run(main()).tokens == 1
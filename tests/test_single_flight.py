@@ -0,0 +1,143 @@
+# tests/test_single_flight.py
+import asyncio
+import threading
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Work:
+    """A coroutine function that blocks until released and counts its calls."""
+
+    def __init__(self, result="answer", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = None
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def bind(self):
+        self.started, self.release = asyncio.Event(), asyncio.Event()
+        return self
+
+
+def test_followers_share_the_leaders_result():
+    async def main():
+        flight, work = SingleFlight("test"), Work().bind()
+        calls = [asyncio.create_task(flight.ado("key", work)) for _ in range(3)]
+        await work.started.wait()
+        work.release.set()
+        return await asyncio.gather(*calls), work.calls, flight.stats()
+
+    results, calls, stats = asyncio.run(main())
+    assert results == [("answer", False), ("answer", True), ("answer", True)]
+    assert calls == 1
+    assert stats["in_flight"] == 0 and stats["deduplicated"] == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight, work = SingleFlight("test"), Work().bind()
+        leader = asyncio.create_task(flight.ado("key", work))
+        await work.started.wait()
+        followers = [asyncio.create_task(flight.ado("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        leader.cancel()  # e.g. the leader's client closed its stream
+        await asyncio.sleep(0)
+        work.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers), work.calls
+
+    results, calls = asyncio.run(main())
+    assert results == [("answer", True), ("answer", True)]
+    assert calls == 1
+
+
+def test_cancelled_follower_detaches_alone():
+    async def main():
+        flight, work = SingleFlight("test"), Work().bind()
+        leader = asyncio.create_task(flight.ado("key", work))
+        await work.started.wait()
+        quitter = asyncio.create_task(flight.ado("key", work))
+        stayer = asyncio.create_task(flight.ado("key", work))
+        await asyncio.sleep(0)
+
+        quitter.cancel()
+        await asyncio.sleep(0)
+        work.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await quitter
+        return await leader, await stayer
+
+    assert asyncio.run(main()) == (("answer", False), ("answer", True))
+
+
+def test_exceptions_are_shared():
+    async def main():
+        flight, work = SingleFlight("test"), Work(error=ValueError("boom")).bind()
+        calls = [asyncio.create_task(flight.ado("key", work)) for _ in range(2)]
+        await work.started.wait()
+        work.release.set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, ValueError) and str(e) == "boom" for e in errors)
+
+
+def test_followers_retry_when_the_call_itself_is_cancelled():
+    async def main():
+        flight, work = SingleFlight("test"), Work().bind()
+        leader = asyncio.create_task(flight.ado("key", work))
+        await work.started.wait()
+        follower = asyncio.create_task(flight.ado("key", work))
+        await asyncio.sleep(0)
+
+        # e.g. the loop running the call shuts down
+        (call,) = flight._tasks
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # The follower inherits no cancellation: it leads a new call
+        work.release.set()
+        return await follower, work.calls
+
+    result, calls = asyncio.run(main())
+    assert result == ("answer", False)
+    assert calls == 2
+
+
+def test_sync_callers_share_one_call():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", work)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("key", work)))
+    follower.start()
+    while flight.stats()["deduplicated"] == 0:
+        pass
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert sorted(results) == [("answer", False), ("answer", True)]
+    assert len(calls) == 1
@@ -0,0 +1,91 @@
+# tests/test_sql_preflight.py
+import json
+import pandas as pd
+import pytest
+
+from query_cache import QueryResultCache
+from query_executor import SQLiteExecutor
+from sql_agent import SQLAgent
+from sql_preflight import SQLPreflight
+
+QUERY = "SELECT show, hours FROM views WHERE hours > 1"
+
+
+@pytest.fixture
+def executor():
+    executor = SQLiteExecutor()
+    executor.load_table("views", pd.DataFrame({"show": [f"show {i}" for i in range(500)], "hours": range(500)}))
+    return executor
+
+
+@pytest.fixture
+def table_bytes(executor):
+    return executor.dry_run("SELECT * FROM views")["bytes_processed"]
+
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch, executor):
+    # SQLAgent reads its schema and samples from ../data, relative to the working directory
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "sql_schema.txt").write_text("views: show STRING, hours INT64")
+    (tmp_path / "data" / "sample_queries.json").write_text("[]")
+    (tmp_path / "src").mkdir()
+    monkeypatch.chdir(tmp_path / "src")
+
+    def make_agent(max_bytes):
+        preflight = SQLPreflight(executor, max_bytes=max_bytes, log_path=str(tmp_path / "estimates.jsonl"))
+        return SQLAgent(
+            "key", "https://example", "v", "gpt",
+            executor=executor,
+            query_cache=QueryResultCache(directory=None),
+            preflight=preflight,
+        )
+
+    return make_agent
+
+
+def test_over_budget_query_is_rejected_without_running(make_agent, executor, table_bytes):
+    agent = make_agent(max_bytes=table_bytes // 2)
+
+    result = agent.send_query(QUERY)
+
+    assert isinstance(result, str) and result.startswith("Preflight Error:")
+    assert "views" in result
+    assert executor.queries_run == 0
+    assert agent.preflight.stats()["rejected"] == 1
+
+
+def test_limit_does_not_lower_the_estimate(executor, table_bytes):
+    preflight = SQLPreflight(executor, max_bytes=table_bytes // 2, log_path=None)
+    check = preflight.check(QUERY + " LIMIT 5")
+    assert check["action"] == "rejected"
+    assert check["estimate"]["bytes_processed"] == table_bytes
+
+
+def test_under_budget_query_runs_and_records_actual_cost(make_agent, executor, table_bytes, tmp_path):
+    agent = make_agent(max_bytes=table_bytes * 2)
+
+    result = agent.send_query(QUERY)
+
+    assert isinstance(result, pd.DataFrame) and len(result) == 498
+    assert executor.queries_run == 1
+    (record,) = agent.preflight.records
+    assert record["action"] == "ok"
+    assert record["estimated_bytes"] == table_bytes
+    assert record["tables"] == ["views"]
+    assert record["rows"] == 498 and record["seconds"] >= 0
+    logged = [json.loads(line) for line in (tmp_path / "estimates.jsonl").read_text().splitlines()]
+    assert logged == [record]
+
+
+def test_cached_result_skips_the_dry_run(make_agent, executor, table_bytes):
+    agent = make_agent(max_bytes=table_bytes * 2)
+    dry_runs = []
+    estimate = agent.preflight.estimate
+    agent.preflight.estimate = lambda query: dry_runs.append(query) or estimate(query)
+
+    agent.send_query(QUERY)
+    agent.send_query(QUERY)
+
+    assert len(dry_runs) == 1
+    assert executor.queries_run == 1
@@ -0,0 +1,56 @@
+# tests/test_vector_snapshot.py
+import json
+import os
+import numpy as np
+import pytest
+
+from vector_snapshot import (
+    EMBEDDINGS_FILE,
+    RECORDS_FILE,
+    load_snapshot,
+    save_snapshot,
+    snapshot_exists,
+)
+
+
+def corpus(n, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, 8))
+    return [f"id{i}" for i in range(n)], vectors, [f"doc {i}" for i in range(n)], [{"i": i} for i in range(n)]
+
+
+def test_round_trip_is_normalized_and_memory_mapped(tmp_path):
+    ids, vectors, documents, metadatas = corpus(5)
+    save_snapshot(str(tmp_path), ids, vectors, documents, metadatas)
+
+    data = load_snapshot(str(tmp_path))
+    assert isinstance(data["embeddings"], np.memmap)
+    assert data["normalized"] and data["ids"] == ids and data["documents"] == documents
+    np.testing.assert_allclose(np.linalg.norm(data["embeddings"], axis=1), 1, atol=1e-6)
+
+
+def test_resave_publishes_a_new_version_and_removes_the_old(tmp_path):
+    save_snapshot(str(tmp_path), *corpus(5))
+    mapped = load_snapshot(str(tmp_path))["embeddings"]
+    save_snapshot(str(tmp_path), *corpus(3, seed=1))
+
+    assert len(load_snapshot(str(tmp_path))["ids"]) == 3
+    assert len(os.listdir(tmp_path)) == 3  # manifest + one embeddings/records pair
+    assert mapped.shape == (5, 8)  # an open mapping survives the swap
+
+
+def test_legacy_layout_still_loads(tmp_path):
+    ids, vectors, documents, metadatas = corpus(2)
+    np.save(tmp_path / EMBEDDINGS_FILE, vectors.astype(np.float32))
+    (tmp_path / RECORDS_FILE).write_text(json.dumps({"ids": ids, "documents": documents, "metadatas": metadatas}))
+
+    assert snapshot_exists(str(tmp_path))
+    assert load_snapshot(str(tmp_path))["ids"] == ids
+
+
+def test_mismatched_files_are_rejected(tmp_path):
+    ids, vectors, documents, metadatas = corpus(3)
+    np.save(tmp_path / EMBEDDINGS_FILE, vectors.astype(np.float32))
+    (tmp_path / RECORDS_FILE).write_text(json.dumps({"ids": ids[:2], "documents": documents, "metadatas": metadatas}))
+
+    with pytest.raises(ValueError):
+        load_snapshot(str(tmp_path))
@@ -0,0 +1,96 @@
+# tests/test_vector_store.py
+import threading
+
+import numpy as np
+import pytest
+
+from vector_store import create_vector_store
+
+
+def clustered_corpus(n=600, dims=16, clusters=8, seed=0):
+    """Points scattered around a few random directions, like topical documents."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dims))
+    points = centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dims))
+    queries = centers[rng.integers(clusters, size=20)] + 0.3 * rng.normal(size=(20, dims))
+    return points.astype(np.float32), queries.astype(np.float32)
+
+
+def filled(backend, embeddings, **options):
+    store = create_vector_store(backend, "test", **options)
+    ids = [f"doc{i}" for i in range(len(embeddings))]
+    store.add(ids, [f"text of {i}" for i in ids], embeddings)
+    return store
+
+
+def test_ivf_probing_every_list_matches_exact_search():
+    embeddings, queries = clustered_corpus()
+    exact = filled("numpy", embeddings).query(queries, n_results=10)
+    ivf = filled("ivf", embeddings, n_lists=8, n_probe=8, min_train_size=100)
+    approximate = ivf.query(queries, n_results=10)
+
+    assert ivf.centroids is not None
+    assert approximate["ids"] == exact["ids"]
+    assert np.allclose(approximate["distances"], exact["distances"], atol=1e-5)
+
+
+def test_ivf_recall_with_few_probes():
+    embeddings, queries = clustered_corpus()
+    exact = filled("numpy", embeddings).query(queries, n_results=10)["ids"]
+    approximate = filled("ivf", embeddings, n_lists=8, n_probe=2, min_train_size=100).query(queries, 10)["ids"]
+    recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)])
+    assert recall >= 0.9
+
+
+def test_ivf_searches_small_corpora_exhaustively_and_retrains_after_changes():
+    embeddings, queries = clustered_corpus()
+    small = filled("ivf", embeddings[:50], min_train_size=100)
+    assert small.query(queries, 5)["ids"] == filled("numpy", embeddings[:50]).query(queries, 5)["ids"]
+    assert small.centroids is None
+
+    store = filled("ivf", embeddings, n_lists=8, min_train_size=100)
+    store.query(queries[0], 1)
+    trained = store.centroids
+    store.add(["new"], ["text of new"], queries[:1])
+    assert store.query(queries[0], 1)["ids"] == [["new"]]
+    assert store.centroids is not trained
+    store.delete(["new"])
+    assert "new" not in store.query(queries[0], 5)["ids"][0]
+
+
+@pytest.mark.parametrize("backend,options", [("numpy", {}), ("ivf", {"n_lists": 16, "min_train_size": 500})])
+def test_concurrent_adds_deletes_and_queries_stay_consistent(backend, options):
+    rng = np.random.default_rng(1)
+    store = filled(backend, rng.normal(size=(600, 16)).astype(np.float32), **options)
+    errors = []
+
+    def writer(w):
+        writer_rng = np.random.default_rng(100 + w)
+        for batch in range(30):
+            ids = [f"w{w}-{batch}-{i}" for i in range(10)]
+            store.add(ids, [f"text of {i}" for i in ids], writer_rng.normal(size=(10, 16)))
+            if batch % 3 == 0:
+                store.delete(ids[:2])
+
+    def reader(r):
+        reader_rng = np.random.default_rng(200 + r)
+        try:
+            for _ in range(100):
+                results = store.query(reader_rng.normal(size=(4, 16)), 5)
+                for ids, documents in zip(results["ids"], results["documents"]):
+                    assert len(ids) == 5
+                    assert documents == [f"text of {i}" for i in ids]
+        except Exception as e:  # surfaced below; a thread's assert would be lost
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)]
+    threads += [threading.Thread(target=reader, args=(r,)) for r in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = 600 + 4 * 30 * 10 - 4 * 10 * 2
+    assert store.count() == len(store.matrix) == len(store.positions) == expected
+    assert all(store.ids[row] == doc_id for doc_id, row in store.positions.items())